@@ -18,12 +18,14 @@ import argparse
 import logging
 import os
 import re
+import subprocess
 import sys
 
 from distutils.version import LooseVersion
 
 from refresh_source import Refresher
 from spinnaker.run import run_quick
+from tag_index import TagIndex
 
 
 class CommitTag:
@@ -74,6 +76,52 @@ class CommitMessage:
   def msg(self):
     return self.__msg
 
+def iter_commit_messages(path, revision_range):
+  """Yields a CommitMessage for each commit in a range, most recent first.
+
+  The history is streamed from a single 'git log -z' process and parsed
+  as it arrives, so a caller that stops iterating early does not pay for
+  reading the rest of the history. Close the generator to stop git.
+
+  Args:
+    path [string]: Path to the git repository.
+    revision_range [string]: The git revision range to log.
+  """
+  process = subprocess.Popen(
+      ['git', '-C', path, 'log', '-z', '--format=%H%n%B', revision_range],
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+  try:
+    fd = process.stdout.fileno()
+    pending = ''
+    while True:
+      chunk = os.read(fd, 65536)
+      if not chunk:
+        break
+      records = (pending + chunk).split('\0')
+      pending = records.pop()
+      for record in records:
+        yield _parse_commit_record(record)
+    if pending.strip():
+      yield _parse_commit_record(pending)
+
+    error = process.stderr.read()
+    if process.wait() != 0:
+      raise IOError('git log {range} failed in {path}: {error}'.format(
+          range=revision_range, path=path, error=error.strip()))
+  finally:
+    if process.returncode is None:
+      process.kill()
+      process.wait()
+    process.stdout.close()
+    process.stderr.close()
+
+
+def _parse_commit_record(record):
+  """Returns the CommitMessage for a '%H%n%B' formatted git log record."""
+  hash, _, msg = record.lstrip('\n').partition('\n')
+  return CommitMessage(hash, msg)
+
+
 class VersionBump:
   """Provides a model for a semantic version bump.
   """
@@ -152,6 +200,7 @@ class Annotator(object):
     self.__branch = options.branch
     self.__build_number = options.build_number or os.environ.get('BUILD_NUMBER', '0')
     self.__force_rebuild = options.force_rebuild
+    self.__tag_index = None
     self.__tags_to_delete = []
     self.__filtered_tags = []
     self.__current_version = None
@@ -188,15 +237,15 @@ class Annotator(object):
     build/publish task.
 
     One of the lists will be used to determine the next semantic version
-    for out tag pattern (self.__filtered_tags).
+    for out tag pattern (self.__filtered_tags). This list is ordered by
+    descending semantic version.
     """
-    tag_ref_result = run_quick('git -C {path} show-ref --tags'
-                                   .format(path=self.path),
-                               echo=False)
-    ref_lines = tag_ref_result.stdout.strip().split('\n')
-    hash_tags = [CommitTag(s) for s in ref_lines]
-    self.__filtered_tags = [ht for ht in hash_tags if self.TAG_MATCHER.match(ht.tag)]
-    self.__tags_to_delete = [ht for ht in hash_tags if not self.TAG_MATCHER.match(ht.tag)]
+    self.__tag_index = TagIndex(self.path)
+    matching, other = self.__tag_index.partition(self.TAG_MATCHER)
+    self.__filtered_tags = [
+        CommitTag('{hash} refs/tags/{tag}'.format(hash=hash, tag=tag))
+        for tag, hash in matching]
+    self.__tags_to_delete = [tag for tag, _ in other]
 
   def parse_git_tree(self):
     self.__partition_tags_on_pattern()
@@ -261,9 +310,7 @@ class Annotator(object):
     """
     print ('Deleting {0} unwanted git tags locally from {1}'
            .format(len(self.__tags_to_delete), self.path))
-    for bad_hash_tag in self.__tags_to_delete:
-      run_quick('git -C {path} tag -d {tag}'
-                .format(path=self.path, tag=bad_hash_tag.tag), echo=False)
+    self.__tag_index.delete_tags(self.__tags_to_delete)
 
   def checkout_branch(self):
     """Checks out a branch.
@@ -293,12 +340,11 @@ class Annotator(object):
     """Determines and stores the current (latest) semantic version from
     'version-X.Y.Z' tags.
     """
-    sorted_filtered_tags = sorted(self.__filtered_tags,
-                                  key=lambda ht: ht.version, reverse=True)
-    if len(sorted_filtered_tags) == 0:
+    if len(self.__filtered_tags) == 0:
       raise GitTagMissingException("No version tags of the form 'version-X.Y.Z'.")
 
-    self.__current_version = sorted_filtered_tags[0]
+    # The tag index already sorted these by descending version.
+    self.__current_version = self.__filtered_tags[0]
 
   def determine_new_tag(self):
     """Determines the next semver tag for the repository at the path.
@@ -317,21 +363,14 @@ class Annotator(object):
     if self.__next_tag:
       return VersionBump(self.__next_tag, self.get_head_commit())
 
-    # 'git log' entries of the form '$hash $commit_title'
-    log_onelines = run_quick('git -C {path} log --pretty=oneline'.format(path=self.path),
-                             echo=False).stdout.strip().split('\n')
-    commit_hashes = [line.split(' ')[0].strip() for line in log_onelines]
-
-    # Full commit messages, including bodies for finding 'BREAKING CHANGE:'.
-    msgs = [
-      run_quick('git -C {path} log -n 1 --pretty=medium {hash}'.format(path=self.path, hash=h),
-                echo=False).stdout.strip() for h in commit_hashes
-    ]
-
-    if len(commit_hashes) != len(msgs):
-      raise IOError('Git commit hash list and commit message list are unequal sizes.')
-
-    return self.bump_semver(self.__current_version, commit_hashes, msgs)
+    # Only the commits since the current version can affect the bump.
+    commits = iter_commit_messages(
+        self.path, '{hash}..HEAD'.format(hash=self.__current_version.hash))
+    try:
+      return self.bump_semver_from_commits(
+          self.__current_version, commits, self.get_head_commit())
+    finally:
+      commits.close()
 
   def bump_semver(self, curr_version, commit_hashes, commit_msgs):
     """Determines the semver version bump based on commit messages in 'git log'.
@@ -347,14 +386,40 @@ class Annotator(object):
 
       commit_msgs [String list]: List of ordered, full commit messages.
 
+    Returns:
+      [VersionBump]: Next semantic version tag to be used, along with what type
+      of version bump it was.
+    """
+    commits = [CommitMessage(hash, msg)
+               for hash, msg in zip(commit_hashes, commit_msgs)]
+    return self.bump_semver_from_commits(curr_version, commits)
+
+  def bump_semver_from_commits(self, curr_version, commits,
+                               head_commit_hash=None):
+    """Determines the semver version bump from a sequence of commits.
+
+    The commits are consumed lazily and no more are read once a breaking
+    change is found.
+
+    Args:
+      curr_version [CommitTag]: Latest 'version-X.Y.Z' tag/commit hash pair
+      calcluated by semver sort.
+
+      commits [CommitMessage iterable]: Commits ordered most recent first.
+      Iteration stops at the commit for curr_version if it is present.
+
+      head_commit_hash [String]: The commit hash at HEAD. If None then this
+      is the first of the commits.
+
     Returns:
       [VersionBump]: Next semantic version tag to be used, along with what type
       of version bump it was.
     """
     # Commits are output from 'git log ...' ordered most recent to least.
-    commits_iter = iter([CommitMessage(hash, msg) for hash, msg in zip(commit_hashes, commit_msgs)])
+    commits_iter = iter(commits)
     commit = next(commits_iter, None)
-    head_commit_hash = commit.hash
+    if head_commit_hash is None:
+      head_commit_hash = commit.hash
 
     feat_matcher = re.compile('feat\(.*\)*')
     bc_matcher = re.compile('BREAKING CHANGE')
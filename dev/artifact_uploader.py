@@ -0,0 +1,255 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Uploads build artifacts over pooled keep-alive HTTP connections.
+
+Files are streamed from disk in chunks rather than read into memory. The
+SHA-1 and SHA-256 checksums are sent as X-Checksum-Sha1 and X-Checksum-Sha2
+headers, verified against what was actually streamed, and compared with
+checksums the server echoes back. Transient failures (connection errors,
+429 and 5xx responses) are retried with exponential backoff.
+"""
+
+import hashlib
+import httplib
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import urlparse
+
+
+CHUNK_SIZE = 64 * 1024
+RETRYABLE_STATUS_CODES = [408, 429, 500, 502, 503, 504]
+
+
+class UploadError(Exception):
+  """An upload failed with an HTTP error response or could not be sent.
+
+  Attributes:
+    url: The url being uploaded to.
+    code: The HTTP status code, or None if there was no response.
+    body: The response body, or a description of the connection error.
+  """
+
+  def __init__(self, url, code, body):
+    super(UploadError, self).__init__(
+        '{code}: Upload to {url} failed\n{body}'.format(
+            code=code if code is not None else 'No response',
+            url=url, body=body))
+    self.url = url
+    self.code = code
+    self.body = body
+
+
+class ChecksumError(Exception):
+  """The uploaded content did not match the file's checksums."""
+  pass
+
+
+def compute_checksums(path):
+  """Returns the (sha1, sha256) hex digests of a file's content."""
+  sha1 = hashlib.sha1()
+  sha256 = hashlib.sha256()
+  with open(path, 'rb') as f:
+    while True:
+      chunk = f.read(CHUNK_SIZE)
+      if not chunk:
+        break
+      sha1.update(chunk)
+      sha256.update(chunk)
+  return sha1.hexdigest(), sha256.hexdigest()
+
+
+class ArtifactUploader(object):
+  """Uploads files, sharing a bounded pool of connections between threads.
+
+  At most max_connections requests are in flight at once; further uploads
+  wait for a connection to become free.
+  """
+
+  @property
+  def stats(self):
+    """Dictionary of connections opened, requests made and bytes sent."""
+    with self.__lock:
+      return dict(self.__stats)
+
+  def __init__(self, max_connections=4, max_attempts=4,
+               initial_backoff_secs=1.0, max_backoff_secs=30.0,
+               timeout_secs=300, sleep=time.sleep):
+    """Constructor.
+
+    Args:
+      max_connections [int]: The maximum number of concurrent uploads.
+      max_attempts [int]: The number of times to try each upload.
+      initial_backoff_secs [float]: The delay before the first retry.
+         This doubles on each subsequent retry.
+      max_backoff_secs [float]: The maximum delay between retries.
+      timeout_secs [float]: The socket timeout for each connection.
+      sleep [callable]: Sleeps for the given seconds, for testing.
+    """
+    self.__max_connections = max_connections
+    self.__max_attempts = max_attempts
+    self.__initial_backoff_secs = initial_backoff_secs
+    self.__max_backoff_secs = max_backoff_secs
+    self.__timeout_secs = timeout_secs
+    self.__sleep = sleep
+    self.__semaphore = threading.BoundedSemaphore(max_connections)
+    self.__lock = threading.Lock()
+    self.__idle = {}
+    self.__stats = {'connections': 0, 'requests': 0, 'bytes': 0,
+                    'retries': 0}
+
+  def __acquire_connection(self, scheme, netloc):
+    """Returns an idle or new connection, and whether it was idle."""
+    with self.__lock:
+      idle = self.__idle.get((scheme, netloc))
+      if idle:
+        return idle.pop(), True
+      self.__stats['connections'] += 1
+    klass = (httplib.HTTPSConnection if scheme == 'https'
+             else httplib.HTTPConnection)
+    return klass(netloc, timeout=self.__timeout_secs), False
+
+  def __release_connection(self, scheme, netloc, connection):
+    if connection.sock is None:
+      return  # The server closed it.
+    with self.__lock:
+      self.__idle.setdefault((scheme, netloc), []).append(connection)
+
+  def close(self):
+    """Close the idle connections."""
+    with self.__lock:
+      idle = self.__idle
+      self.__idle = {}
+    for connections in idle.values():
+      for connection in connections:
+        connection.close()
+
+  def __send_file(self, connection, method, url, path, headers, checksums):
+    """Stream a file in a single request.
+
+    Returns:
+      The (status, response, body) of the response.
+    """
+    parsed = urlparse.urlsplit(url)
+    selector = parsed.path or '/'
+    if parsed.query:
+      selector += '?' + parsed.query
+
+    size = os.path.getsize(path)
+    connection.putrequest(method, selector, skip_accept_encoding=True)
+    connection.putheader('Content-Length', str(size))
+    connection.putheader('X-Checksum-Sha1', checksums[0])
+    connection.putheader('X-Checksum-Sha2', checksums[1])
+    for key, value in (headers or {}).items():
+      connection.putheader(key, value)
+    connection.endheaders()
+
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    sent = 0
+    with open(path, 'rb') as f:
+      while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+          break
+        sha1.update(chunk)
+        sha256.update(chunk)
+        connection.send(chunk)
+        sent += len(chunk)
+    with self.__lock:
+      self.__stats['requests'] += 1
+      self.__stats['bytes'] += sent
+
+    response = connection.getresponse()
+    body = response.read()
+    if response.will_close:
+      connection.close()
+
+    if sent != size or (sha1.hexdigest(), sha256.hexdigest()) != checksums:
+      raise ChecksumError('{path} changed while uploading it.'.format(
+          path=path))
+    return response.status, response, body
+
+  def upload(self, url, path, headers=None, method='PUT'):
+    """Upload a file.
+
+    Args:
+      url [string]: The http or https url to upload to.
+      path [string]: The path to the local file.
+      headers [dict]: Additional request headers.
+      method [string]: The HTTP method.
+
+    Returns:
+      The response body.
+
+    Raises:
+      UploadError if the server rejected the upload or retries ran out.
+      ChecksumError if the content could not be uploaded intact.
+    """
+    parsed = urlparse.urlsplit(url)
+    checksums = compute_checksums(path)
+    backoff = self.__initial_backoff_secs
+    for attempt in range(1, self.__max_attempts + 1):
+      error = None
+      with self.__semaphore:
+        reused = True
+        while reused:
+          connection, reused = self.__acquire_connection(
+              parsed.scheme, parsed.netloc)
+          try:
+            status, response, body = self.__send_file(
+                connection, method, url, path, headers, checksums)
+          except (socket.error, httplib.HTTPException, ChecksumError) as ex:
+            # An idle connection may have been dropped by the server,
+            # so try again right away with another connection.
+            connection.close()
+            error = ex
+          else:
+            self.__release_connection(
+                parsed.scheme, parsed.netloc, connection)
+            error = None
+            break
+
+      if error is None:
+        if 200 <= status < 300:
+          echoed = response.getheader('X-Checksum-Sha1')
+          if echoed and echoed.lower() != checksums[0]:
+            error = ChecksumError(
+                '{url} reports sha1 {echoed} but {path} is {sha1}'.format(
+                    url=url, echoed=echoed, path=path, sha1=checksums[0]))
+          else:
+            return body
+        elif status in RETRYABLE_STATUS_CODES:
+          error = UploadError(url, status, body)
+        else:
+          raise UploadError(url, status, body)
+
+      if attempt == self.__max_attempts:
+        if isinstance(error, (socket.error, httplib.HTTPException)):
+          raise UploadError(url, None, '{0}: {1}'.format(
+              error.__class__.__name__, error))
+        raise error
+      with self.__lock:
+        self.__stats['retries'] += 1
+      delay = min(self.__max_backoff_secs, backoff) * random.uniform(0.5, 1.0)
+      sys.stderr.write('Upload of {path} failed ({error}).'
+                       ' Retrying in {delay:.1f}s\n'.format(
+                           path=path, error=str(error).split('\n')[0],
+                           delay=delay))
+      self.__sleep(delay)
+      backoff *= 2
@@ -0,0 +1,185 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remembers what each component build produced so it can be reused.
+
+A component's build key is derived from its source (the HEAD commit, the tags
+at HEAD that determine the package version, and any uncommitted changes) and
+the options affecting the build. When a later build of the component has the
+same key and the recorded artifacts are still present, the build is skipped.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+def _git(path, *args):
+  process = subprocess.Popen(['git', '-C', path] + list(args),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             close_fds=True)
+  stdout, stderr = process.communicate()
+  if process.returncode != 0:
+    raise IOError('git {args} failed in {path}: {error}'.format(
+        args=' '.join(args), path=path, error=stderr.strip()))
+  return stdout
+
+
+def fingerprint_source(path):
+  """Returns a hash identifying the source content of a git work tree.
+
+  Args:
+    path [string]: The root of the work tree to build.
+  """
+  digest = hashlib.sha1()
+  digest.update(_git(path, 'rev-parse', 'HEAD'))
+  digest.update(''.join(sorted(
+      _git(path, 'tag', '--points-at', 'HEAD').splitlines(True))))
+
+  # Uncommitted changes are part of the build too.
+  digest.update(_git(path, 'diff', 'HEAD', '--binary', '--', '.'))
+  untracked = _git(path, 'ls-files', '--others', '--exclude-standard', '-z',
+                   '--', '.')
+  for name in sorted(filter(None, untracked.split('\0'))):
+    digest.update(name + '\0')
+    with open(os.path.join(path, name), 'rb') as f:
+      digest.update(hashlib.sha1(f.read()).hexdigest())
+  return digest.hexdigest()
+
+
+def make_build_key(source_fingerprint, build_options):
+  """Combines a source fingerprint with the options affecting the build.
+
+  Args:
+    source_fingerprint [string]: The result of fingerprint_source.
+    build_options [dict]: The option values that affect the build output.
+  """
+  digest = hashlib.sha1(source_fingerprint)
+  digest.update(json.dumps(build_options, sort_keys=True))
+  return digest.hexdigest()
+
+
+class BuildManifest(object):
+  """The build key and artifacts of the last successful build of components.
+
+  The manifest is saved to a json file after every update, so it reflects
+  what was built even if the overall build later fails.
+  """
+
+  def __init__(self, path):
+    """Constructor.
+
+    Args:
+      path [string]: The path to the manifest file, or None to not keep one.
+         Without a manifest nothing is reused.
+    """
+    self.__path = path
+    self.__lock = threading.Lock()
+    self.__entries = {}
+    self.__reused = []
+    self.__rebuilt = []
+    if path and os.path.exists(path):
+      try:
+        with open(path, 'r') as f:
+          self.__entries = json.load(f)
+      except ValueError:
+        sys.stderr.write('WARNING: Ignoring malformed {path}\n'.format(
+            path=path))
+
+  @classmethod
+  def init_argument_parser(cls, parser):
+    parser.add_argument(
+        '--build_manifest_path', default='',
+        help='If set, records the inputs and packages of each component'
+             ' build so that components whose inputs, including the build'
+             ' number, have not changed since are not built again.')
+    parser.add_argument(
+        '--force_rebuild_packages', default=False, action='store_true',
+        help='Build every component even if --build_manifest_path shows'
+             ' that it has not changed.')
+
+  def lookup(self, name, key):
+    """Returns the recorded entry if the component can be reused, else None.
+
+    Args:
+      name [string]: The component name.
+      key [string]: The component's current build key.
+    """
+    with self.__lock:
+      entry = self.__entries.get(name)
+    if entry is None or entry['key'] != key:
+      return None
+    for artifact in entry['artifacts']:
+      if (not os.path.exists(artifact['path'])
+          or os.path.getsize(artifact['path']) != artifact['size']):
+        return None
+    return entry
+
+  def record(self, name, key, version, artifact_paths):
+    """Record a successful build of a component.
+
+    Args:
+      name [string]: The component name.
+      key [string]: The build key the component was built with.
+      version [string]: The package version built, if known.
+      artifact_paths [list of string]: The files the build produced.
+    """
+    entry = {
+        'key': key,
+        'version': version,
+        'built_at': time.time(),
+        'artifacts': [{'path': os.path.abspath(path),
+                       'size': os.path.getsize(path)}
+                      for path in sorted(artifact_paths)]
+    }
+    with self.__lock:
+      self.__entries[name] = entry
+      self.__save()
+
+  def forget(self, name):
+    """Forget a component's build, for example because it failed."""
+    with self.__lock:
+      if self.__entries.pop(name, None) is not None:
+        self.__save()
+
+  def note_reused(self, name):
+    with self.__lock:
+      self.__reused.append(name)
+
+  def note_rebuilt(self, name):
+    with self.__lock:
+      self.__rebuilt.append(name)
+
+  def report(self):
+    """Returns a summary of which components were reused and rebuilt."""
+    with self.__lock:
+      reused = sorted(self.__reused)
+      rebuilt = sorted(self.__rebuilt)
+    return ('Reused {num_reused} unchanged component builds: {reused}\n'
+            'Rebuilt {num_rebuilt} components: {rebuilt}'
+            .format(num_reused=len(reused), reused=', '.join(reused) or '-',
+                    num_rebuilt=len(rebuilt),
+                    rebuilt=', '.join(rebuilt) or '-'))
+
+  def __save(self):
+    if not self.__path:
+      return
+    tmp_path = self.__path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(self.__entries, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, self.__path)
@@ -18,7 +18,6 @@ import argparse
 import os
 import sys
 
-from annotate_source import Annotator
 from build_release import Builder
 from generate_bom import BomGenerator
 from refresh_source import Refresher
@@ -26,18 +25,6 @@ from refresh_source import Refresher
 from spinnaker.run import check_run_quick
 
 
-def __annotate_component(annotator, component):
-  """Annotate the component's source but don't include it in the BOM.
-
-  Returns:
-    [VersionBump]: Version bump complete with commit hash.
-  """
-  annotator.path = component
-  annotator.parse_git_tree()
-  version_bump = annotator.tag_head()
-  annotator.delete_unwanted_tags()
-  return version_bump
-
 def __record_halyard_nightly_version(version_bump, options):
   """Record the version and commit hash at which Halyard was built in a bucket.
 
@@ -87,11 +74,10 @@ def main():
   init_argument_parser(parser)
   options = parser.parse_args()
 
-  annotator = Annotator(options)
-  halyard_bump = __annotate_component(annotator, 'halyard')
-
   bom_generator = BomGenerator(options)
+  # This tags halyard too, though it is not included in the BOM.
   bom_generator.determine_and_tag_versions()
+  halyard_bump = bom_generator.halyard_version_bump
   if options.container_builder == 'gcb':
     bom_generator.write_container_builder_gcr_config()
   elif options.container_builder == 'gcb-trigger':
@@ -63,8 +63,18 @@ import urllib2
 from urllib2 import HTTPError
 
 import refresh_source
+from artifact_uploader import ArtifactUploader
+from artifact_uploader import UploadError
+from build_manifest import BuildManifest
+from build_manifest import fingerprint_source
+from build_manifest import make_build_key
+from build_scheduler import DurationHistory
+from build_scheduler import BuildJob
+from build_scheduler import WeightedScheduler
+from build_scheduler import format_schedule_report
 
 from google.cloud import pubsub
+from spinnaker import command_telemetry
 from spinnaker.run import run_quick
 
 SUBSYSTEM_LIST = ['clouddriver', 'orca', 'front50',
@@ -114,18 +124,22 @@ def determine_package_version(platform, gradle_root):
     return version
 
 def run_shell_and_log(cmd_list, logfile, cwd=None):
-  for cmd in cmd_list:
-    parsed = shlex.split(cmd)
-    log = None
-    if not os.path.exists(logfile):
-      log = open(logfile, 'w')
-    else:
-      log = open(logfile, 'a')
-    log.write('Executing command: {}\n---\n'.format(cmd))
-    subprocess.check_call(parsed, stdout=log, stderr=log, cwd=cwd)
-    log.write('\n---\nFinished executing command: {}'.format(cmd))
-    if log:
-      log.close()
+  with open(logfile, 'a') as log:
+    for cmd in cmd_list:
+      parsed = shlex.split(cmd)
+      log.write('Executing command: {}\n---\n'.format(cmd))
+      log.flush()
+      log_start = os.fstat(log.fileno()).st_size
+      start_time = time.time()
+      process = subprocess.Popen(parsed, stdout=log, stderr=log, cwd=cwd)
+      rusage = command_telemetry.wait_for_process(process)
+      command_telemetry.record(
+          'run_shell_and_log', cmd, start_time, time.time() - start_time,
+          process.returncode, os.fstat(log.fileno()).st_size - log_start,
+          rusage)
+      if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, parsed)
+      log.write('\n---\nFinished executing command: {}'.format(cmd))
 
 
 class Builder(object):
@@ -135,6 +149,8 @@ class Builder(object):
       self.__package_list = []
       self.__build_failures = []
       self.__background_processes = []
+      self.__build_keys = {}
+      self.__reused_builds = set()
 
       os.environ['NODE_ENV'] = os.environ.get('NODE_ENV', 'dev')
       self.__build_number = build_number or os.environ.get('BUILD_NUMBER') or '{:%Y-%m-%d}'.format(datetime.datetime.utcnow())
@@ -148,6 +164,14 @@ class Builder(object):
         self.__verify_bintray()
 
       self.__project_dir = determine_project_root()
+      self.__manifest = BuildManifest(options.build_manifest_path)
+      self.__duration_history = DurationHistory(
+          options.build_duration_history_path)
+      if options.command_telemetry_path:
+        command_telemetry.enable(options.command_telemetry_path)
+      self.__uploader = ArtifactUploader(
+          max_connections=options.upload_concurrency,
+          max_attempts=options.upload_attempts)
 
   def determine_gradle_root(self, name):
       if self.__options.platform == "debian":
@@ -473,89 +497,79 @@ class Builder(object):
                    version=version, path=path,
                    debian_tags=debian_tags))
 
-    with open(source, 'r') as f:
-        data = f.read()
-        put_request = urllib2.Request(url)
-        encoded_auth = base64.encodestring('{user}:{pwd}'.format(
-            user=bintray_user, pwd=bintray_key))[:-1]  # strip eoln
-
-        put_request.add_header('Authorization', 'Basic ' + encoded_auth)
-        put_request.get_method = lambda: 'PUT'
-        try:
-            result = urllib2.urlopen(put_request, data)
-        except HTTPError as put_error:
-            if put_error.code == 409 and self.__options.wipe_package_on_409:
-              # The problem here is that BinTray does not allow packages to change once
-              # they have been published (even though we are explicitly asking it to
-              # override). PATCH wont work either.
-              # Since we are building from source, we don't really have a version
-              # yet, since we are still modifying the code. Either we need to generate a new
-              # version number every time or we don't want to publish these.
-              # Ideally we could control whether or not to publish. However,
-              # if we do not publish, then the repository will not be visible without
-              # credentials, and adding conditional credentials into the packer scripts
-              # starts getting even more complex.
-              #
-              # We cannot seem to delete individual versions either (at least not for
-              # InstallSpinnaker.sh, which is where this problem seems to occur),
-              # so we'll be heavy handed and wipe the entire package.
-              print 'Got 409 on {url}.'.format(url=url)
-              delete_url = ('https://api.bintray.com/content'
-                            '/{subject}/{repo}/{path}'
-                            .format(subject=subject, repo=repo, path=path))
-              print 'Attempt to delete url={url} then retry...'.format(url=delete_url)
-              delete_request = urllib2.Request(delete_url)
-              delete_request.add_header('Authorization', 'Basic ' + encoded_auth)
-              delete_request.get_method = lambda: 'DELETE'
-              try:
-                urllib2.urlopen(delete_request)
-                print 'Deleted...'
-              except HTTPError as ex:
-                # Maybe it didn't exist. Try again anyway.
-                print 'Delete {url} got {ex}. Try again anyway.'.format(url=url, ex=ex)
-              print 'Retrying {url}'.format(url=url)
-              result = urllib2.urlopen(put_request, data)
-              print 'SUCCESS'
-
-            elif put_error.code != 400:
-              raise
-
-            else:
-              # Try creating the package and retrying.
-              pkg_url = os.path.join('https://api.bintray.com/packages',
-                                     subject, repo)
-              print 'Creating an entry for {package} with {pkg_url}...'.format(
-                  package=package, pkg_url=pkg_url)
-
-              # All the packages are from spinnaker so we'll hardcode it.
-              # Note spinnaker-monitoring is a github repo with two packages.
-              # Neither is "spinnaker-monitoring"; that's only the github repo.
-              gitname = (package.replace('spinnaker-', '')
-                         if not package.startswith('spinnaker-monitoring')
-                         else 'spinnaker-monitoring')
-              pkg_data = """{{
-                "name": "{package}",
-                "licenses": ["Apache-2.0"],
-                "vcs_url": "https://github.com/spinnaker/{gitname}.git",
-                "website_url": "http://spinnaker.io",
-                "github_repo": "spinnaker/{gitname}",
-                "public_download_numbers": false,
-                "public_stats": false
-              }}'""".format(package=package, gitname=gitname)
-
-              pkg_request = urllib2.Request(pkg_url)
-              pkg_request.add_header('Authorization', 'Basic ' + encoded_auth)
-              pkg_request.add_header('Content-Type', 'application/json')
-              pkg_request.get_method = lambda: 'POST'
-              pkg_result = urllib2.urlopen(pkg_request, pkg_data)
-              pkg_code = pkg_result.getcode()
-              if pkg_code >= 200 and pkg_code < 300:
-                  result = urllib2.urlopen(put_request, data)
-
-        code = result.getcode()
-        if code < 200 or code >= 300:
-          raise ValueError('{code}: Could not add version to {url}\n{msg}'
-                           .format(code=code, url=url, msg=result.read()))
+    encoded_auth = base64.encodestring('{user}:{pwd}'.format(
+        user=bintray_user, pwd=bintray_key))[:-1]  # strip eoln
+    put_headers = {'Authorization': 'Basic ' + encoded_auth}
+    try:
+        self.__uploader.upload(url, source, headers=put_headers)
+    except UploadError as put_error:
+        if put_error.code == 409 and self.__options.wipe_package_on_409:
+          # The problem here is that BinTray does not allow packages to change once
+          # they have been published (even though we are explicitly asking it to
+          # override). PATCH wont work either.
+          # Since we are building from source, we don't really have a version
+          # yet, since we are still modifying the code. Either we need to generate a new
+          # version number every time or we don't want to publish these.
+          # Ideally we could control whether or not to publish. However,
+          # if we do not publish, then the repository will not be visible without
+          # credentials, and adding conditional credentials into the packer scripts
+          # starts getting even more complex.
+          #
+          # We cannot seem to delete individual versions either (at least not for
+          # InstallSpinnaker.sh, which is where this problem seems to occur),
+          # so we'll be heavy handed and wipe the entire package.
+          print 'Got 409 on {url}.'.format(url=url)
+          delete_url = ('https://api.bintray.com/content'
+                        '/{subject}/{repo}/{path}'
+                        .format(subject=subject, repo=repo, path=path))
+          print 'Attempt to delete url={url} then retry...'.format(url=delete_url)
+          delete_request = urllib2.Request(delete_url)
+          delete_request.add_header('Authorization', 'Basic ' + encoded_auth)
+          delete_request.get_method = lambda: 'DELETE'
+          try:
+            urllib2.urlopen(delete_request)
+            print 'Deleted...'
+          except HTTPError as ex:
+            # Maybe it didn't exist. Try again anyway.
+            print 'Delete {url} got {ex}. Try again anyway.'.format(url=url, ex=ex)
+          print 'Retrying {url}'.format(url=url)
+          self.__uploader.upload(url, source, headers=put_headers)
+          print 'SUCCESS'
+
+        elif put_error.code != 400:
+          raise
+
+        else:
+          # Try creating the package and retrying.
+          pkg_url = os.path.join('https://api.bintray.com/packages',
+                                 subject, repo)
+          print 'Creating an entry for {package} with {pkg_url}...'.format(
+              package=package, pkg_url=pkg_url)
+
+          # All the packages are from spinnaker so we'll hardcode it.
+          # Note spinnaker-monitoring is a github repo with two packages.
+          # Neither is "spinnaker-monitoring"; that's only the github repo.
+          gitname = (package.replace('spinnaker-', '')
+                     if not package.startswith('spinnaker-monitoring')
+                     else 'spinnaker-monitoring')
+          pkg_data = """{{
+            "name": "{package}",
+            "licenses": ["Apache-2.0"],
+            "vcs_url": "https://github.com/spinnaker/{gitname}.git",
+            "website_url": "http://spinnaker.io",
+            "github_repo": "spinnaker/{gitname}",
+            "public_download_numbers": false,
+            "public_stats": false
+          }}'""".format(package=package, gitname=gitname)
+
+          pkg_request = urllib2.Request(pkg_url)
+          pkg_request.add_header('Authorization', 'Basic ' + encoded_auth)
+          pkg_request.add_header('Content-Type', 'application/json')
+          pkg_request.get_method = lambda: 'POST'
+          pkg_result = urllib2.urlopen(pkg_request, pkg_data)
+          pkg_code = pkg_result.getcode()
+          if pkg_code >= 200 and pkg_code < 300:
+              self.__uploader.upload(url, source, headers=put_headers)
 
     print 'Wrote {source} to {url}'.format(source=source, url=url)
 
@@ -582,6 +596,22 @@ class Builder(object):
     self.publish_to_bintray(source, package=package, version=version,
                             path=path, debian_tags=debian_tags)
 
+  def publish_files(self, files):
+    """Write several files to the bintray repository concurrently.
+
+    Args:
+      files [list of (source, package, version)]: The files to publish.
+    """
+    if not files:
+      return
+    pool = multiprocessing.pool.ThreadPool(
+        processes=min(len(files), self.__options.upload_concurrency))
+    try:
+      pool.map(lambda entry: self.publish_file(*entry), files)
+    finally:
+      pool.close()
+      pool.join()
+
   def start_copy_debian_target(self, name):
       """Copies the debian package for the specified subsystem.
 
@@ -589,6 +619,7 @@ class Builder(object):
         name [string]: The name of the subsystem repository.
       """
       pids = []
+      to_publish = []
       gradle_root = self.determine_gradle_root(name)
       version = determine_package_version(self.__options.platform, gradle_root)
       if version is None:
@@ -621,9 +652,10 @@ class Builder(object):
         self.__package_list.append(from_path)
         basename = os.path.basename(from_path)
         module_name = basename[0:basename.find('_')]
-        if self.__options.bintray_repo:
-          self.publish_file(from_path, module_name, version)
+        to_publish.append((from_path, module_name, version))
 
+      if self.__options.bintray_repo:
+        self.publish_files(to_publish)
       return pids
 
   def start_copy_redhat_target(self, name):
@@ -633,6 +665,7 @@ class Builder(object):
         name [string]: The name of the subsystem repository.
       """
       pids = []
+      to_publish = []
       gradle_root = self.determine_gradle_root(name)
       version = determine_package_version(self.__options.platform, gradle_root)
       if version is None:
@@ -665,34 +698,137 @@ class Builder(object):
         self.__package_list.append(from_path)
         basename = os.path.basename(from_path)
         module_name = re.search("^(.*)-{}.noarch.rpm$".format(version), basename).group(1)
-        if self.__options.bintray_repo:
-          self.publish_file(from_path, module_name, version)
+        to_publish.append((from_path, module_name, version))
 
+      if self.__options.bintray_repo:
+        self.publish_files(to_publish)
       return pids
 
+  def determine_build_key(self, name):
+    """Determine the key identifying the inputs to a subsystem build.
+
+    Args:
+      name [string]: Name of the subsystem repository.
+
+    Returns:
+      The key, or None if it cannot be determined.
+    """
+    gradle_root = self.determine_gradle_root(name)
+    try:
+      fingerprint = fingerprint_source(gradle_root)
+    except (IOError, OSError) as ex:
+      print 'Cannot determine build key for {name}: {ex}'.format(
+          name=name, ex=ex)
+      return None
+    return make_build_key(fingerprint, {
+        'platform': self.__options.platform,
+        'build_number': self.__build_number,
+        'nebula': self.__options.nebula,
+        'bintray_repo': self.__options.bintray_repo,
+        'jar_repo': self.__options.jar_repo,
+        'run_unit_tests': self.__options.run_unit_tests,
+        'chrome': name == 'deck' and 'CHROME_BIN' in os.environ
+    })
+
+  def __record_build(self, subsys):
+    """Record the artifacts of a successful build in the build manifest."""
+    key = self.__build_keys.get(subsys)
+    if key is None:
+      return
+    gradle_root = self.determine_gradle_root(subsys)
+    if self.__options.platform == 'debian':
+      roots = determine_modules_with_debians(gradle_root)
+      pattern = '*.deb'
+    else:
+      roots = determine_modules_with_redhats(gradle_root)
+      pattern = '*.rpm'
+    artifacts = []
+    for root in set(roots):
+      artifacts.extend(glob.glob(
+          os.path.join(root, 'build', 'distributions', pattern)))
+    try:
+      self.__manifest.record(
+          subsys, key,
+          determine_package_version(self.__options.platform, gradle_root),
+          artifacts)
+    except (IOError, OSError) as ex:
+      print 'Could not record the build of {name}: {ex}'.format(
+          name=subsys, ex=ex)
+
   def __do_build(self, subsys):
+    with command_telemetry.context(component=subsys):
+      self.__do_build_component(subsys)
+
+  def __do_build_component(self, subsys):
+    key = None
+    if self.__options.build_manifest_path:
+      key = self.determine_build_key(subsys)
+    if (key is not None
+        and not self.__options.force_rebuild_packages
+        and self.__manifest.lookup(subsys, key) is not None):
+      print 'Reusing unchanged build of {0}.'.format(subsys)
+      self.__manifest.note_reused(subsys)
+      self.__reused_builds.add(subsys)
+      return
+
+    self.__manifest.note_rebuilt(subsys)
+    self.__manifest.forget(subsys)
     if self.__options.platform == 'debian':
       try:
         self.start_deb_build(subsys)
       except Exception as ex:
         print ex
         self.__build_failures.append(subsys)
+        return
     elif self.__options.platform == 'redhat':
       try:
         self.start_rpm_build(subsys)
       except Exception as ex:
         self.__build_failures.append(subsys)
+        return
+
+    self.__build_keys[subsys] = key
+    if self.__options.nebula:
+      # Nebula builds published the packages already.
+      self.__record_build(subsys)
 
   def __do_container_build(self, subsys):
     try:
-      # HACK: Space out the container builds to address scalability concerns.
-      full_subsystem_list = SUBSYSTEM_LIST + ADDITIONAL_SUBSYSTEMS
-      time.sleep(2 * full_subsystem_list.index(subsys))
-      self.start_container_build(subsys)
+      with command_telemetry.context(component=subsys):
+        self.start_container_build(subsys)
     except Exception as ex:
       print ex
       self.__build_failures.append(subsys)
 
+  def __run_scheduled(self, kind, subsystems, func, resources, capacities):
+    """Run a function on each subsystem, longest expected build first.
+
+    Args:
+      kind [string]: Identifies the kind of build in the duration history.
+      subsystems [list of string]: The subsystems to build.
+      func [callable]: Builds the subsystem passed to it.
+      resources [dict]: The resource units each build holds while running.
+      capacities [dict]: The available units of each resource.
+    """
+    history_key = lambda name: '{kind}:{name}'.format(kind=kind, name=name)
+    scheduler = WeightedScheduler(
+        capacities,
+        estimate=lambda name: self.__duration_history.estimate(
+            history_key(name)))
+    jobs = [BuildJob(name, lambda name=name: func(name), resources=resources)
+            for name in subsystems]
+    outcomes = scheduler.run(jobs)
+
+    for name, outcome in outcomes.items():
+      if outcome.error is not None:
+        print outcome.error
+        self.__build_failures.append(name)
+      elif (name not in self.__build_failures
+            and name not in self.__reused_builds):
+        self.__duration_history.record(history_key(name), outcome.elapsed)
+    self.__duration_history.save()
+    print format_schedule_report('{kind} builds'.format(kind=kind), outcomes)
+
   def build_container_images(self):
     """Build the Spinnaker packages as container images.
     """
@@ -701,9 +837,16 @@ class Builder(object):
 
     if self.__options.container_builder:
       weighted_processes = self.__options.cpu_ratio * multiprocessing.cpu_count()
-      pool = multiprocessing.pool.ThreadPool(
-        processes=int(max(1, weighted_processes)))
-      pool.map(self.__do_container_build, subsystems)
+      capacities = {'cpu': int(max(1, weighted_processes)),
+                    'container_build': max(
+                        1, self.__options.container_build_concurrency)}
+      # Docker builds run locally whereas the GCB builds run remotely.
+      resources = ({'cpu': 1, 'container_build': 1}
+                   if self.__options.container_builder == 'docker'
+                   else {'container_build': 1})
+      self.__run_scheduled(
+          'container-' + self.__options.container_builder, subsystems,
+          self.__do_container_build, resources, capacities)
 
     if self.__build_failures:
       if set(self.__build_failures).intersection(set(subsystems)):
@@ -724,9 +867,11 @@ class Builder(object):
         # Build in parallel using half available cores
         # to keep load in check.
         weighted_processes = self.__options.cpu_ratio * multiprocessing.cpu_count()
-        pool = multiprocessing.pool.ThreadPool(
-            processes=int(max(1, weighted_processes)))
-        pool.map(self.__do_build, all_subsystems)
+        self.__run_scheduled(
+            'package-' + self.__options.platform, all_subsystems,
+            self.__do_build, {'cpu': 1},
+            {'cpu': int(max(1, weighted_processes))})
+        print self.__manifest.report()
 
       if self.__build_failures:
         if set(self.__build_failures).intersection(set(SUBSYSTEM_LIST)):
@@ -750,15 +895,26 @@ class Builder(object):
       return
 
   def __do_copy(self, subsys):
+    if subsys in self.__reused_builds:
+      # These packages were copied when they were built.
+      entry = self.__manifest.lookup(subsys, self.determine_build_key(subsys))
+      if entry is not None:
+        self.__package_list.extend(
+            [artifact['path'] for artifact in entry['artifacts']])
+        print 'Reusing packages already copied for {0}.'.format(subsys)
+        return
+
     print 'Starting to copy {0}...'.format(subsys)
-    if self.__options.platform == 'debian':
-      pids = self.start_copy_debian_target(subsys)
+    with command_telemetry.context(component=subsys):
+      if self.__options.platform == 'debian':
+        pids = self.start_copy_debian_target(subsys)
 
-    elif self.__options.platform == 'redhat':
-      pids = self.start_copy_redhat_target(subsys)
+      elif self.__options.platform == 'redhat':
+        pids = self.start_copy_redhat_target(subsys)
 
     for p in pids:
       p.check_wait()
+    self.__record_build(subsys)
     print 'Finished copying {0}.'.format(subsys)
 
   @classmethod
@@ -832,7 +988,39 @@ class Builder(object):
       parser.add_argument(
           '--run_unit_tests', type=bool, default=False,
           help='Run unit tests during build for all components other than Deck.')
+      parser.add_argument(
+          '--command_telemetry_path', default='',
+          help='If set, append how long each build command took to this'
+               ' file.')
+      parser.add_argument(
+          '--upload_concurrency', type=int, default=4,
+          help='The maximum number of packages to upload at once.')
+      parser.add_argument(
+          '--upload_attempts', type=int, default=4,
+          help='The number of times to try uploading each package.')
+      parser.add_argument(
+          '--build_duration_history_path', default='build_durations.json',
+          help='Records how long each component took to build so that'
+               ' later builds can start the longest ones first.')
+      parser.add_argument(
+          '--container_build_concurrency', type=int, default=4,
+          help='The maximum number of container builds to run at once.')
+      BuildManifest.init_argument_parser(parser)
+
 
+  def report_command_telemetry(self):
+    """Print the slowest build steps compared with the previous run."""
+    path = self.__options.command_telemetry_path
+    if not path or not os.path.exists(path):
+      return
+    runs = command_telemetry.group_runs(command_telemetry.load_records(path))
+    this_run = runs.pop(
+        os.environ.get(command_telemetry.TELEMETRY_RUN_VAR), None)
+    if not this_run:
+      return
+    previous_run = runs.values()[-1] if runs else None
+    print '\nSlowest build steps:'
+    print command_telemetry.summarize(this_run, previous_run)
 
   def __verify_bintray(self):
     if not os.environ.get('BINTRAY_KEY', None):
@@ -859,6 +1047,7 @@ class Builder(object):
     builder.build_packages()
     if container_builder:
       builder.build_container_images()
+    builder.report_command_telemetry()
 
     if options.build and options.bintray_repo:
       fd, temp_path = tempfile.mkstemp()
@@ -0,0 +1,326 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Schedules build jobs longest-first within resource limits.
+
+Each job is weighted by how long it took in earlier runs. Among the jobs whose
+dependencies have finished, those with the longest remaining chain of work are
+started first, as long as the resources they need (such as CPU slots or
+concurrent container builds) are available. Short jobs fill in the remaining
+capacity, so a long job such as clouddriver does not end up running alone
+after everything else finished.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+
+class DurationHistory(object):
+  """Job durations from recent runs, kept in a json file."""
+
+  def __init__(self, path, max_samples=5):
+    """Constructor.
+
+    Args:
+      path [string]: The path to the history file, or None to not keep one.
+      max_samples [int]: The number of recent durations to keep per job.
+    """
+    self.__path = path
+    self.__max_samples = max_samples
+    self.__lock = threading.Lock()
+    self.__samples = {}
+    if path and os.path.exists(path):
+      try:
+        with open(path, 'r') as f:
+          self.__samples = json.load(f)
+      except ValueError:
+        sys.stderr.write('WARNING: Ignoring malformed {path}\n'.format(
+            path=path))
+
+  def estimate(self, key):
+    """Returns the expected duration for a job.
+
+    Jobs without a history are assumed to be as long as the longest known
+    job so that they are started early rather than discovered late.
+    """
+    with self.__lock:
+      samples = self.__samples.get(key)
+      if samples:
+        return sum(samples) / float(len(samples))
+      known = [sum(values) / float(len(values))
+               for values in self.__samples.values() if values]
+    return max(known) if known else 0.0
+
+  def record(self, key, secs):
+    with self.__lock:
+      samples = self.__samples.setdefault(key, [])
+      samples.append(secs)
+      del samples[:-self.__max_samples]
+
+  def save(self):
+    if not self.__path:
+      return
+    with self.__lock:
+      tmp_path = self.__path + '.tmp'
+      with open(tmp_path, 'w') as f:
+        json.dump(self.__samples, f, indent=2, sort_keys=True)
+      os.rename(tmp_path, self.__path)
+
+
+class BuildJob(object):
+  """A unit of work for the WeightedScheduler."""
+
+  def __init__(self, name, func, resources=None, dependencies=None):
+    """Constructor.
+
+    Args:
+      name [string]: The unique name of the job.
+      func [callable]: Called with no arguments to perform the job.
+      resources [dict]: The units of each resource that the job holds
+         while it runs, keyed by resource name.
+      dependencies [list of string]: The names of the jobs that must
+         finish successfully before this one starts.
+    """
+    self.name = name
+    self.func = func
+    self.resources = dict(resources or {})
+    self.dependencies = list(dependencies or [])
+
+
+class JobOutcome(object):
+  """What happened to a BuildJob.
+
+  Attributes:
+    name: The job name.
+    estimate: The expected duration when scheduled.
+    start: The time the job started, or None if it never ran.
+    end: The time the job finished, or None if it never ran.
+    error: The exception raised by the job, if any.
+    waited_on: The name of the job whose completion allowed this one to
+       start, or None if it could start right away.
+  """
+
+  @property
+  def elapsed(self):
+    if self.start is None or self.end is None:
+      return None
+    return self.end - self.start
+
+  def __init__(self, name, estimate):
+    self.name = name
+    self.estimate = estimate
+    self.start = None
+    self.end = None
+    self.error = None
+    self.waited_on = None
+
+
+class WeightedScheduler(object):
+  """Runs BuildJobs concurrently, longest remaining work first."""
+
+  def __init__(self, capacities, estimate=None, clock=time.time):
+    """Constructor.
+
+    Args:
+      capacities [dict]: The available units of each resource, keyed by
+         resource name. Resources not listed are unlimited.
+      estimate [callable]: Given a job name, returns its expected duration.
+      clock [callable]: Returns the current time in seconds.
+    """
+    self.__capacities = dict(capacities)
+    self.__estimate = estimate or (lambda name: 0.0)
+    self.__clock = clock
+
+  def __determine_ranks(self, jobs, outcomes):
+    """Returns each job's estimate plus the longest chain of dependents."""
+    dependents = dict([(name, []) for name in jobs.keys()])
+    for job in jobs.values():
+      for dependency in job.dependencies:
+        dependents[dependency].append(job.name)
+
+    ranks = {}
+    visiting = set()
+    def rank(name):
+      if name in ranks:
+        return ranks[name]
+      if name in visiting:
+        raise ValueError('Cyclic build dependency involving "{0}"'.format(
+            name))
+      visiting.add(name)
+      ranks[name] = outcomes[name].estimate + max(
+          [rank(other) for other in dependents[name]] or [0])
+      visiting.remove(name)
+      return ranks[name]
+
+    for name in jobs.keys():
+      rank(name)
+    return ranks
+
+  def run(self, jobs):
+    """Run the jobs to completion.
+
+    Jobs whose dependencies failed are not run; their outcome error is a
+    RuntimeError naming the failed dependency.
+
+    Args:
+      jobs [list of BuildJob]: The jobs to run.
+
+    Returns:
+      A dictionary of JobOutcome keyed by job name.
+    """
+    jobs_by_name = {}
+    for job in jobs:
+      if job.name in jobs_by_name:
+        raise ValueError('Duplicate job "{0}"'.format(job.name))
+      jobs_by_name[job.name] = job
+    for job in jobs:
+      for dependency in job.dependencies:
+        if dependency not in jobs_by_name:
+          raise ValueError('"{0}" depends on unknown job "{1}"'.format(
+              job.name, dependency))
+      for resource, units in job.resources.items():
+        if units > self.__capacities.get(resource, units):
+          raise ValueError(
+              '"{0}" needs {1} {2} but only {3} are available'.format(
+                  job.name, units, resource, self.__capacities[resource]))
+
+    outcomes = dict([(job.name, JobOutcome(job.name,
+                                           self.__estimate(job.name)))
+                     for job in jobs])
+    ranks = self.__determine_ranks(jobs_by_name, outcomes)
+    available = dict(self.__capacities)
+    pending = sorted(jobs, key=lambda job: (-ranks[job.name], job.name))
+    finished = []
+    condition = threading.Condition()
+    running = [0]
+
+    def perform(job):
+      try:
+        job.func()
+      except Exception as ex:
+        outcomes[job.name].error = ex
+      except BaseException as ex:
+        # Such as SystemExit. Record it but let it end the thread.
+        outcomes[job.name].error = ex
+        raise
+      finally:
+        with condition:
+          outcomes[job.name].end = self.__clock()
+          for resource, units in job.resources.items():
+            if resource in available:
+              available[resource] += units
+          running[0] -= 1
+          finished.append(job.name)
+          condition.notify()
+
+    def fits(job):
+      return all([units <= available[resource]
+                  for resource, units in job.resources.items()
+                  if resource in available])
+
+    trigger = None
+    with condition:
+      while pending or running[0]:
+        skipped_any = True
+        while skipped_any:
+          skipped_any = False
+          for job in list(pending):
+            failed = [dependency for dependency in job.dependencies
+                      if outcomes[dependency].error is not None]
+            if failed:
+              pending.remove(job)
+              outcomes[job.name].error = RuntimeError(
+                  'Dependency "{0}" failed'.format(failed[0]))
+              skipped_any = True
+
+        for job in list(pending):
+          if any([outcomes[dependency].end is None
+                  for dependency in job.dependencies]):
+            continue
+          if not fits(job):
+            continue
+          pending.remove(job)
+          for resource, units in job.resources.items():
+            if resource in available:
+              available[resource] -= units
+          outcome = outcomes[job.name]
+          outcome.start = self.__clock()
+          outcome.waited_on = trigger
+          running[0] += 1
+          thread = threading.Thread(target=perform, args=(job,))
+          thread.daemon = True
+          thread.start()
+
+        if not running[0]:
+          if pending:
+            raise ValueError('Could not schedule {0}'.format(
+                ', '.join([job.name for job in pending])))
+          break
+        while not finished:
+          condition.wait(1)
+        trigger = finished.pop(0)
+        # Let other jobs that finished in the meantime release their
+        # resources in this same pass.
+        del finished[:]
+
+    return outcomes
+
+
+def critical_path(outcomes):
+  """Returns the chain of jobs that determined when the last one finished.
+
+  This starts from the job that finished last and follows back through the
+  jobs whose completion allowed each to start.
+
+  Args:
+    outcomes [dict]: The JobOutcomes from WeightedScheduler.run.
+
+  Returns:
+    A list of JobOutcome in the order they ran.
+  """
+  ran = [outcome for outcome in outcomes.values() if outcome.end is not None]
+  if not ran:
+    return []
+  path = []
+  outcome = max(ran, key=lambda outcome: outcome.end)
+  while outcome is not None:
+    path.append(outcome)
+    outcome = outcomes.get(outcome.waited_on)
+  path.reverse()
+  return path
+
+
+def format_schedule_report(title, outcomes):
+  """Returns a human readable summary of the schedule and its critical path.
+
+  Args:
+    title [string]: Describes what was scheduled.
+    outcomes [dict]: The JobOutcomes from WeightedScheduler.run.
+  """
+  ran = [outcome for outcome in outcomes.values() if outcome.end is not None]
+  if not ran:
+    return '{title}: nothing ran.'.format(title=title)
+  begin = min([outcome.start for outcome in ran])
+  lines = ['{title} took {secs:.1f}s. Critical path:'.format(
+      title=title, secs=max([outcome.end for outcome in ran]) - begin)]
+  for outcome in critical_path(outcomes):
+    lines.append(
+        '  {name:<24} start +{start:>7.1f}s  took {elapsed:>7.1f}s'
+        '  (expected {estimate:.1f}s)'.format(
+            name=outcome.name, start=outcome.start - begin,
+            elapsed=outcome.elapsed, estimate=outcome.estimate))
+  return '\n'.join(lines)
@@ -50,9 +50,8 @@ def populate_aws_yml(content):
 
   bindings = YamlBindings()
   bindings.import_dict({'providers': {'aws': aws_dict}})
-  content = bindings.transform_yaml_source(content, 'providers.aws.enabled')
-  content = bindings.transform_yaml_source(content,
-                                           'providers.aws.defaultRegion')
+  content = bindings.transform_yaml_source_keys(
+      content, ['providers.aws.enabled', 'providers.aws.defaultRegion'])
 
   return content
 
@@ -81,17 +80,13 @@ def populate_google_yml(content):
   bindings = YamlBindings()
   bindings.import_dict({'providers': {'google': google_dict}})
   bindings.import_dict({'services': {'front50': front50_dict}})
-  content = bindings.transform_yaml_source(content, 'providers.google.enabled')
-  content = bindings.transform_yaml_source(
-      content, 'providers.google.defaultRegion')
-  content = bindings.transform_yaml_source(
-      content, 'providers.google.defaultZone')
-  content = bindings.transform_yaml_source(
-      content, 'providers.google.primaryCredentials.project')
-  content = bindings.transform_yaml_source(
-      content, 'providers.google.primaryCredentials.jsonPath')
-  content = bindings.transform_yaml_source(
-      content, 'services.front50.storage_bucket')
+  content = bindings.transform_yaml_source_keys(
+      content, ['providers.google.enabled',
+                'providers.google.defaultRegion',
+                'providers.google.defaultZone',
+                'providers.google.primaryCredentials.project',
+                'providers.google.primaryCredentials.jsonPath',
+                'services.front50.storage_bucket'])
 
   return content
 
@@ -189,7 +184,8 @@ class DevRunner(spinnaker_runner.Runner):
         self.installation.SUBSYSTEM_ROOT_DIR,
         subsystem,
         'start_dev.sh')
-    return self.run_daemon(command, [command], environ=environ)
+    return self.run_daemon(command, [command], environ=environ,
+                           pid_path=self.subsystem_pid_path(subsystem))
 
   def tail_error_logs(self):
     """Start a background tail job of all the component error logs."""
@@ -16,8 +16,10 @@
 
 import argparse
 import datetime
+import multiprocessing.pool
 import os
 import sys
+import time
 import yaml
 
 from annotate_source import Annotator
@@ -82,12 +84,19 @@ class BomGenerator(Annotator):
     self.__halyard_version = {'halyard': None}
     self.__container_builder_base_image = options.container_builder_base_image
     self.__container_builder_env_vars = options.container_builder_env_vars
+    self.__component_workers = options.component_workers
+    self.__component_timings = {}  # Seconds per step keyed by component.
     super(BomGenerator, self).__init__(options)
 
   @property
   def base_dir(self):
     return self.__base_dir
 
+  @property
+  def halyard_version_bump(self):
+    """The VersionBump from tagging halyard, or None if not yet tagged."""
+    return self.__halyard_version['halyard']
+
   @classmethod
   def init_argument_parser(cls, parser):
     """Initialize command-line arguments."""
@@ -109,6 +118,8 @@ class BomGenerator(Annotator):
                         help="GCE project we publish HA Spinnaker component images to.")
     parser.add_argument('--git_prefix', default='https://github.com/spinnaker',
                         help="Prefix to the component source URIs.")
+    parser.add_argument('--component_workers', default=8, type=int,
+                        help="Maximum number of component repositories to process concurrently.")
     super(BomGenerator, cls).init_argument_parser(parser)
 
   def __version_from_tag(self, comp):
@@ -241,23 +252,17 @@ class BomGenerator(Annotator):
     The changelog contains a section per microservice that describes the
     changes made since the last Spinnaker release. It also contains the
     version information as well.
+
+    The changelogs for the components are generated concurrently, then
+    written in component name order.
     """
-    changelog = []
-    for comp in sorted(self.__changelog_start_hashes.keys()):
-      if comp == 'spinnaker':
-        continue
-      hash = self.__changelog_start_hashes.get(comp, None)
-      version = self.__version_from_tag(comp)
+    components = [comp for comp in sorted(self.__changelog_start_hashes.keys())
+                  if comp != 'spinnaker']
+    results = self.__map_components(
+        'changelog', self.__generate_component_changelog, components)
 
-      # Generate the changelog for the component.
-      print 'Generating changelog for {comp}...'.format(comp=comp)
-      # Assumes the remote repository is aliased as 'origin'.
-      component_url = run_quick('git -C {path} config --get remote.origin.url'
-                                .format(path=comp)).stdout.strip()
-      if component_url.endswith('.git'):
-        component_url = component_url.replace('.git', '')
-      result = run_quick('cd {comp}; clog -r {url} -f {hash} --setversion {version}; cd ..'
-                         .format(comp=comp, url=component_url, hash=hash, version=version))
+    changelog = []
+    for comp, result in zip(components, results):
       if result.returncode != 0:
         print "Changelog generation failed for {0} with \n{1}\n exiting...".format(comp, result.stdout)
         exit(result.returncode)
@@ -274,6 +279,26 @@ class BomGenerator(Annotator):
     changelog_file = self.__changelog_output or '{0}-changelog.md'.format(self.__toplevel_version)
     with open(changelog_file, 'w') as clog:
       clog.write('\n'.join(changelog))
+    self.report_component_timings()
+
+  def __generate_component_changelog(self, comp):
+    """Runs clog for the component.
+
+    Returns:
+      [RunResult] The result of running clog.
+    """
+    hash = self.__changelog_start_hashes.get(comp, None)
+    version = self.__version_from_tag(comp)
+
+    # Generate the changelog for the component.
+    print 'Generating changelog for {comp}...'.format(comp=comp)
+    # Assumes the remote repository is aliased as 'origin'.
+    component_url = run_quick('git -C {path} config --get remote.origin.url'
+                              .format(path=comp)).stdout.strip()
+    if component_url.endswith('.git'):
+      component_url = component_url.replace('.git', '')
+    return run_quick('cd {comp}; clog -r {url} -f {hash} --setversion {version}; cd ..'
+                     .format(comp=comp, url=component_url, hash=hash, version=version))
 
   def write_bom(self):
     output_yaml = {SERVICES: {}, DEPENDENCIES: {}, ARTIFACT_SOURCES: {}}
@@ -394,26 +419,96 @@ class BomGenerator(Annotator):
         config_path = os.path.join(comp, 'halconfig')
         self.__publish_config(comp, config_path)
 
+  def __map_components(self, step, func, components):
+    """Apply a function to each component concurrently.
+
+    Args:
+      step [string]: The name of the step, for reporting timings.
+      func [callable]: Called with a component name.
+      components [list of string]: The components to apply func to.
+
+    Returns:
+      The list of results in the same order as components.
+    """
+    def timed_func(comp):
+      start = time.time()
+      try:
+        return func(comp)
+      finally:
+        secs = time.time() - start
+        self.__component_timings.setdefault(comp, {})[step] = secs
+        print '{step} for {comp} took {secs:.1f}s'.format(
+            step=step, comp=comp, secs=secs)
+
+    if not components:
+      return []
+    pool = multiprocessing.pool.ThreadPool(
+        processes=max(1, min(self.__component_workers, len(components))))
+    try:
+      return pool.map(timed_func, components)
+    finally:
+      pool.close()
+      pool.join()
+
+  def report_component_timings(self):
+    """Print how long each component spent in each step."""
+    steps = sorted(set(step for timings in self.__component_timings.values()
+                       for step in timings))
+    print 'Component timings (seconds):'
+    print '  {0:<24}{1}'.format(
+        'COMPONENT', ''.join('{0:>12}'.format(step) for step in steps))
+    for comp in sorted(self.__component_timings):
+      timings = self.__component_timings[comp]
+      print '  {0:<24}{1}'.format(
+          comp, ''.join('{0:>12}'.format(
+              '{0:.1f}'.format(timings[step]) if step in timings else '-')
+                        for step in steps))
+
+  def __annotate_component(self, comp):
+    """Determine and tag the next version of a component repository.
+
+    Each component gets its own Annotator so they can be processed
+    concurrently.
+
+    Returns:
+      The hash of the component's current version and its VersionBump.
+    """
+    annotator = Annotator(self.__options,
+                          path=os.path.join(self.__base_dir, comp))
+    annotator.parse_git_tree()
+    start_hash = annotator.current_version.hash
+    version_bump = annotator.tag_head()
+    annotator.delete_unwanted_tags()
+    return start_hash, version_bump
+
   def determine_and_tag_versions(self):
-    for comp in self.COMPONENTS:
-      self.path = os.path.join(self.__base_dir, comp)
-      self.parse_git_tree()
-      self.__changelog_start_hashes[comp] = self.current_version.hash
-      version_bump = self.tag_head()
-      self.__component_versions[comp] = version_bump
-      self.delete_unwanted_tags()
+    """Determine and tag the versions of all the components and halyard.
+
+    The repositories are processed concurrently, but the results are
+    recorded in component order so the BOM does not depend on timing.
+    """
+    components = self.COMPONENTS + ['halyard']
+    results = self.__map_components(
+        'versions', self.__annotate_component, components)
+    for comp, (start_hash, version_bump) in zip(components, results):
+      self.__changelog_start_hashes[comp] = start_hash
+      if comp == 'halyard':
+        self.__halyard_version[comp] = version_bump
+      else:
+        self.__component_versions[comp] = version_bump
 
   def determine_and_tag_halyard(self):
     """This serves only to generate an rpm version file
     for halyard
+
+    This is a no-op if determine_and_tag_versions already tagged halyard.
     """
     comp = 'halyard'
-    self.path = os.path.join(self.__base_dir, comp)
-    self.parse_git_tree()
-    self.__changelog_start_hashes[comp] = self.current_version.hash
-    version_bump = self.tag_head()
+    if self.__halyard_version[comp] is not None:
+      return
+    start_hash, version_bump = self.__annotate_component(comp)
+    self.__changelog_start_hashes[comp] = start_hash
     self.__halyard_version[comp] = version_bump
-    self.delete_unwanted_tags()
 
   @classmethod
   def main(cls):
@@ -0,0 +1,260 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local cache of bare git mirrors that clones borrow objects from.
+
+Each remote url has a bare mirror in the cache directory. Before a clone,
+the mirror is brought up to date with an incremental fetch, then the clone
+uses it as a --reference so that only objects not already in the cache are
+transferred. Mirrors are garbage collected least-recently-used first to keep
+the cache within a size and count limit.
+
+Clones made with --reference keep using the mirror's objects through
+.git/objects/info/alternates, so removing a mirror, or pruning objects from
+it, breaks clones that still refer to it. Therefore clones are always
+dissociated from their mirror when the cache has a size or count limit.
+Without a limit, clones borrow objects unless --git_cache_dissociate is used,
+and the mirrors are fetched without pruning or automatic git gc so that
+the objects the clones borrow are kept.
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+
+from spinnaker.run import check_run_quick
+
+
+_LAST_USED_FILE = 'last-used'
+_MIRROR_SUFFIX = '.git'
+
+
+def _directory_size(path):
+  """Returns the bytes used by the files under path."""
+  total = 0
+  for root, _, files in os.walk(path):
+    for name in files:
+      try:
+        total += os.lstat(os.path.join(root, name)).st_size
+      except OSError:
+        pass
+  return total
+
+
+class GitObjectCache(object):
+  """Manages the bare mirrors in a cache directory.
+
+  Mirrors are locked with flock while they are fetched so that concurrent
+  processes sharing the cache do not collide.
+  """
+
+  @property
+  def cache_dir(self):
+    return self.__cache_dir
+
+  @property
+  def dissociate(self):
+    """Whether clones copy the objects they would borrow from the mirror."""
+    return self.__dissociate
+
+  def __init__(self, cache_dir, max_bytes=0, max_entries=0, dissociate=False):
+    """Constructor.
+
+    Args:
+      cache_dir [string]: The directory to keep the mirrors in.
+      max_bytes [int]: If positive, collect mirrors beyond this total size.
+      max_entries [int]: If positive, collect mirrors beyond this count.
+      dissociate [bool]: If True then clones copy the borrowed objects
+         so they do not depend on the mirror afterwards. This is implied
+         by max_bytes or max_entries since mirrors may then be removed.
+    """
+    self.__cache_dir = os.path.abspath(cache_dir)
+    self.__max_bytes = max_bytes
+    self.__max_entries = max_entries
+    self.__dissociate = dissociate or max_bytes > 0 or max_entries > 0
+    self.__lock = threading.Lock()
+    self.__used = set()
+    if not os.path.exists(self.__cache_dir):
+      try:
+        os.makedirs(self.__cache_dir)
+      except OSError as ex:
+        if ex.errno != errno.EEXIST:
+          raise
+
+  def mirror_path(self, url):
+    """Returns the path of the mirror for the given remote url."""
+    name = re.sub(r'\.git$', '', url.rstrip('/').split('/')[-1])
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', name) or 'repository'
+    digest = hashlib.sha1(url).hexdigest()[:12]
+    return os.path.join(self.__cache_dir,
+                        '{name}-{digest}{suffix}'.format(
+                            name=name, digest=digest, suffix=_MIRROR_SUFFIX))
+
+  def __lock_mirror(self, path, blocking=True):
+    """Returns an open lock file for the mirror, or None if it is busy."""
+    lock_file = open(path + '.lock', 'a')
+    try:
+      fcntl.flock(lock_file,
+                  fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as ex:
+      lock_file.close()
+      if ex.errno in [errno.EAGAIN, errno.EACCES]:
+        return None
+      raise
+    return lock_file
+
+  def refresh(self, url):
+    """Bring the mirror for a url up to date, creating it if needed.
+
+    Args:
+      url [string]: The remote repository url.
+
+    Returns:
+      The path to the mirror.
+    """
+    path = self.mirror_path(url)
+    with self.__lock:
+      self.__used.add(path)
+    lock_file = self.__lock_mirror(path)
+    try:
+      if os.path.exists(path):
+        if self.__dissociate:
+          fetch = 'fetch --prune --quiet origin'
+        else:
+          # Clones may still borrow objects that pruning would drop.
+          fetch = '-c gc.auto=0 fetch --quiet origin'
+        check_run_quick('git -C "{path}" {fetch}'.format(path=path,
+                                                          fetch=fetch),
+                        echo=False)
+      else:
+        # Clone aside then rename so a failure does not leave a partial
+        # mirror behind.
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+          shutil.rmtree(tmp_path)
+        check_run_quick('git clone --mirror --quiet {url} "{path}"'
+                        .format(url=url, path=tmp_path), echo=False)
+        os.rename(tmp_path, path)
+      with open(os.path.join(path, _LAST_USED_FILE), 'w') as f:
+        f.write('{0}\n'.format(time.time()))
+    finally:
+      lock_file.close()
+    return path
+
+  def get_clone_options(self, url):
+    """Refresh the url's mirror and return 'git clone' options using it."""
+    path = self.refresh(url)
+    options = '--reference "{path}"'.format(path=path)
+    if self.__dissociate:
+      options += ' --dissociate'
+    return options
+
+  def clone(self, url, dest, options=''):
+    """Clone a remote repository, borrowing objects from the cache.
+
+    Args:
+      url [string]: The remote repository url.
+      dest [string]: The directory to clone into.
+      options [string]: Additional 'git clone' options.
+    """
+    check_run_quick('git clone {cache_options} {options} {url} "{dest}"'
+                    .format(cache_options=self.get_clone_options(url),
+                            options=options, url=url, dest=dest),
+                    echo=False)
+
+  def __last_used(self, path):
+    try:
+      return os.path.getmtime(os.path.join(path, _LAST_USED_FILE))
+    except OSError:
+      return os.path.getmtime(path)
+
+  def gc(self):
+    """Remove least recently used mirrors until within the limits.
+
+    Mirrors refreshed through this instance and mirrors that another process
+    is currently fetching are never removed.
+
+    Returns:
+      The list of removed mirror paths.
+    """
+    if self.__max_bytes <= 0 and self.__max_entries <= 0:
+      return []
+
+    entries = []
+    for name in os.listdir(self.__cache_dir):
+      path = os.path.join(self.__cache_dir, name)
+      if name.endswith(_MIRROR_SUFFIX) and os.path.isdir(path):
+        entries.append((self.__last_used(path), path, _directory_size(path)))
+    entries.sort()
+
+    total_bytes = sum([size for _, _, size in entries])
+    num_entries = len(entries)
+    removed = []
+    with self.__lock:
+      used = set(self.__used)
+    for _, path, size in entries:
+      over_bytes = self.__max_bytes > 0 and total_bytes > self.__max_bytes
+      over_entries = (self.__max_entries > 0
+                      and num_entries > self.__max_entries)
+      if not over_bytes and not over_entries:
+        break
+      if path in used:
+        continue
+      lock_file = self.__lock_mirror(path, blocking=False)
+      if lock_file is None:
+        continue
+      try:
+        shutil.rmtree(path)
+      finally:
+        # Keep the lock file since another process may be waiting on it.
+        lock_file.close()
+      total_bytes -= size
+      num_entries -= 1
+      removed.append(path)
+    return removed
+
+  @classmethod
+  def init_argument_parser(cls, parser):
+    """Initialize command-line arguments."""
+    parser.add_argument('--git_cache_dir', default='',
+                        help='If set, keep bare mirrors of the repositories'
+                             ' here and borrow their objects when cloning.')
+    parser.add_argument('--git_cache_max_gb', default=0, type=float,
+                        help='If positive, remove least recently used'
+                             ' mirrors to keep the cache within this size.')
+    parser.add_argument('--git_cache_max_entries', default=0, type=int,
+                        help='If positive, remove least recently used'
+                             ' mirrors to keep at most this many.')
+    parser.add_argument('--git_cache_dissociate', default=False,
+                        action='store_true',
+                        help='Copy borrowed objects into clones so they do'
+                             ' not break if their mirror is removed.'
+                             ' This is implied by --git_cache_max_gb and'
+                             ' --git_cache_max_entries.')
+
+  @classmethod
+  def make_from_options(cls, options):
+    """Returns the cache configured by the options, or None if disabled."""
+    cache_dir = getattr(options, 'git_cache_dir', '')
+    if not cache_dir:
+      return None
+    return cls(cache_dir,
+               max_bytes=int(options.git_cache_max_gb * 1024 * 1024 * 1024),
+               max_entries=options.git_cache_max_entries,
+               dissociate=options.git_cache_dissociate)
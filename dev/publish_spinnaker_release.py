@@ -20,6 +20,7 @@ import sys
 
 from publish_bom import BomPublisher
 from publish_changelog import ChangelogPublisher
+from git_object_cache import GitObjectCache
 from reconstruct_source import SourceReconstructor
 
 
@@ -27,6 +28,7 @@ def init_argument_parser(parser):
   # ChangelogPublisher subclasses BomPublisher, only need to initialize
   # the subclass's flags.
   ChangelogPublisher.init_argument_parser(parser)
+  GitObjectCache.init_argument_parser(parser)
 
 def main():
   """Publish a validated Spinnaker release.
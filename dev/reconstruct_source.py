@@ -20,6 +20,8 @@ import yaml
 
 from spinnaker.run import check_run_quick
 
+from git_object_cache import GitObjectCache
+
 COMPONENTS = [
   'clouddriver',
   'deck',
@@ -39,6 +41,7 @@ class SourceReconstructor(object):
   def __init__(self, options, bom_version=None):
     self.__bom_dict = {}
     self.__bom_version = bom_version or options.bom_version
+    self.__git_cache = GitObjectCache.make_from_options(options)
 
   def reconstruct_source_from_bom(self):
     """Reconstruct the Spinnaker source repositories from a BOM.
@@ -61,7 +64,10 @@ class SourceReconstructor(object):
       if comp != 'spinnaker':
         component_uri = '{prefix}/{component}.git'.format(prefix=git_prefix,
                                                           component=comp)
-        check_run_quick('git clone {0}'.format(component_uri))
+        if self.__git_cache:
+          self.__git_cache.clone(component_uri, comp)
+        else:
+          check_run_quick('git clone {0}'.format(component_uri))
 
       entry_key = ''
       if comp == 'spinnaker-monitoring':
@@ -76,12 +82,17 @@ class SourceReconstructor(object):
       check_run_quick('git -C {0} checkout {1}'.format(comp, commit))
       check_run_quick('git -C {0} tag {1} HEAD || true'.format(comp, tag))
 
+    if self.__git_cache:
+      for path in self.__git_cache.gc():
+        print 'Removed least recently used git cache {0}'.format(path)
+
   @classmethod
   def init_argument_parser(cls, parser):
     """Initialize command-line arguments.
     """
     parser.add_argument('--bom_version', default='', required=True,
                         help="The BOM version to reconstruct the source from.")
+    GitObjectCache.init_argument_parser(parser)
 
   @classmethod
   def main(cls):
@@ -16,14 +16,20 @@
 
 import argparse
 import collections
+import json
+import multiprocessing.pool
 import os
 import sys
+import threading
+import time
 
 from spinnaker.run import check_run_and_monitor
 from spinnaker.run import check_run_quick
 from spinnaker.run import run_and_monitor
 from spinnaker.run import run_quick
 
+from git_object_cache import GitObjectCache
+
 
 def get_repository_dir(name):
   """Determine the local directory that a given repository is in.
@@ -52,6 +58,59 @@ class SourceRepository(
   pass
 
 
+class RefreshState(object):
+  """Records which repositories finished each refresh operation.
+
+  The state is kept in a local json file so that if a refresh is interrupted
+  then resuming it only revisits the repositories that did not finish.
+  An operation's record is discarded once every repository finished it.
+  """
+
+  def __init__(self, path):
+    """Constructor.
+
+    Args:
+      path [string]: The path to the state file, or None to not keep state.
+    """
+    self.__path = path
+    self.__lock = threading.Lock()
+    self.__operations = {}
+    if path and os.path.exists(path):
+      try:
+        with open(path, 'r') as f:
+          self.__operations = json.load(f)
+      except ValueError:
+        sys.stderr.write('WARNING: Ignoring malformed {path}\n'.format(
+            path=path))
+
+  def finished(self, operation):
+    """Returns the names of the repositories that finished the operation."""
+    with self.__lock:
+      return set(self.__operations.get(operation, {}).keys())
+
+  def mark_finished(self, operation, name, status):
+    with self.__lock:
+      self.__operations.setdefault(operation, {})[name] = status
+      self.__save()
+
+  def clear(self, operation):
+    with self.__lock:
+      if self.__operations.pop(operation, None) is not None:
+        self.__save()
+
+  def __save(self):
+    if not self.__path:
+      return
+    if not self.__operations:
+      if os.path.exists(self.__path):
+        os.remove(self.__path)
+      return
+    tmp_path = self.__path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(self.__operations, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, self.__path)
+
+
 class Refresher(object):
   """Provides branch management capabilities across Spinnaker repositories.
 
@@ -141,6 +200,9 @@ class Refresher(object):
 
   def __init__(self, options):
       self.__options = options
+      self.__state = RefreshState(
+          getattr(options, 'refresh_state_file', None))
+      self.__git_cache = GitObjectCache.make_from_options(options)
       self.__extra_repositories = self.__OPTIONAL_REPOSITORIES
       if options.extra_repos:
         for extra in options.extra_repos.split(','):
@@ -204,6 +266,46 @@ class Refresher(object):
                      else 'git@github.com:{user}/{name}.git')
       return url_pattern.format(user=user, name=repository.name)
 
+  def get_clone_options(self, repository, url=None):
+      """Determine the additional 'git clone' options for a repository.
+
+      These come from --clone_depth, --clone_filter, --clone_reference_dir
+      and --git_cache_dir. Using the git cache refreshes the repository's
+      mirror.
+
+      Args:
+        repository [SourceRepository]: The repository being cloned.
+        url [string]: The url being cloned from, for the git cache.
+
+      Returns:
+        A string of options, which may be empty.
+      """
+      clone_options = []
+      depth = getattr(self.__options, 'clone_depth', 0)
+      if depth:
+          clone_options.append('--depth {depth}'.format(depth=depth))
+      clone_filter = getattr(self.__options, 'clone_filter', '')
+      if clone_filter:
+          clone_options.append('--filter={filter}'.format(filter=clone_filter))
+      reference_dir = getattr(self.__options, 'clone_reference_dir', '')
+      if reference_dir:
+          for name in [repository.name, repository.name + '.git']:
+            path = os.path.join(reference_dir, name)
+            if os.path.exists(path):
+              clone_options.append('--reference-if-able "{path}"'.format(
+                  path=path))
+              break
+      if self.__git_cache and url:
+          try:
+            clone_options.append(self.__git_cache.get_clone_options(url))
+          except RuntimeError as ex:
+            # Let the clone itself fail, such as for an optional repository
+            # that does not exist.
+            sys.stderr.write(
+                'WARNING: Cloning {url} without the git cache: {ex}\n'.format(
+                    url=url, ex=ex))
+      return ' '.join(clone_options)
+
   def git_clone(self, repository, owner=None):
       """Clone the specified repository
 
@@ -211,6 +313,9 @@ class Refresher(object):
         repository [string]: The name of the github repository (without owner).
         owner [string]: An explicit repository owner.
                If not provided use the configured options.
+
+      Returns:
+        A brief description of the outcome.
       """
       name = repository.name
       repository_dir = get_repository_dir(name)
@@ -223,8 +328,11 @@ class Refresher(object):
       # Don't echo because we're going to hide some failure.
       print 'Cloning {name} from {origin_url} -b {branch}.'.format(
           name=name, origin_url=origin_url, branch=branch)
+      clone_options = self.get_clone_options(repository, url=origin_url)
       shell_result = run_and_monitor(
-          'git clone {url} -b {branch}'.format(url=origin_url, branch=branch),
+          'git clone {url} -b {branch}{options}'.format(
+              url=origin_url, branch=branch,
+              options=' ' + clone_options if clone_options else ''),
           echo=False)
       if not shell_result.returncode:
           if shell_result.stdout:
@@ -234,7 +342,7 @@ class Refresher(object):
              sys.stderr.write('WARNING: Missing optional repository {name}.\n'
                                   .format(name=name))
              sys.stderr.write('         Continue on without it.\n')
-             return
+             return 'missing optional repository'
           sys.stderr.write(shell_result.stderr or shell_result.stdout)
           sys.stderr.write(
               'FATAL: Cannot continue without required repository {name}.\n'
@@ -257,18 +365,21 @@ class Refresher(object):
               'git -C "{dir}" remote set-url --push {which} disabled'
                   .format(dir=repository_dir, which=which),
               echo=False)
+      return 'cloned'
 
   def pull_from_origin(self, repository):
       """Pulls the current branch from the git origin.
 
       Args:
         repository [string]: The local repository to update.
+
+      Returns:
+        A brief description of the outcome.
       """
       name = repository.name
       repository_dir = get_repository_dir(name)
       if not os.path.exists(repository_dir):
-          self.git_clone(repository)
-          return
+          return self.git_clone(repository)
 
       print 'Updating {name} from origin'.format(name=name)
       branch = self.get_local_branch_name(name)
@@ -282,11 +393,12 @@ class Refresher(object):
               'WARNING: Skipping {name} because branch={branch},'
               ' *NOT* "{want}"\n'
               .format(name=name, branch=branch, want=self.pull_branch))
-          return
+          return 'skipped branch={branch}'.format(branch=branch)
       try:
         check_run_and_monitor('git -C "{dir}" pull origin {branch} --tags'
                                   .format(dir=repository_dir, branch=branch),
                               echo=True)
+        return 'pulled {branch}'.format(branch=branch)
       except RuntimeError:
         result = check_run_and_monitor('git -C "{dir}" branch -r'
                                            .format(dir=repository_dir),
@@ -296,6 +408,7 @@ class Refresher(object):
         sys.stderr.write(
               'WARNING {name} branch={branch} is not known to the origin.\n'
               .format(name=name, branch=branch))
+        return 'branch={branch} not in origin'.format(branch=branch)
 
   def pull_from_upstream_if_master(self, repository):
       """Pulls the master branch from the upstream repository.
@@ -305,24 +418,28 @@ class Refresher(object):
 
       Args:
         repository [string]: The name of the local repository to update.
+
+      Returns:
+        A brief description of the outcome.
       """
       name = repository.name
       repository_dir = get_repository_dir(name)
       if not os.path.exists(repository_dir):
-          self.pull_from_origin(repository)
+          outcome = self.pull_from_origin(repository)
           if not os.path.exists(repository_dir):
-            return
+            return outcome
         
       branch = self.get_local_branch_name(name)
       if branch != 'master':
           sys.stderr.write('Skipping {name} because it is in branch={branch}.\n'
                            .format(name=name, branch=branch))
-          return
+          return 'skipped branch={branch}'.format(branch=branch)
 
       print 'Pulling master {name} from upstream'.format(name=name)
       check_run_and_monitor('git -C "{dir}" pull upstream master --tags'
                                 .format(dir=repository_dir),
                             echo=True)
+      return 'pulled master'
 
   def push_to_origin_if_target_branch(self, repository):
       """Pushes the current target branch of the local repository to the origin.
@@ -332,25 +449,104 @@ class Refresher(object):
 
       Args:
         repository [string]: The name of the local repository to push from.
+
+      Returns:
+        A brief description of the outcome.
       """
       name = repository.name
       repository_dir = get_repository_dir(name)
       if not os.path.exists(repository_dir):
           sys.stderr.write('Skipping {name} because it does not yet exist.\n'
                                .format(name=name))
-          return
+          return 'skipped missing'
 
       branch = self.get_local_branch_name(name)
       if branch != self.push_branch:
           sys.stderr.write(
               'Skipping {name} because it is in branch={branch}, not {want}.\n'
                   .format(name=name, branch=branch, want=self.push_branch))
-          return
+          return 'skipped branch={branch}'.format(branch=branch)
 
       print 'Pushing {name} to origin.'.format(name=name)
       check_run_and_monitor('git -C "{dir}" push origin {branch} --tags'.format(
                                 dir=repository_dir, branch=self.push_branch),
                             echo=True)
+      return 'pushed {branch}'.format(branch=self.push_branch)
+
+  def for_all_repositories(self, operation, func):
+    """Apply an operation to all the repositories concurrently.
+
+    Up to --refresh_workers repositories are processed at once. With --resume,
+    repositories that already finished this operation in an earlier,
+    interrupted run are not revisited. Otherwise every repository is
+    processed and the earlier progress is discarded. A status table is
+    printed once all have been attempted.
+
+    Args:
+      operation [string]: Identifies the operation in the refresh state.
+      func [callable]: Called with each SourceRepository. Returns a brief
+         description of the outcome.
+
+    Raises:
+      The first error raised by func, once all repositories were attempted.
+    """
+    all_repos = self.__REQUIRED_REPOSITORIES + self.__extra_repositories
+    if getattr(self.__options, 'resume', False):
+      finished = self.__state.finished(operation)
+    else:
+      self.__state.clear(operation)
+      finished = set()
+    skipped = sorted([repository.name for repository in all_repos
+                      if repository.name in finished])
+    if skipped:
+      sys.stderr.write(
+          'WARNING: Resuming "{operation}" by skipping {names}, which'
+          ' finished in an earlier run recorded in {path}.\n'.format(
+              operation=operation, names=', '.join(skipped),
+              path=self.__options.refresh_state_file))
+    statuses = {}
+    errors = []
+
+    def process(repository):
+      name = repository.name
+      if name in finished:
+        statuses[name] = ('RESUMED', 0, 'finished in an earlier run')
+        return
+      start = time.time()
+      try:
+        outcome = func(repository) or 'ok'
+      except (Exception, SystemExit) as ex:
+        statuses[name] = ('FAILED', time.time() - start,
+                          str(ex).strip().split('\n')[-1])
+        errors.append(sys.exc_info())
+        return
+      statuses[name] = ('OK', time.time() - start, outcome)
+      self.__state.mark_finished(operation, name, outcome)
+
+    workers = max(1, getattr(self.__options, 'refresh_workers', 1))
+    pool = multiprocessing.pool.ThreadPool(
+        processes=min(workers, len(all_repos)))
+    try:
+      pool.map(process, all_repos)
+    finally:
+      pool.close()
+      pool.join()
+
+    print '\n{operation}:'.format(operation=operation)
+    print '  {0:<24} {1:<8} {2:>7}  {3}'.format(
+        'REPOSITORY', 'STATUS', 'SECS', 'DETAIL')
+    for repository in all_repos:
+      status, secs, detail = statuses[repository.name]
+      print '  {0:<24} {1:<8} {2:>7.1f}  {3}'.format(
+          repository.name, status, secs, detail)
+
+    if self.__git_cache:
+      for path in self.__git_cache.gc():
+        print 'Removed least recently used git cache {path}'.format(path=path)
+
+    if errors:
+      raise errors[0][0], errors[0][1], errors[0][2]
+    self.__state.clear(operation)
 
   def push_all_to_origin_if_target_branch(self):
     """Push all the local repositories current target branch to origin.
@@ -358,9 +554,9 @@ class Refresher(object):
     This will skip any local repositories that are not currently in the
     target branch.
     """
-    all_repos = self.__REQUIRED_REPOSITORIES + self.__extra_repositories
-    for repository in all_repos:
-        self.push_to_origin_if_target_branch(repository)
+    self.for_all_repositories(
+        'push_origin {branch}'.format(branch=self.push_branch),
+        self.push_to_origin_if_target_branch)
 
   def pull_all_from_upstream_if_master(self):
     """Pull all the upstream master branches into their local repository.
@@ -368,9 +564,8 @@ class Refresher(object):
     This will skip any local repositories that are not currently in the master
     branch.
     """
-    all_repos = self.__REQUIRED_REPOSITORIES + self.__extra_repositories
-    for repository in all_repos:
-        self.pull_from_upstream_if_master(repository)
+    self.for_all_repositories('pull_upstream master',
+                              self.pull_from_upstream_if_master)
 
   def pull_all_from_origin(self):
     """Pull all the origin target branches into their local repository.
@@ -378,20 +573,23 @@ class Refresher(object):
     This will skip any local repositories that are not currently in the
     target branch.
     """
-    all_repos = self.__REQUIRED_REPOSITORIES + self.__extra_repositories
-    for repository in all_repos:
+    def pull(repository):
         try:
-          self.pull_from_origin(repository)
+          return self.pull_from_origin(repository)
         except RuntimeError as ex:
           if repository in self.__extra_repositories and not os.path.exists(
-              get_repository_dir(repository)):
+              get_repository_dir(repository.name)):
               sys.stderr.write(
                    'IGNORING error "{msg}" in optional repository {name}'
                    ' because the local repository does not yet exist.\n'
                        .format(msg=ex.message, name=repository.name))
+              return 'ignored error in optional repository'
           else:
               raise
 
+    self.for_all_repositories(
+        'pull_origin {branch}'.format(branch=self.pull_branch), pull)
+
   def __determine_spring_config_location(self):
     root = '{dir}/config'.format(
         dir=os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -539,6 +737,34 @@ bash -c "(./start.sh >> '$LOG_DIR/{name}.log') 2>&1\
                                ' If the user is "default" then use the'
                                ' authoritative (upstream) repository.')
 
+      parser.add_argument('--refresh_workers', default=4, type=int,
+                          help='The number of repositories to process'
+                               ' concurrently.')
+      parser.add_argument('--refresh_state_file',
+                          default='.refresh_source_state.json',
+                          help='Records which repositories finished so that'
+                               ' an interrupted refresh can be resumed with'
+                               ' --resume. An empty value disables this.')
+      parser.add_argument('--resume', default=False, action='store_true',
+                          help='Skip the repositories that finished in an'
+                               ' earlier refresh recorded in'
+                               ' --refresh_state_file.')
+
+      parser.add_argument('--clone_depth', default=0, type=int,
+                          help='If positive, make shallow clones with this'
+                               ' many commits of history.')
+      parser.add_argument('--clone_filter', default='',
+                          help='If set, make partial clones with this'
+                               ' object filter, such as "blob:none".'
+                               ' The origin must support partial clones.')
+      parser.add_argument('--clone_reference_dir', default='',
+                          help='A directory containing existing <name> or'
+                               ' <name>.git repositories to borrow objects'
+                               ' from when cloning. These must not be removed'
+                               ' while the clones still use them.')
+
+      GitObjectCache.init_argument_parser(parser)
+
       parser.add_argument('--update_run_scripts', default=True,
                           action='store_true',
                           help='Update the run script for each component.')
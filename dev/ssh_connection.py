@@ -0,0 +1,195 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shares a single ssh connection to a host between many commands.
+
+The SshConnectionManager keeps an OpenSSH ControlMaster connection to the
+host in the background. The ssh and scp commands it makes are multiplexed
+over that connection so they do not each pay for a new key exchange or count
+against the host's sshd MaxStartups limit. If the master is not running the
+commands connect directly as before.
+
+Port forwards are added to the master with "ssh -O forward" because they
+then live as long as the master rather than as long as some client.
+"""
+
+import logging
+import os
+import pipes
+import shutil
+import tempfile
+import threading
+
+from spinnaker.run import run_quick
+
+
+class SshConnectionManager(object):
+  """Makes ssh and scp commands that share a master connection to a host."""
+
+  @property
+  def destination(self):
+    """The user@host to connect to."""
+    return '{user}@{host}'.format(user=self.__user, host=self.__host)
+
+  @property
+  def control_path(self):
+    """The path to the master connection's control socket."""
+    return os.path.join(self.__control_dir, 'master')
+
+  def __init__(self, user, host, key_path, control_dir=None):
+    """Constructor.
+
+    Args:
+      user [string]: The user to log in as.
+      host [string]: The host to connect to.
+      key_path [string]: The path to the private key to log in with.
+      control_dir [string]: The directory for the control socket.
+         This should have a short path since socket paths are limited
+         to around 100 characters. Defaults to a new temporary directory.
+    """
+    self.__user = user
+    self.__host = host
+    self.__key_path = key_path
+    self.__owns_control_dir = control_dir is None
+    self.__control_dir = control_dir or tempfile.mkdtemp(prefix='ssh')
+    self.__lock = threading.Lock()
+
+  def __make_options(self, control_master='no'):
+    return ' '.join([
+        '-i {key}'.format(key=pipes.quote(self.__key_path)),
+        '-o StrictHostKeyChecking=no',
+        '-o UserKnownHostsFile=/dev/null',
+        '-o ControlMaster={0}'.format(control_master),
+        '-o ControlPath={0}'.format(pipes.quote(self.control_path))])
+
+  def make_master_command(self):
+    """Returns the shell command to start the master in the background.
+
+    The master does not hold on to the caller's output because its log is
+    written to a file instead.
+    """
+    return ('ssh {options} -o ControlPersist=yes -o ServerAliveInterval=15'
+            ' -E {log} -f -N {dest} < /dev/null > /dev/null 2>&1'
+            .format(options=self.__make_options(control_master='yes'),
+                    log=pipes.quote(os.path.join(self.__control_dir,
+                                                 'master.log')),
+                    dest=self.destination))
+
+  def make_check_command(self):
+    """Returns the shell command that succeeds if the master is running."""
+    return 'ssh {options} -O check {dest} > /dev/null 2>&1'.format(
+        options=self.__make_options(), dest=self.destination)
+
+  def make_ensure_master_command(self):
+    """Returns the shell command to start the master if it is not running.
+
+    This is locked so that concurrent commands do not start several masters.
+    The master must not inherit the lock or it would hold it forever.
+    """
+    return '(flock 9; {check} || {start} 9>&-) 9> {lock}'.format(
+        check=self.make_check_command(), start=self.make_master_command(),
+        lock=pipes.quote(os.path.join(self.__control_dir, 'master.lock')))
+
+  def ensure_master(self):
+    """Start the master connection unless it is already running.
+
+    Returns:
+      True if the master is running, False if it could not be started,
+      for example because the host is not yet accepting ssh.
+    """
+    with self.__lock:
+      result = run_quick(self.make_ensure_master_command(), echo=False)
+    if result.returncode != 0:
+      logging.info('ssh master to %s is not available', self.destination)
+      return False
+    return True
+
+  def make_ssh_command(self, remote_command=None):
+    """Returns the shell command to run a command on the host.
+
+    Args:
+      remote_command [string]: The command to run remotely, or None to
+         just connect.
+    """
+    command = 'ssh {options} {dest}'.format(options=self.__make_options(),
+                                            dest=self.destination)
+    if remote_command:
+      command += ' ' + pipes.quote(remote_command)
+    return command
+
+  def make_scp_command(self, local_paths, remote_dir='~'):
+    """Returns the shell command to copy local files to the host.
+
+    Args:
+      local_paths [list of string]: The files to copy.
+      remote_dir [string]: The directory to copy them into.
+    """
+    return 'scp {options} {files} {dest}:{remote_dir}'.format(
+        options=self.__make_options(),
+        files=' '.join([pipes.quote(path) for path in local_paths]),
+        dest=self.destination, remote_dir=remote_dir)
+
+  def make_fetch_files_command(self, remote_paths, local_dir):
+    """Returns the shell command to fetch remote files as one tar stream.
+
+    The files are written into local_dir by their base name. Remote files
+    that do not exist are skipped.
+
+    Args:
+      remote_paths [list of string]: The absolute paths of the files.
+      local_dir [string]: The directory to write the files into.
+    """
+    remote_command = 'tar -czf - --ignore-failed-read -C / {paths}'.format(
+        paths=' '.join([pipes.quote(path.lstrip('/'))
+                        for path in remote_paths]))
+    return ('{ssh} | tar -xzf - -C {local_dir} --transform "s,.*/,,"'
+            .format(ssh=self.make_ssh_command(remote_command),
+                    local_dir=pipes.quote(local_dir)))
+
+  def make_port_forward_command(self, local_port, remote_port,
+                                check_interval_secs=10):
+    """Returns the command that forwards a local port to the host.
+
+    The command adds the forward to the master, starting the master if
+    needed, then runs for as long as the master does.
+
+    Args:
+      local_port [int]: The local port to listen on.
+      remote_port [int]: The port on the host to forward to.
+      check_interval_secs [int]: How often to check that the master is alive.
+
+    Returns:
+      array of commandline arguments to create a subprocess with.
+    """
+    script = (
+        '{ensure_master} || exit 1'
+        '; ssh {options} -O forward -L {local_port}:localhost:{remote_port}'
+        ' {dest} || exit 1'
+        '; while {check}; do sleep {interval}; done'
+        .format(ensure_master=self.make_ensure_master_command(),
+                check=self.make_check_command(),
+                options=self.__make_options(),
+                local_port=local_port, remote_port=remote_port,
+                dest=self.destination, interval=check_interval_secs))
+    return ['/bin/sh', '-c', script]
+
+  def close(self):
+    """Stop the master connection and its port forwards."""
+    with self.__lock:
+      if os.path.exists(self.control_path):
+        run_quick('ssh {options} -O exit {dest}'.format(
+            options=self.__make_options(), dest=self.destination),
+                  echo=False)
+      if self.__owns_control_dir:
+        shutil.rmtree(self.__control_dir, ignore_errors=True)
@@ -0,0 +1,165 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reads a git repository's tags directly from its .git directory.
+
+This avoids running 'git show-ref --tags' and then a 'git tag -d' per
+unwanted tag, which for repositories with thousands of tags is thousands
+of subprocesses.
+"""
+
+import os
+import re
+import subprocess
+
+
+_SEMVER_RE = re.compile(r'(?:^|[^0-9])([0-9]+)\.([0-9]+)\.([0-9]+)$')
+_TAGS_PREFIX = 'refs/tags/'
+
+
+def _find_common_git_dir(path):
+  """Returns the directory holding the refs for the repository at path."""
+  git_dir = os.path.join(path, '.git')
+  if os.path.isfile(git_dir):
+    # A worktree or submodule whose .git file points at the real directory.
+    with open(git_dir, 'r') as f:
+      content = f.read().strip()
+    if not content.startswith('gitdir:'):
+      raise ValueError('Unexpected {0} content: {1}'.format(git_dir, content))
+    git_dir = os.path.join(path, content[len('gitdir:'):].strip())
+  elif not os.path.isdir(git_dir):
+    git_dir = path  # A bare repository.
+
+  commondir_path = os.path.join(git_dir, 'commondir')
+  if os.path.exists(commondir_path):
+    with open(commondir_path, 'r') as f:
+      git_dir = os.path.join(git_dir, f.read().strip())
+  return os.path.normpath(git_dir)
+
+
+class TagIndex(object):
+  """The tags in a repository, mapped to the objects they refer to.
+
+  Like 'git show-ref --tags', the hash for an annotated tag is that of the
+  tag object rather than the commit it points at.
+  """
+
+  # Parsed semantic versions keyed by tag name, shared across indexes since
+  # the same names recur in every repository.
+  __semver_cache = {}
+
+  @property
+  def path(self):
+    return self.__path
+
+  @property
+  def tags(self):
+    """Dictionary of hashes keyed by tag name (relative to refs/tags)."""
+    return dict(self.__tags)
+
+  def __init__(self, path):
+    """Constructor.
+
+    Args:
+      path [string]: Path to the git repository.
+    """
+    self.__path = path
+    self.__git_dir = _find_common_git_dir(path)
+    self.__tags = {}
+    self.reload()
+
+  def reload(self):
+    """Re-read the tags from the repository."""
+    tags = {}
+    packed_refs_path = os.path.join(self.__git_dir, 'packed-refs')
+    if os.path.exists(packed_refs_path):
+      with open(packed_refs_path, 'r') as f:
+        for line in f:
+          # Skip the header and the '^<hash>' peeled lines.
+          if line.startswith('#') or line.startswith('^'):
+            continue
+          hash, _, ref = line.rstrip('\n').partition(' ')
+          if ref.startswith(_TAGS_PREFIX):
+            tags[ref[len(_TAGS_PREFIX):]] = hash
+
+    # Loose refs take precedence over packed ones.
+    tags_dir = os.path.join(self.__git_dir, 'refs', 'tags')
+    for root, _, files in os.walk(tags_dir):
+      for name in files:
+        file_path = os.path.join(root, name)
+        try:
+          with open(file_path, 'r') as f:
+            hash = f.read().strip()
+        except IOError:
+          continue  # Deleted while we were looking.
+        if hash and not hash.startswith('ref:'):
+          tags[os.path.relpath(file_path, tags_dir)] = hash
+
+    self.__tags = tags
+
+  @classmethod
+  def semver(cls, tag):
+    """Returns the (major, minor, patch) ending the tag name, or None."""
+    try:
+      return cls.__semver_cache[tag]
+    except KeyError:
+      pass
+    match = _SEMVER_RE.search(tag)
+    version = (tuple(int(part) for part in match.groups())
+               if match else None)
+    cls.__semver_cache[tag] = version
+    return version
+
+  def partition(self, matcher):
+    """Partition the tags on whether the name matches a regex.
+
+    Args:
+      matcher [re.RegexObject]: The tag name pattern.
+
+    Returns:
+      A (matching, other) pair of lists of (tag, hash). The matching tags
+      are sorted by descending semantic version, then name.
+    """
+    matching = []
+    other = []
+    for tag, hash in self.__tags.iteritems():
+      if matcher.match(tag):
+        matching.append((self.semver(tag) or (), tag, hash))
+      else:
+        other.append((tag, hash))
+    matching.sort(reverse=True)
+    other.sort()
+    return [(tag, hash) for _, tag, hash in matching], other
+
+  def delete_tags(self, tags):
+    """Delete tags from the repository in a single transaction.
+
+    Args:
+      tags [list of string]: The tag names to delete.
+    """
+    if not tags:
+      return
+    commands = ''.join(['delete {prefix}{tag}\n'.format(prefix=_TAGS_PREFIX,
+                                                         tag=tag)
+                        for tag in tags])
+    process = subprocess.Popen(
+        ['git', '-C', self.__path, 'update-ref', '--stdin'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        close_fds=True)
+    stdout, stderr = process.communicate(commands)
+    if process.returncode != 0:
+      raise IOError('Failed to delete {count} tags in {path}: {error}'.format(
+          count=len(tags), path=self.__path, error=stderr.strip()))
+    for tag in tags:
+      self.__tags.pop(tag, None)
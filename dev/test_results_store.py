@@ -0,0 +1,248 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps the outcome and timing of every validate_bom test run.
+
+Each test run is appended to a JSON lines file as one record. Records hold
+how long the test waited before it started, split into the time it was held
+back by --test_concurrency and by --test_quota, how long it executed, its
+exit code and where its log is.
+
+Running this module summarizes the recorded runs, showing the median and
+95th percentile duration of each test, how its median changed from the
+previous runs, and how flaky it is:
+
+  python test_results_store.py validate_bom_test_results.jsonl --runs 10
+"""
+
+import argparse
+import collections
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+
+PASSED = 'PASSED'
+FAILED = 'FAILED'
+SKIPPED = 'SKIPPED'
+
+
+def make_run_id():
+  """Returns a new identifier for a test run, sortable by time."""
+  return '{time}-{id}'.format(time=time.strftime('%Y%m%d%H%M%S'),
+                              id=uuid.uuid4().hex[:8])
+
+
+class TestResultsStore(object):
+  """Appends test results to a JSON lines file."""
+
+  @property
+  def path(self):
+    return self.__path
+
+  @property
+  def run_id(self):
+    return self.__run_id
+
+  def __init__(self, path, run_id=None, labels=None):
+    """Constructor.
+
+    Args:
+      path [string]: The file to append the results to.
+      run_id [string]: Identifies this run in the records.
+      labels [dict]: Additional values to add to every record, such as the
+         version being validated.
+    """
+    self.__path = path
+    self.__run_id = run_id or make_run_id()
+    self.__labels = dict(labels or {})
+    self.__lock = threading.Lock()
+
+  def record(self, test, outcome, start_time=None, queue_wait_secs=0.0,
+             semaphore_wait_secs=0.0, quota_wait_secs=0.0,
+             execution_secs=None, exit_code=None, log_path=None):
+    """Append the result of a test.
+
+    Args:
+      test [string]: The name of the test.
+      outcome [string]: PASSED, FAILED or SKIPPED.
+      start_time [float]: When the test started executing.
+      queue_wait_secs [float]: How long the test waited to start once it
+         was ready to run.
+      semaphore_wait_secs [float]: The part of the queue wait spent waiting
+         for fewer tests to be running.
+      quota_wait_secs [float]: The part of the queue wait spent waiting
+         for quota.
+      execution_secs [float]: How long the test ran, if it ran.
+      exit_code [int]: The test's exit code, if it ran.
+      log_path [string]: The test's log file.
+    """
+    entry = dict(self.__labels)
+    entry.update({
+        'run': self.__run_id,
+        'test': test,
+        'outcome': outcome,
+        'recorded_at': time.time(),
+        'start_time': start_time,
+        'queue_wait_secs': round(queue_wait_secs, 3),
+        'semaphore_wait_secs': round(semaphore_wait_secs, 3),
+        'quota_wait_secs': round(quota_wait_secs, 3),
+        'execution_secs': (None if execution_secs is None
+                           else round(execution_secs, 3)),
+        'exit_code': exit_code,
+        'log_path': log_path
+    })
+
+    # A single O_APPEND write keeps records from concurrent runs intact.
+    line = json.dumps(entry, sort_keys=True) + '\n'
+    with self.__lock:
+      fd = os.open(self.__path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+      try:
+        os.write(fd, line)
+      finally:
+        os.close(fd)
+
+
+def load_records(path):
+  """Returns the records in a results file, skipping malformed lines."""
+  records = []
+  with open(path, 'r') as f:
+    for line in f:
+      try:
+        records.append(json.loads(line))
+      except ValueError:
+        pass
+  return records
+
+
+def percentile(values, percent):
+  """Returns the nearest-rank percentile of a list of numbers."""
+  if not values:
+    return None
+  ordered = sorted(values)
+  rank = int(math.ceil(percent / 100.0 * len(ordered)))
+  return ordered[min(len(ordered), max(1, rank)) - 1]
+
+
+def summarize_tests(records, num_runs=10):
+  """Summarize the durations and outcomes of each test.
+
+  Args:
+    records [list of dict]: The records to summarize.
+    num_runs [int]: How many of the most recent runs to summarize. The
+       median is compared against the same number of runs before them.
+
+  Returns:
+    A list of dict, one per test, sorted by name, with the test name and
+    the number of 'runs', 'failures', 'p50_secs', 'p95_secs',
+    'previous_p50_secs', 'flips' (outcome changes between consecutive runs)
+    and 'flakiness' (flips per opportunity to flip).
+  """
+  run_ids = sorted(set([entry['run'] for entry in records]))
+  recent = set(run_ids[-num_runs:])
+  previous = set(run_ids[-2 * num_runs:-num_runs])
+
+  by_test = collections.defaultdict(list)
+  for entry in records:
+    if entry['outcome'] != SKIPPED:
+      by_test[entry['test']].append(entry)
+
+  summaries = []
+  for test in sorted(by_test.keys()):
+    entries = sorted(by_test[test], key=lambda entry: entry['run'])
+    current = [entry for entry in entries if entry['run'] in recent]
+    if not current:
+      continue
+    durations = [entry['execution_secs'] for entry in current
+                 if entry['outcome'] == PASSED
+                 and entry['execution_secs'] is not None]
+    previous_durations = [entry['execution_secs'] for entry in entries
+                          if entry['run'] in previous
+                          and entry['outcome'] == PASSED
+                          and entry['execution_secs'] is not None]
+    outcomes = [entry['outcome'] for entry in current]
+    flips = len([index for index in range(1, len(outcomes))
+                 if outcomes[index] != outcomes[index - 1]])
+    summaries.append({
+        'test': test,
+        'runs': len(current),
+        'failures': outcomes.count(FAILED),
+        'p50_secs': percentile(durations, 50),
+        'p95_secs': percentile(durations, 95),
+        'previous_p50_secs': percentile(previous_durations, 50),
+        'flips': flips,
+        'flakiness': (float(flips) / (len(outcomes) - 1)
+                      if len(outcomes) > 1 else 0.0)
+    })
+  return summaries
+
+
+def format_summaries(summaries):
+  """Returns the test summaries as a table."""
+  def secs(value):
+    return '-' if value is None else '{0:.0f}s'.format(value)
+
+  lines = ['{test:<40} {runs:>4} {failures:>4} {p50:>7} {p95:>7} {trend:>7}'
+           ' {flaky:>6}'.format(test='TEST', runs='RUNS', failures='FAIL',
+                                p50='P50', p95='P95', trend='TREND',
+                                flaky='FLAKY')]
+  for summary in summaries:
+    trend = '-'
+    if summary['p50_secs'] is not None and summary['previous_p50_secs']:
+      trend = '{0:+.0%}'.format(
+          summary['p50_secs'] / summary['previous_p50_secs'] - 1)
+    lines.append(
+        '{test:<40} {runs:>4} {failures:>4} {p50:>7} {p95:>7} {trend:>7}'
+        ' {flaky:>6.0%}'.format(
+            test=summary['test'], runs=summary['runs'],
+            failures=summary['failures'], p50=secs(summary['p50_secs']),
+            p95=secs(summary['p95_secs']), trend=trend,
+            flaky=summary['flakiness']))
+  return '\n'.join(lines)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Summarize the recorded validate_bom test results.')
+  parser.add_argument('path', help='The results file to summarize.')
+  parser.add_argument('--runs', default=10, type=int,
+                      help='The number of most recent runs to summarize.')
+  parser.add_argument('--test', default='.*',
+                      help='Only summarize tests matching this regex.')
+  parser.add_argument('--sort', default='test',
+                      choices=['test', 'p50', 'p95', 'flakiness', 'failures'],
+                      help='How to order the tests.')
+  options = parser.parse_args()
+
+  records = [entry for entry in load_records(options.path)
+             if re.search(options.test, entry['test'])]
+  if not records:
+    sys.stderr.write('No records in {path}\n'.format(path=options.path))
+    return -1
+  summaries = summarize_tests(records, num_runs=options.runs)
+  if options.sort != 'test':
+    key = options.sort if options.sort in ['flakiness', 'failures'] else (
+        options.sort + '_secs')
+    summaries.sort(key=lambda summary: summary[key], reverse=True)
+  print format_summaries(summaries)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
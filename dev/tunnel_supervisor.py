@@ -0,0 +1,224 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps port forwarding tunnels up for as long as they are needed.
+
+A single thread watches all the port forwarding processes. When one exits it
+is restarted with the same command, so it comes back on the same local port.
+On the same thread the tunnels are kept from idling out (kubectl closes
+port forwards left idle for around 30s) by briefly connecting to each of
+their local ports on a shared timer.
+"""
+
+import logging
+import socket
+import subprocess
+import threading
+import time
+
+
+class Tunnel(object):
+  """A port forward managed by a TunnelSupervisor.
+
+  This looks like the subprocess.Popen it manages so that callers can poll()
+  and kill() it. While it is supervised, poll() returns None even if the
+  process is being restarted.
+
+  Attributes:
+    name: The name of the tunnel, typically the service it forwards to.
+    local_port: The local port that is forwarded.
+    resets: The number of times the process was restarted.
+  """
+
+  @property
+  def returncode(self):
+    return self.poll()
+
+  def __init__(self, supervisor, name, command, local_port, popen_kwargs):
+    self.name = name
+    self.local_port = local_port
+    self.resets = 0
+    self.command = command
+    self.popen_kwargs = popen_kwargs
+    self.process = None
+    self.started_at = None
+    self.final_returncode = None
+    self.__supervisor = supervisor
+
+  def poll(self):
+    """Returns None while supervised, else the final exit code."""
+    return self.final_returncode
+
+  def kill(self):
+    """Stop supervising the tunnel and terminate its process."""
+    self.__supervisor.remove(self)
+
+
+class TunnelSupervisor(object):
+  """Runs and watches the port forwarding processes."""
+
+  # How long to wait for a keepalive connection. The tunnels are local so
+  # this is short to keep the watcher from being held up.
+  KEEPALIVE_TIMEOUT_SECS = 0.5
+
+  def __init__(self, check_interval_secs=1.0, keepalive_interval_secs=20,
+               max_resets=10, popen=subprocess.Popen):
+    """Constructor.
+
+    Args:
+      check_interval_secs: [float] How often to check for exited processes.
+      keepalive_interval_secs: [float] How often to connect to each tunnel
+         to keep it from idling out, or 0 to not.
+      max_resets: [int] How many times to restart a tunnel before giving up.
+      popen: [callable] Starts a process, for testing.
+    """
+    self.__check_interval_secs = check_interval_secs
+    self.__keepalive_interval_secs = keepalive_interval_secs
+    self.__max_resets = max_resets
+    self.__popen = popen
+    self.__condition = threading.Condition()
+    self.__tunnels = []
+    self.__stopped = False
+    self.__thread = None
+
+  def add(self, name, command, local_port, **popen_kwargs):
+    """Start a supervised port forward.
+
+    Args:
+      name: [string] The name of the tunnel, for logging.
+      command: [list] The command that forwards the local port.
+      local_port: [int] The local port that the command forwards.
+      popen_kwargs: Additional arguments for subprocess.Popen.
+
+    Returns:
+      The Tunnel.
+    """
+    tunnel = Tunnel(self, name, command, local_port, popen_kwargs)
+    self.__start(tunnel)
+    with self.__condition:
+      self.__tunnels.append(tunnel)
+      if self.__thread is None:
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+    return tunnel
+
+  def remove(self, tunnel):
+    """Stop supervising a tunnel and terminate its process."""
+    with self.__condition:
+      if tunnel in self.__tunnels:
+        self.__tunnels.remove(tunnel)
+    self.__terminate(tunnel, -1)
+
+  def stop(self):
+    """Stop supervising, terminate all the tunnels and wait for the watcher."""
+    with self.__condition:
+      self.__stopped = True
+      tunnels = self.__tunnels
+      self.__tunnels = []
+      thread = self.__thread
+      self.__condition.notify_all()
+    for tunnel in tunnels:
+      self.__terminate(tunnel, -1)
+    if thread is not None and thread is not threading.current_thread():
+      thread.join()
+
+  def report(self):
+    """Returns a summary of how often each tunnel was reset."""
+    with self.__condition:
+      tunnels = sorted(self.__tunnels, key=lambda tunnel: tunnel.name)
+    if not tunnels:
+      return 'No tunnels.'
+    return 'Tunnel resets: {0}'.format(', '.join(
+        ['{name}={resets}'.format(name=tunnel.name, resets=tunnel.resets)
+         for tunnel in tunnels]))
+
+  def __start(self, tunnel):
+    logging.debug('Starting tunnel to %s: %s',
+                  tunnel.name, ' '.join(tunnel.command))
+    tunnel.started_at = time.time()
+    tunnel.process = self.__popen(tunnel.command, **tunnel.popen_kwargs)
+
+  def __terminate(self, tunnel, returncode):
+    if tunnel.final_returncode is None:
+      tunnel.final_returncode = returncode
+    process = tunnel.process
+    if process is not None and process.poll() is None:
+      try:
+        process.kill()
+        process.wait()
+      except OSError:
+        pass
+
+  def __restart(self, tunnel):
+    returncode = tunnel.process.returncode
+    if tunnel.resets >= self.__max_resets:
+      logging.error('Giving up on tunnel to %s after %d resets.',
+                    tunnel.name, tunnel.resets)
+      tunnel.final_returncode = returncode
+      return
+    tunnel.resets += 1
+    logging.warning('Tunnel to %s on port %d exited with %s after %d secs.'
+                    ' Restarting it (reset #%d).',
+                    tunnel.name, tunnel.local_port, returncode,
+                    time.time() - tunnel.started_at, tunnel.resets)
+    try:
+      self.__start(tunnel)
+    except OSError as ex:
+      logging.error('Could not restart tunnel to %s: %s', tunnel.name, ex)
+      tunnel.final_returncode = returncode
+      return
+    if tunnel.final_returncode is not None:
+      # It was removed while restarting.
+      self.__terminate(tunnel, tunnel.final_returncode)
+
+  def __keep_alive(self, tunnel):
+    """Open and close a connection through the tunnel."""
+    try:
+      sock = socket.create_connection(('localhost', tunnel.local_port),
+                                      timeout=self.KEEPALIVE_TIMEOUT_SECS)
+      sock.close()
+    except (socket.error, socket.timeout) as ex:
+      logging.debug('Keepalive to %s on port %d failed: %s',
+                    tunnel.name, tunnel.local_port, ex)
+
+  def __run(self):
+    next_keepalive = time.time() + self.__keepalive_interval_secs
+    while True:
+      with self.__condition:
+        if self.__stopped:
+          return
+        self.__condition.wait(self.__check_interval_secs)
+        if self.__stopped:
+          return
+        tunnels = list(self.__tunnels)
+
+      self.__restart_exited(tunnels)
+
+      now = time.time()
+      if self.__keepalive_interval_secs > 0 and now >= next_keepalive:
+        next_keepalive = now + self.__keepalive_interval_secs
+        for tunnel in tunnels:
+          if self.__stopped:
+            return
+          if tunnel.final_returncode is None:
+            self.__keep_alive(tunnel)
+            # Do not let slow keepalives delay noticing exited tunnels.
+            self.__restart_exited(tunnels)
+
+  def __restart_exited(self, tunnels):
+    for tunnel in tunnels:
+      if (tunnel.final_returncode is None
+          and tunnel.process.poll() is not None):
+        self.__restart(tunnel)
@@ -17,23 +17,26 @@
 It is responsible for deploying spinnaker (via Halyard) remotely.
 """
 
-from multiprocessing.pool import ThreadPool
 
+import atexit
 import distutils
 import json
 import logging
 import os
 import stat
 import tempfile
+import threading
 import time
-import traceback
 
+from spinnaker.concurrent_run import run_concurrently
 from spinnaker.run import (
     run_quick,
     check_run_quick,
     check_run_and_monitor,
     run_and_monitor)
 
+from ssh_connection import SshConnectionManager
+
 
 SUPPORTED_DEPLOYMENT_TYPES = ['localdebian', 'distributed']
 SUPPORTED_DISTRIBUTED_PLATFORMS = ['kubernetes']
@@ -191,32 +194,40 @@ class BaseValidateBomDeployer(object):
     if not os.path.exists(log_dir):
       os.makedirs(log_dir)
 
-    def fetch_service_log(service):
-      try:
-        logging.debug('Fetching logs for "%s"...', service)
-        deployer = (self if service in HALYARD_SERVICES
-                    else self.__spinnaker_deployer)
-        deployer.do_fetch_service_log_file(service, log_dir)
-      except Exception as ex:
-        message = 'Error fetching log for service "{service}": {ex}'.format(
-            service=service, ex=ex)
-        if ex.message.find('No such file') >= 0:
+    logging.info('Collecting server log files into "%s"', log_dir)
+    if self.__spinnaker_deployer is self:
+      deployer_services = [(self, SPINNAKER_SERVICES + HALYARD_SERVICES)]
+    else:
+      deployer_services = [(self.__spinnaker_deployer, SPINNAKER_SERVICES),
+                           (self, HALYARD_SERVICES)]
+
+    fetches = []
+    for deployer, services in deployer_services:
+      for service in services:
+        write_data_to_secure_path('', os.path.join(log_dir, service + '.log'))
+      fetches.extend(
+          deployer.do_make_fetch_service_logs_commands(services, log_dir))
+
+    results = run_concurrently([command for _, command in fetches],
+                               echo=False)
+    for (services, _), result in zip(fetches, results):
+      for service in services:
+        path = os.path.join(log_dir, service + '.log')
+        if result.returncode == 0:
+          if os.path.getsize(path) == 0:
+            write_data_to_secure_path(
+                'No log found for service "{service}".\n'
+                '    Perhaps the service never started.'.format(
+                    service=service), path)
+          continue
+        error = result.stderr.strip()
+        message = 'Error fetching log for service "{service}": {error}'.format(
+            service=service, error=error)
+        if error.find('No such file') >= 0:
           message += '\n    Perhaps the service never started.'
-          # dont log since the error was already captured.
         else:
           logging.error(message)
-          message += '\n{trace}'.format(
-              trace=traceback.format_exc())
-
-        write_data_to_secure_path(
-            message, os.path.join(log_dir, service + '.log'))
-
-    logging.info('Collecting server log files into "%s"', log_dir)
-    all_services = list(SPINNAKER_SERVICES)
-    all_services.extend(HALYARD_SERVICES)
-    thread_pool = ThreadPool(len(all_services))
-    thread_pool.map(fetch_service_log, all_services)
-    thread_pool.terminate()
+        write_data_to_secure_path(message, path)
 
   def do_make_port_forward_command(self, service, local_port, remote_port):
     """Hook for concrete platforms to return the port forwarding command.
@@ -226,6 +237,37 @@ class BaseValidateBomDeployer(object):
     """
     raise NotImplementedError(self.__class__.__name__)
 
+  def do_make_fetch_service_log_command(self, service, log_dir):
+    """Hook for concrete platforms to return the command to fetch a log.
+
+    Args:
+      service: [string] The service's log to get
+      log_dir: [string] The directory name to write the logs into.
+         The log should be written to "<service>.log" in this directory.
+
+    Returns:
+      The shell command to run.
+    """
+    raise NotImplementedError(self.__class__.__name__)
+
+  def do_make_fetch_service_logs_commands(self, services, log_dir):
+    """Hook for platforms to return the commands to fetch service logs.
+
+    By default each log is fetched with its own command.
+
+    Args:
+      services: [list of string] The services whose logs to get.
+      log_dir: [string] The directory name to write the logs into.
+         Each log should be written to "<service>.log" in this directory.
+
+    Returns:
+      A list of (services, command) where command is the shell command
+      fetching the logs of the listed services.
+    """
+    return [([service],
+             self.do_make_fetch_service_log_command(service, log_dir))
+            for service in services]
+
   def do_deploy(self, script, files_to_upload):
     """Hook for specialized platforms to implement the concrete deploy()."""
     # pylint: disable=unused-argument
@@ -323,17 +365,26 @@ class KubernetesValidateBomDeployer(BaseValidateBomDeployer):
                        .format(options.injected_deploy_spinnaker_account))
     options.injected_deploy_spinnaker_account = options.k8s_account_name
 
-  def __get_pod_name(self, k8s_namespace, service):
-    """Determine the pod name for the deployed service."""
+  def __make_context_option(self):
+    """Returns the kubectl --context option, if any."""
     options = self.options
-    response = check_run_quick(
+    return ('--context {0}'.format(options.k8s_account_context)
+            if options.k8s_account_context
+            else '')
+
+  def __make_get_pod_name_command(self, k8s_namespace, service):
+    """Returns a shell pipeline that prints the pod name for the service."""
+    return (
         'kubectl {context} get pods --namespace {namespace}'
         ' | gawk -F "[[:space:]]+" "/{service}-v/ {{print \\$1}}" | tail -1'
-        .format(context=('--context {0}'.format(options.k8s_account_context)
-                         if options.k8s_account_context
-                         else ''),
+        .format(context=self.__make_context_option(),
                 namespace=k8s_namespace,
                 service=service))
+
+  def __get_pod_name(self, k8s_namespace, service):
+    """Determine the pod name for the deployed service."""
+    response = check_run_quick(
+        self.__make_get_pod_name_command(k8s_namespace, service))
     pod = response.stdout.strip()
     if not pod:
       message = 'There is no pod for "{service}" in {namespace}'.format(
@@ -378,28 +429,24 @@ class KubernetesValidateBomDeployer(BaseValidateBomDeployer):
     super(KubernetesValidateBomDeployer, self).do_undeploy()
     # kubectl delete namespace spinnaker
 
-  def do_fetch_service_log_file(self, service, log_dir):
-    """Retrieve log file for the given service's pod.
-
-    Args:
-      service: [string] The service's log to get
-      log_dir: [string] The directory name to write the logs into.
-    """
-    options = self.options
-    k8s_namespace = options.deploy_k8s_namespace
-    service_pod = self.__get_pod_name(k8s_namespace, service)
-    path = os.path.join(log_dir, service + '.log')
-    write_data_to_secure_path('', path)
-    check_run_quick(
-        'kubectl -n {namespace} -c {container} {context} logs {pod}'
+  def do_make_fetch_service_log_command(self, service, log_dir):
+    """Implements the BaseBomValidateDeployer interface."""
+    k8s_namespace = self.options.deploy_k8s_namespace
+    return (
+        'pod=$({get_pod_name});'
+        ' if [ -z "$pod" ]; then'
+        '   echo "There is no pod for \\"{service}\\" in {namespace}" >&2;'
+        '   exit 1;'
+        ' fi;'
+        ' kubectl -n {namespace} -c {container} {context} logs $pod'
         '  >> {path}'
-        .format(namespace=k8s_namespace,
+        .format(get_pod_name=self.__make_get_pod_name_command(
+                    k8s_namespace, service),
+                namespace=k8s_namespace,
                 container='spin-{service}'.format(service=service),
-                context=('--context {0}'.format(options.k8s_account_context)
-                         if options.k8s_account_context
-                         else ''),
-                pod=service_pod,
-                path=path))
+                context=self.__make_context_option(),
+                service=service,
+                path=os.path.join(log_dir, service + '.log')))
 
 class GenericVmValidateBomDeployer(BaseValidateBomDeployer):
   """Concrete deployer used to deploy Hal onto Generic VM
@@ -434,6 +481,20 @@ class GenericVmValidateBomDeployer(BaseValidateBomDeployer):
     """Returns the Halyard User within the deployment VM."""
     return self.__hal_user
 
+  @property
+  def ssh_connection(self):
+    """Returns the SshConnectionManager for the deployment VM.
+
+    This is created on first use since the VM and key are not known until
+    the VM is created.
+    """
+    with self.__ssh_lock:
+      if self.__ssh_connection is None:
+        self.__ssh_connection = SshConnectionManager(
+            self.hal_user, self.instance_ip, self.__ssh_key_path)
+        atexit.register(self.__ssh_connection.close)
+      return self.__ssh_connection
+
   def __init__(self, options, **kwargs):
     super(GenericVmValidateBomDeployer, self).__init__(options, **kwargs)
     self.__instance_ip = None
@@ -441,17 +502,13 @@ class GenericVmValidateBomDeployer(BaseValidateBomDeployer):
     logging.info('hal_user="%s"', self.__hal_user)
     self.__ssh_key_path = os.path.join(os.environ['HOME'], '.ssh',
                                        '{0}_empty_key'.format(self.__hal_user))
+    self.__ssh_lock = threading.Lock()
+    self.__ssh_connection = None
 
   def do_make_port_forward_command(self, service, local_port, remote_port):
     """Implements interface."""
-    return [
-        'ssh', '-i', self.__ssh_key_path,
-        '-o', 'StrictHostKeyChecking=no',
-        '-o', 'UserKnownHostsFile=/dev/null',
-        '{user}@{ip}'.format(user=self.hal_user, ip=self.instance_ip),
-        '-L', '{local_port}:localhost:{remote_port}'.format(
-            local_port=local_port, remote_port=remote_port),
-        '-N']
+    return self.ssh_connection.make_port_forward_command(
+        local_port, remote_port)
 
   def do_determine_instance_ip(self):
     """Hook for determining the ip address of the hal instance."""
@@ -486,21 +543,14 @@ class GenericVmValidateBomDeployer(BaseValidateBomDeployer):
     try:
       self.do_create_vm(options)
 
-      copy_files = (
-          'scp'
-          ' -i {ssh_key_path}'
-          ' -o StrictHostKeyChecking=no'
-          ' -o UserKnownHostsFile=/dev/null'
-          ' {files}'
-          ' {user}@{ip}:~'
-          .format(ssh_key_path=self.__ssh_key_path,
-                  files=' '.join(files_to_upload),
-                  user=self.hal_user,
-                  ip=self.instance_ip))
+      connection = self.ssh_connection
+      copy_files = connection.make_scp_command(files_to_upload)
       logging.info('Copying files %s', copy_files)
 
       # pylint: disable=unused-variable
       for retry in range(0, 10):
+        # Once the VM accepts ssh, this and later commands share the master.
+        connection.ensure_master()
         result = run_quick(copy_files)
         if result.returncode == 0:
           break
@@ -519,20 +569,7 @@ class GenericVmValidateBomDeployer(BaseValidateBomDeployer):
       end_time = time.time() + 30
       logging.info('Entering while %f < %f', time.time(), end_time)
       while time.time() < end_time:
-        logging.info('Running quick...')
-        ready_response = run_quick(
-            'ssh'
-            ' -i {ssh_key}'
-            ' -o StrictHostKeyChecking=no'
-            ' -o UserKnownHostsFile=/dev/null'
-            ' {user}@{ip}'
-            ' "exit 0"'
-            .format(user=self.hal_user,
-                    ip=self.instance_ip,
-                    ssh_key=self.__ssh_key_path),
-            echo=False)
-        logging.info('got %s', ready_response)
-        if ready_response.returncode == 0:
+        if connection.ensure_master():
           logging.info('ssh is ready.')
           break
         logging.info('ssh not yet ready...')
@@ -540,16 +577,9 @@ class GenericVmValidateBomDeployer(BaseValidateBomDeployer):
 
       logging.info('Running install script')
       check_run_and_monitor(
-          'ssh'
-          ' -i {ssh_key}'
-          ' -o StrictHostKeyChecking=no'
-          ' -o UserKnownHostsFile=/dev/null'
-          ' {user}@{ip}'
-          ' ./{script_name}'
-          .format(user=self.hal_user,
-                  ip=self.instance_ip,
-                  ssh_key=self.__ssh_key_path,
-                  script_name=os.path.basename(script_path)))
+          connection.make_ssh_command(
+              './{script_name}'.format(
+                  script_name=os.path.basename(script_path))))
     except RuntimeError as error:
       logging.error('Caught runtime error: %s', error)
       raise RuntimeError('Halyard deployment failed.')
@@ -558,21 +588,22 @@ class GenericVmValidateBomDeployer(BaseValidateBomDeployer):
       logging.exception('Unexpected exception: %s', ex)
       raise
 
-  def do_fetch_service_log_file(self, service, log_dir):
+  def do_make_fetch_service_log_command(self, service, log_dir):
     """Implements the BaseBomValidateDeployer interface."""
-    write_data_to_secure_path('', os.path.join(log_dir, service + '.log'))
-    check_run_quick(
-        'scp'
-        ' -i {ssh_key}'
-        ' -o StrictHostKeyChecking=no'
-        ' -o UserKnownHostsFile=/dev/null'
-        ' {user}@{ip}:/var/log/spinnaker/{service}/{service}.log'
-        ' {log_dir}'
-        .format(user=self.hal_user,
-                ip=self.instance_ip,
-                ssh_key=self.ssh_key_path,
-                service=service,
-                log_dir=log_dir))
+    return self.ssh_connection.make_fetch_files_command(
+        ['/var/log/spinnaker/{service}/{service}.log'.format(service=service)],
+        log_dir)
+
+  def do_make_fetch_service_logs_commands(self, services, log_dir):
+    """Implements the BaseBomValidateDeployer interface.
+
+    All the logs are streamed back in a single tar over one ssh channel.
+    """
+    self.ssh_connection.ensure_master()
+    return [(services, self.ssh_connection.make_fetch_files_command(
+        ['/var/log/spinnaker/{service}/{service}.log'.format(service=service)
+         for service in services],
+        log_dir))]
 
 
 class AwsValidateBomDeployer(GenericVmValidateBomDeployer):
@@ -748,25 +779,14 @@ class AwsValidateBomDeployer(GenericVmValidateBomDeployer):
     # attempt to ssh into it so we know we're accepting connections when
     # we return. It takes time to start
     logging.info('Checking if it is ready for ssh...')
-    check = run_quick(
-        'ssh'
-        ' -i {ssh_key}'
-        ' -o StrictHostKeyChecking=no'
-        ' -o UserKnownHostsFile=/dev/null'
-        ' {user}@{ip}'
-        ' "exit 0"'
-        .format(user=self.hal_user,
-                ip=self.instance_ip,
-                ssh_key=self.ssh_key_path),
-        echo=False)
-    if check.returncode == 0:
+    if self.ssh_connection.ensure_master():
       logging.info('READY')
       return True
 
     # Sometimes ssh accepts but authentication still fails
     # for a while. If this is the case, then try again
     # though the whole loop to distinguish VM going away.
-    logging.info('%s\nNot yet ready...', check.stdout.strip())
+    logging.info('Not yet ready...')
     return False
 
   def do_undeploy(self):
@@ -888,15 +908,8 @@ class AzureValidateBomDeployer(GenericVmValidateBomDeployer):
     """Implements the BaseBomValidateDeployer interface."""
     options = self.options
     if options.deploy_spinnaker_type == 'distributed':
-      run_and_monitor(
-          'ssh'
-          ' -i {ssh_key}'
-          ' -o StrictHostKeyChecking=no'
-          ' -o UserKnownHostsFile=/dev/null'
-          ' {user}@{ip} sudo hal -q --log=info deploy clean'
-          .format(user=self.hal_user,
-                  ip=self.instance_ip,
-                  ssh_key=self.ssh_key_path))
+      run_and_monitor(self.ssh_connection.make_ssh_command(
+          'sudo hal -q --log=info deploy clean'))
     check_run_and_monitor(
         'az vm delete -y'
         ' --name {name}'
@@ -1061,15 +1074,8 @@ class GoogleValidateBomDeployer(GenericVmValidateBomDeployer):
     """Implements the BaseBomValidateDeployer interface."""
     options = self.options
     if options.deploy_spinnaker_type == 'distributed':
-      run_and_monitor(
-          'ssh'
-          ' -i {ssh_key}'
-          ' -o StrictHostKeyChecking=no'
-          ' -o UserKnownHostsFile=/dev/null'
-          ' {user}@{ip} sudo hal -q --log=info deploy clean'
-          .format(user=self.hal_user,
-                  ip=self.instance_ip,
-                  ssh_key=self.ssh_key_path))
+      run_and_monitor(self.ssh_connection.make_ssh_command(
+          'sudo hal -q --log=info deploy clean'))
 
     check_run_and_monitor(
         'gcloud -q compute instances delete'
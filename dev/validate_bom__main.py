@@ -81,6 +81,8 @@ def build_report(test_controller):
   if response.returncode != 0:
     logging.error('Error building report: %s', response.stdout)
   logging.info('Logging information is in %s', options.log_dir)
+  if options.test_results_store:
+    logging.info('Test results were appended to %s', options.test_results_store)
 
   return test_controller.build_summary()
 
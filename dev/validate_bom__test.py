@@ -68,9 +68,10 @@ test execution for these resources. Unrestricted resources wont rate-limit.
 If the cost bigger than the total semaphore capacity then the test will
 be given all the quota once all is available.
 
-There is an overall rate-limiting semaphore on --test_concurrency for
-how many tests can run at a time. This is enforced at the point of execution,
-after all the setup and filtering has taken place.
+There is an overall limit of --test_concurrency on how many tests can run at
+a time. This is enforced at the point of execution, after all the setup and
+filtering has taken place. Tests are started longest first, based on their
+durations in earlier runs as recorded in --test_duration_history.
 """
 
 # pylint: disable=broad-except
@@ -78,11 +79,12 @@ after all the setup and filtering has taken place.
 from multiprocessing.pool import ThreadPool
 
 import atexit
+import bisect
 import collections
+import heapq
 import logging
 import os
 import re
-import subprocess
 import socket
 import sys
 import threading
@@ -93,9 +95,27 @@ import yaml
 
 from spinnaker.run import run_and_monitor
 
+from build_scheduler import DurationHistory
+from tunnel_supervisor import TunnelSupervisor
+from test_results_store import FAILED, PASSED, SKIPPED, TestResultsStore
+
 
 ForwardedPort = collections.namedtuple('ForwardedPort', ['child', 'port'])
 
+# A test that is ready to run.
+#   name: [string] The name of the test.
+#   command: [list] The command line to run the test.
+#   quota: [dict] The quota the test needs while it runs.
+#   estimate: [float] The expected number of seconds the test will take.
+RunnableTest = collections.namedtuple(
+    'RunnableTest', ['name', 'command', 'quota', 'estimate'])
+
+# The most tests to prepare (filter and wait on services for) at once.
+MAX_PREPARE_CONCURRENCY = 16
+
+# The QuotaTracker resource limiting how many tests run at once.
+TEST_CONCURRENCY_QUOTA = 'test_concurrency'
+
 
 def _unused_port():
   """Find a port that is not currently in use."""
@@ -107,25 +127,128 @@ def _unused_port():
   return port
 
 
+class _QuotaRequest(object):
+  """A request for quota from the QuotaTracker.
+
+  Attributes:
+    who: Who is asking, for logging purposes.
+    quota: The desired quota for each keyed resource.
+    granted: The quota acquired once the request was granted.
+    waited: The seconds spent waiting on each resource.
+  """
+
+  def __init__(self, who, quota, priority, sequence, lock, on_granted=None):
+    self.who = who
+    self.quota = quota
+    self.priority = priority
+    self.sequence = sequence
+    self.enqueue_time = time.time()
+    self.granted = None
+    self.on_granted = on_granted
+    self.waited = collections.Counter()
+    self.waiting_on = None
+    self.waiting_since = self.enqueue_time
+    self.condition = threading.Condition(lock)
+
+  def __lt__(self, other):
+    return ((-self.priority, self.sequence)
+            < (-other.priority, other.sequence))
+
+  def wait_on(self, name, now):
+    """Charge the time since the last change to what it was waiting on."""
+    if self.waiting_on is not None:
+      self.waited[self.waiting_on] += now - self.waiting_since
+    self.waiting_on = name
+    self.waiting_since = now
+
+
 class QuotaTracker(object):
   """Manages quota for individual resources.
 
   Note that this quota tracker is purely logical. It does not relate to the
   real world. Others may be using the actual quota we have. This is only
   regulating the test's use of the quota.
+
+  Requests that cannot be satisfied right away wait in a queue ordered by
+  priority then arrival. Quota is granted all-or-nothing in queue order.
+  The resources wanted by a waiting request are reserved for it, so smaller
+  requests arriving later cannot keep starving it, though they can still use
+  other resources. When quota is released, only the waiters that were granted
+  their quota are woken up.
   """
 
-  def __init__(self, max_counts):
+  def __init__(self, max_counts, quiet=False, shared_keys=None):
     """Constructor.
 
     Args:
       max_counts: [dict] The list of resources and quotas to manage.
+      quiet: [bool] If True then do not log requests, such as when only
+         simulating a schedule.
+      shared_keys: [list] Resources that every request needs, such as how
+         many tests may run at once. A waiting request only reserves these
+         while it is short of them, so that it does not hold up the requests
+         behind it that need none of its other resources.
     """
+    self.__quiet = quiet
     self.__counts = dict(max_counts)
     self.__max_counts = dict(max_counts)
-    self.__condition_variable = threading.Condition()
+    self.__shared_keys = set(shared_keys or [])
+    self.__lock = threading.Lock()
+    self.__queue = []  # The waiting _QuotaRequest, in priority order.
+    self.__reserved = set()  # The resources held for the waiting requests.
+    self.__sequence = 0
+    self.__metrics = {}
+
+  def __log(self, level, message, *args):
+    if not self.__quiet:
+      logging.log(level, message, *args)
 
-  def acquire_all_safe(self, who, quota):
+  @property
+  def num_waiting(self):
+    """The number of requests waiting for quota."""
+    with self.__lock:
+      return len(self.__queue)
+
+  def wait_metrics(self):
+    """Returns statistics on waiting for each limited resource.
+
+    Returns:
+      A dictionary keyed by resource name whose values are dictionaries
+      with the number of 'acquired', 'waited', 'timed_out' and 'rejected'
+      requests, and the 'total_wait_secs' and 'max_wait_secs' of those
+      that waited.
+    """
+    with self.__lock:
+      return dict([(name, dict(metrics))
+                   for name, metrics in self.__metrics.items()])
+
+  def report(self):
+    """Returns a summary of how long requests waited on each resource."""
+    metrics = self.wait_metrics()
+    if not metrics:
+      return 'No quota requests.'
+    return 'Quota waits: {0}'.format(', '.join(
+        ['{name}={waited}/{acquired} (total {total:.1f}s, max {max:.1f}s)'
+         .format(name=name, waited=metrics[name]['waited'],
+                 acquired=metrics[name]['acquired'],
+                 total=metrics[name]['total_wait_secs'],
+                 max=metrics[name]['max_wait_secs'])
+         for name in sorted(metrics)]))
+
+  def __note_unsafe(self, quota, counter, wait_secs=None):
+    for name in quota or {}:
+      if name not in self.__max_counts:
+        continue
+      metrics = self.__metrics.setdefault(
+          name, {'acquired': 0, 'waited': 0, 'timed_out': 0, 'rejected': 0,
+                 'total_wait_secs': 0.0, 'max_wait_secs': 0.0})
+      metrics[counter] += 1
+      if wait_secs is not None:
+        metrics['waited'] += 1
+        metrics['total_wait_secs'] += wait_secs
+        metrics['max_wait_secs'] = max(metrics['max_wait_secs'], wait_secs)
+
+  def acquire_all_safe(self, who, quota, priority=0, timeout=None):
     """Acquire the desired quota, if any.
 
     This is thread-safe and will block until it can be satisified.
@@ -133,17 +256,79 @@ class QuotaTracker(object):
     Args:
       who: [string] Who is asking, for logging purposes.
       quota: [dict] The desired quota for each keyed resource, if any.
+      priority: [float] Waiting requests with higher priority are granted
+         before those with lower priority, then in the order they arrived.
+      timeout: [float] If not None, give up after this many seconds.
     Returns:
-      The quota acquired.
+      The quota acquired, or None if the timeout expired first.
     """
-    got = None
-    with self.__condition_variable:
-      got = self.acquire_all_or_none_unsafe(who, quota)
-      while got is None:
-        logging.info('"%s" waiting on quota %s', who, quota)
-        self.__condition_variable.wait()
-        got = self.acquire_all_or_none_unsafe(who, quota)
-    return got
+    return self.wait_safe(self.request_safe(who, quota, priority=priority),
+                          timeout=timeout)
+
+  def request_safe(self, who, quota, priority=0, on_granted=None):
+    """Ask for the desired quota without waiting for it.
+
+    This is thread-safe. Making the requests in the order they should be
+    served keeps them from racing for quota that is available right away.
+
+    Args:
+      who: [string] Who is asking, for logging purposes.
+      quota: [dict] The desired quota for each keyed resource, if any.
+      priority: [float] Waiting requests with higher priority are granted
+         before those with lower priority, then in the order they arrived.
+      on_granted: [callable] If provided, called with the request once it
+         is granted, which may be before this returns. It is called while
+         the tracker is locked so must not call back into the tracker.
+    Returns:
+      The request to pass to wait_safe. Its granted attribute is the quota
+      acquired once the request was granted.
+    """
+    with self.__lock:
+      self.__sequence += 1
+      request = _QuotaRequest(who, quota or {}, priority, self.__sequence,
+                              self.__lock, on_granted=on_granted)
+      request.granted = self.__try_acquire_unsafe(quota, self.__reserved)
+      if request.granted is not None:
+        self.__note_unsafe(request.granted, 'acquired')
+        if on_granted:
+          on_granted(request)
+        return request
+
+      self.__log(logging.INFO, '"%s" waiting on quota %s', who, quota)
+      bisect.insort(self.__queue, request)
+      # It may be ahead of the requests that were blocking it.
+      self.__grant_waiting_unsafe()
+      return request
+
+  def wait_safe(self, request, timeout=None):
+    """Wait for a request from request_safe to be granted.
+
+    Args:
+      request: [_QuotaRequest] The request to wait on.
+      timeout: [float] If not None, give up after this many seconds.
+    Returns:
+      The quota acquired, or None if the timeout expired first.
+    """
+    with self.__lock:
+      end_time = None if timeout is None else time.time() + timeout
+      while request.granted is None:
+        if end_time is None:
+          request.condition.wait()
+          continue
+        remaining = end_time - time.time()
+        if remaining <= 0:
+          break
+        request.condition.wait(remaining)
+
+      if request.granted is None:
+        self.__log(logging.INFO, '"%s" gave up waiting on quota %s',
+                   request.who, request.quota)
+        request.wait_on(None, time.time())
+        self.__queue.remove(request)
+        self.__note_unsafe(request.quota, 'timed_out')
+        # What this request had reserved may now go to others.
+        self.__grant_waiting_unsafe()
+      return request.granted
 
   def acquire_all_or_none_safe(self, who, quota):
     """Acquire the desired quota, if any.
@@ -156,13 +341,14 @@ class QuotaTracker(object):
     Returns:
       The quota acquired if successful, or None if not.
     """
-    with self.__condition_variable:
+    with self.__lock:
       return self.acquire_all_or_none_unsafe(who, quota)
 
   def acquire_all_or_none_unsafe(self, who, quota):
     """Acquire the desired quota, if any.
 
     This is not thread-safe so should be called while locked.
+    It will not take quota reserved by waiting requests.
 
     Args:
       who: [string] Who is asking, for logging purposes.
@@ -172,14 +358,13 @@ class QuotaTracker(object):
     """
     if not quota:
       return {}
-    logging.info('"%s" attempting to acquire quota %s', who, quota)
-    acquired = {}
-    for key, value in quota.items():
-      got = self.__acquire_resource_or_none(key, value)
-      if not got:
-        self.release_all_unsafe(who, acquired)
-        return None
-      acquired[key] = got
+    self.__log(logging.INFO, '"%s" attempting to acquire quota %s', who, quota)
+    acquired = self.__try_acquire_unsafe(quota, self.__reserved)
+    self.__note_unsafe(quota, 'rejected' if acquired is None else 'acquired')
+    if acquired is None:
+      self.__log(logging.WARNING,
+                 'Quota %s is not available. Rejecting "%s" for now.',
+                 quota, who)
     return acquired
 
   def release_all_safe(self, who, quota):
@@ -189,14 +374,14 @@ class QuotaTracker(object):
       who: [string] Who is releasing, for logging purposes.
       quota: [dict] The non-None result from an acquire_all* method.
     """
-    with self.__condition_variable:
+    with self.__lock:
       self.release_all_unsafe(who, quota)
-      self.__condition_variable.notify_all()
 
   def release_all_unsafe(self, who, quota):
     """Release all the resource quota.
 
     This is not thread-safe so should be called while locked.
+    Waiting requests that can now be satisfied are granted and woken up.
 
     Args:
       who: [string] Who is releasing, for logging purposes.
@@ -204,46 +389,330 @@ class QuotaTracker(object):
     """
     if not quota:
       return
-    logging.info('"%s" releasing quota %s', who, quota)
+    self.__log(logging.INFO, '"%s" releasing quota %s', who, quota)
     for key, value in quota.items():
-      self.__release_resource(key, value)
+      have = self.__counts.get(key, None)
+      if have is not None:
+        self.__counts[key] = have + value
+    if self.__queue:
+      self.__grant_waiting_unsafe()
+
+  def __blocking_unsafe(self, quota, reserved):
+    """Returns the wanted resources that are reserved or too scarce."""
+    blocking = []
+    for name, count in sorted((quota or {}).items()):
+      if name not in self.__max_counts:
+        continue
+      # If the cost is bigger than the max quota then take all of it.
+      if (name in reserved
+          or self.__counts[name] < min(count, self.__max_counts[name])):
+        blocking.append(name)
+    return blocking
 
-  def __acquire_resource_or_none(self, name, count):
-    """Attempt to acquire some amount of quota.
+  def __try_acquire_unsafe(self, quota, reserved):
+    """Acquire all the quota or none of it.
 
     Args:
-      name: [string] The name of the resource we're acquiring.
-      count: [int] The amount of the resource
+      quota: [dict] The desired quota for each keyed resource.
+      reserved: [set] Resource names that may not be taken.
 
     Returns:
-      The amount we were given. This is either all or none. If non-zero
-      but less than we asked for, then it gave us the max quota it has.
-      In order for this to be the case, it must have all the quota available.
-      Otherwise it will return 0.
+      The quota acquired, or None if it is not all available.
     """
-    have = self.__counts.get(name)
-    if have is None:
-      return count
-    if have >= count:
-      self.__counts[name] = have - count
-      return count
-    max_count = self.__max_counts[name]
-    if have == max_count:
-      logging.warning('Quota %s has a max of %d but %d is desired.'
-                      ' Acquiring all the quota as a best effort.',
-                      name, max_count, count)
-      self.__counts[name] = 0
-      return have
-    logging.warning('Quota %s has %d remaining, but %d are needed.'
-                    ' Rejecting the request for now.',
-                    name, have, count)
-    return 0
-
-  def __release_resource(self, name, count):
-    """Restores previously acquired resource quota."""
-    have = self.__counts.get(name, None)
-    if have is not None:
-      self.__counts[name] = have + count
+    if self.__blocking_unsafe(quota, reserved):
+      return None
+    acquired = dict(quota or {})
+    for name, count in acquired.items():
+      if name not in self.__max_counts:
+        continue
+      if count > self.__max_counts[name]:
+        self.__log(logging.WARNING,
+                   'Quota %s has a max of %d but %d is desired.'
+                   ' Acquiring all the quota as a best effort.',
+                   name, self.__max_counts[name], count)
+        count = self.__max_counts[name]
+      self.__counts[name] -= count
+      acquired[name] = count
+    return acquired
+
+  def __grant_waiting_unsafe(self):
+    """Grant quota to waiting requests in queue order and wake them."""
+    now = time.time()
+    reserved = set()
+    granted = []
+    for request in self.__queue:
+      blocking = self.__blocking_unsafe(request.quota, reserved)
+      if blocking:
+        # Waiting on a shared resource, such as for any test to finish,
+        # is what holds up everything else.
+        shared = [name for name in blocking if name in self.__shared_keys]
+        request.wait_on((shared or blocking)[0], now)
+        reserved.update([name for name in request.quota
+                         if name in self.__max_counts
+                         and (name not in self.__shared_keys
+                              or name in blocking)])
+        if reserved.issuperset(self.__max_counts):
+          break  # Nobody else can be granted anything.
+        continue
+      request.granted = self.__try_acquire_unsafe(request.quota, reserved)
+      request.wait_on(None, now)
+      granted.append(request)
+    self.__reserved = reserved
+
+    for request in granted:
+      self.__queue.remove(request)
+      self.__note_unsafe(request.granted, 'acquired',
+                         wait_secs=now - request.enqueue_time)
+      request.condition.notify()
+      if request.on_granted:
+        request.on_granted(request)
+
+
+def make_test_quota_tracker(quota_spec, concurrency, quiet=False):
+  """Create the QuotaTracker that schedules the tests.
+
+  Besides the quota, each test needs one of the concurrency slots as
+  TEST_CONCURRENCY_QUOTA. Requests are prioritized by their estimate so the
+  longest tests start first, and shorter tests may start ahead of a longer
+  test waiting on quota, but not if they need the same quota.
+
+  Args:
+    quota_spec: [dict] The quota limits.
+    concurrency: [int] How many tests can run at once.
+    quiet: [bool] If True then do not log requests.
+  """
+  limits = dict(quota_spec)
+  limits[TEST_CONCURRENCY_QUOTA] = concurrency
+  return QuotaTracker(limits, quiet=quiet,
+                      shared_keys=[TEST_CONCURRENCY_QUOTA])
+
+
+def request_test_quota(tracker, test, on_granted=None):
+  """Ask a tracker from make_test_quota_tracker for what a test needs.
+
+  Args:
+    tracker: [QuotaTracker] The tracker scheduling the tests.
+    test: [RunnableTest] The test to schedule.
+    on_granted: [callable] Called with the request once it is granted.
+
+  Returns:
+    The request to wait on.
+  """
+  quota = dict(test.quota or {})
+  quota[TEST_CONCURRENCY_QUOTA] = 1
+  return tracker.request_safe(test.name, quota, priority=test.estimate,
+                              on_granted=on_granted)
+
+
+def run_granted_tests(tracker, tests, run_test):
+  """Run each test in its own thread once the tracker grants its quota.
+
+  The requests are made up front, longest first. The calling thread then
+  waits for them to be granted, starts their threads, and releases the
+  quota once each thread has finished, so only the running tests have
+  threads.
+
+  Args:
+    tracker: [QuotaTracker] A tracker from make_test_quota_tracker.
+    tests: [list of RunnableTest] The tests to run, longest first.
+    run_test: [callable] Runs a test given the RunnableTest and its granted
+       request.
+  """
+  condition = threading.Condition()
+  granted = []
+  finished = []
+  def on_granted(request):
+    with condition:
+      granted.append(request)
+      condition.notify()
+
+  def run_and_notify(test, request):
+    try:
+      run_test(test, request)
+    finally:
+      with condition:
+        finished.append(request)
+        condition.notify()
+
+  tests_by_name = dict([(test.name, test) for test in tests])
+  for test in tests:
+    request_test_quota(tracker, test, on_granted=on_granted)
+
+  num_started = 0
+  threads = {}  # The running threads keyed by test name.
+  while num_started < len(tests) or threads:
+    with condition:
+      while not granted and not finished:
+        condition.wait()
+      starting, done = list(granted), list(finished)
+      del granted[:]
+      del finished[:]
+
+    for request in done:
+      threads.pop(request.who).join()
+      tracker.release_all_safe(request.who, request.granted)
+    for request in starting:
+      thread = threading.Thread(
+          target=run_and_notify, args=(tests_by_name[request.who], request))
+      thread.daemon = True
+      thread.start()
+      threads[request.who] = thread
+      num_started += 1
+
+
+def estimate_makespan(tests, quota_spec, concurrency):
+  """Simulate the test schedule to determine how long it should take.
+
+  Args:
+    tests: [list of RunnableTest] The tests to run, longest first.
+    quota_spec: [dict] The quota limits.
+    concurrency: [int] How many tests can run at once.
+
+  Returns:
+    The expected number of seconds to run all the tests.
+  """
+  # The simulated requests are not interesting to log.
+  tracker = make_test_quota_tracker(quota_spec, concurrency, quiet=True)
+  pending = [(test, request_test_quota(tracker, test)) for test in tests]
+  running = []  # heap of (end time, name, acquired quota)
+  now = 0.0
+  while pending or running:
+    waiting = []
+    for test, request in pending:
+      if request.granted is None:
+        waiting.append((test, request))
+      else:
+        heapq.heappush(running,
+                       (now + test.estimate, test.name, request.granted))
+    pending = waiting
+    if not running:
+      break
+    now, name, acquired = heapq.heappop(running)
+    tracker.release_all_safe(name, acquired)
+  return now
+
+
+class ServiceHealthProbe(object):
+  """Polls the health of a forwarded service on behalf of all the tests.
+
+  There is one probe per forwarded port. It polls only while some test is
+  waiting on it and remembers once the service became ready, so the probe
+  traffic depends on the number of services rather than the number of tests.
+  """
+
+  @property
+  def is_ready(self):
+    with self.__condition:
+      return self.__ready
+
+  def __init__(self, service_name, forwarding, interval_secs=2.0,
+               request_timeout_secs=20):
+    """Constructor.
+
+    Args:
+      service_name: [string] The service being probed.
+      forwarding: [ForwardedPort] The tunnel to the service.
+      interval_secs: [float] How long to wait between polls.
+      request_timeout_secs: [int] How long to wait on each poll.
+         This is 20 to appease kubectl port forwarding, which will close
+         if left idle for 30s.
+    """
+    self.__service_name = service_name
+    self.__forwarding = forwarding
+    self.__interval_secs = interval_secs
+    self.__request_timeout_secs = request_timeout_secs
+    self.__condition = threading.Condition()
+    self.__ready = False
+    self.__error = None
+    self.__closed = False
+    self.__num_waiters = 0
+    self.__thread = None
+
+  def wait(self, timeout):
+    """Wait for the service to become ready.
+
+    Args:
+      timeout: [float] How many seconds to wait before giving up.
+
+    Raises:
+      RuntimeError if the tunnel closed.
+      The last polling error if the timeout expired.
+    """
+    end_time = time.time() + timeout
+    with self.__condition:
+      self.__num_waiters += 1
+      try:
+        if not self.__ready and not self.__closed and self.__thread is None:
+          self.__thread = threading.Thread(target=self.__poll)
+          self.__thread.daemon = True
+          self.__thread.start()
+        while not self.__ready and not self.__closed:
+          remaining = end_time - time.time()
+          if remaining <= 0:
+            break
+          self.__condition.wait(remaining)
+        ready, closed, error = self.__ready, self.__closed, self.__error
+      finally:
+        self.__num_waiters -= 1
+
+    if ready:
+      return
+    if closed:
+      logging.error('It appears %s is no longer available.'
+                    ' Perhaps the tunnel closed.',
+                    self.__service_name)
+      raise RuntimeError('It appears that {0} failed'.format(
+          self.__service_name))
+    logging.error('Timing out waiting for %s', self.__service_name)
+    raise error or RuntimeError('Timed out waiting for {0}'.format(
+        self.__service_name))
+
+  def __poll(self):
+    """Poll the service until it is ready or nobody is waiting anymore."""
+    # It seems we have a race condition in the poll
+    # where it thinks the jobs have terminated.
+    # I've only seen this happen once.
+    time.sleep(1)
+
+    count = 0
+    url = 'http://localhost:{port}/health'.format(port=self.__forwarding.port)
+    while True:
+      with self.__condition:
+        if not self.__num_waiters:
+          self.__thread = None
+          return
+      if self.__forwarding.child.poll() is not None:
+        self.__finish(closed=True)
+        return
+
+      try:
+        # localhost is hardcoded here because we are port forwarding.
+        logging.debug('Polling %s', self.__service_name)
+        urllib2.urlopen(url, timeout=self.__request_timeout_secs)
+        logging.info('"%s" is ready on port %d',
+                     self.__service_name, self.__forwarding.port)
+        self.__finish(ready=True)
+        return
+      except urllib2.HTTPError as error:
+        logging.warning('%s got %s. Ignoring that for now.',
+                        self.__service_name, error)
+        self.__finish(ready=True)
+        return
+      except Exception as error:
+        with self.__condition:
+          self.__error = error
+        if count % 5 == 0:
+          # poll every two seconds but only report every 10
+          logging.info('Waiting on %s got %s', self.__service_name, error)
+        count += 1
+      time.sleep(self.__interval_secs)
+
+  def __finish(self, ready=False, closed=False):
+    with self.__condition:
+      self.__ready = ready
+      self.__closed = closed
+      self.__thread = None
+      self.__condition.notify_all()
 
 
 class CommandOutputMediator(object):
@@ -347,11 +816,10 @@ class ValidateBomTestController(object):
     return -1 if self.failed else 0
 
   def __close_forwarded_ports(self):
-    for forwarding in self.__forwarded_ports.values():
-      try:
-        forwarding[0].kill()
-      except Exception as ex:
-        logging.error('Error terminating child: %s', ex)
+    try:
+      self.__tunnel_supervisor.stop()
+    except Exception as ex:
+      logging.error('Error terminating tunnels: %s', ex)
 
   def __init__(self, deployer):
     options = deployer.options
@@ -361,7 +829,7 @@ class ValidateBomTestController(object):
     quota_spec.update({parts[0]: int(parts[1])
                   for parts in [entry.split('=')
                                 for entry in options.test_quota.split(',')]})
-    self.__quota_tracker = QuotaTracker(quota_spec)
+    self.__quota_spec = quota_spec
     self.__deployer = deployer
     self.__lock = threading.Lock()
     self.__passed = []  # Resulted in success
@@ -375,12 +843,25 @@ class ValidateBomTestController(object):
     )
 
     num_concurrent = len(self.__test_suite.get('tests')) or 1
-    num_concurrent = int(min(num_concurrent,
-                             options.test_concurrency or num_concurrent))
-    self.__semaphore = threading.Semaphore(num_concurrent)
+    self.__max_concurrent = int(min(num_concurrent,
+                                    options.test_concurrency or num_concurrent))
+    self.__quota_tracker = make_test_quota_tracker(quota_spec,
+                                                   self.__max_concurrent)
+    self.__duration_history = DurationHistory(options.test_duration_history)
+    self.__results_store = (
+        TestResultsStore(options.test_results_store,
+                         labels={'version': options.deploy_version,
+                                 'platform': options.deploy_hal_platform})
+        if options.test_results_store
+        else None)
 
     # dictionary of service -> ForwardedPort
+    # The children are the supervised Tunnels.
     self.__forwarded_ports = {}
+    self.__tunnel_supervisor = TunnelSupervisor()
+
+    # dictionary of service -> ServiceHealthProbe
+    self.__health_probes = {}
     atexit.register(self.__close_forwarded_ports)
 
     # Map of service names to native ports.
@@ -432,31 +913,13 @@ class ValidateBomTestController(object):
 
     # Redirect stdout to prevent buffer overflows (at least in k8s)
     # but keep errors for failures.
-    class KeepAlive(threading.Thread):
-      def run(self):
-        while True:
-          try:
-            logging.info('KeepAlive %s polling', service_name)
-            got = urllib2.urlopen('http://localhost:{port}/health'
-                                  .format(port=local_port))
-            logging.info('KeepAlive %s -> %s', service_name, got.getcode())
-          except Exception as ex:
-            logging.info('KeepAlive %s -> %s', service_name, ex)
-
-          time.sleep(20)
-
-    if self.options.deploy_spinnaker_type == 'distributed':
-      # For now, distributed deployments are k8s
-      # and K8s port forwarding with kubectl requires keep alive.
-      hack = KeepAlive()
-      hack.setDaemon(True)
-      hack.start()
-
-    child = subprocess.Popen(
-        command,
-        stderr=sys.stderr.fileno(),
-        stdout=None)
-    return ForwardedPort(child, local_port)
+    #
+    # The supervisor restarts the tunnel on the same port if it dies and
+    # keeps it from idling out, which k8s port forwarding is prone to.
+    tunnel = self.__tunnel_supervisor.add(
+        service_name, command, local_port,
+        stderr=sys.stderr.fileno(), stdout=None)
+    return ForwardedPort(tunnel, local_port)
 
   def build_summary(self):
     """Return a summary of all the test results."""
@@ -490,77 +953,63 @@ class ValidateBomTestController(object):
       summary.append('PASSED {0}, skipped {1}'.format(num_passed, num_skipped))
     return '\n'.join(summary)
 
-  def wait_on_service(self, service_name, port=None, timeout=240):
-    """Wait for the given service to be available on the specified port.
+  def __get_health_probe(self, service_name):
+    """Returns the ServiceHealthProbe for a service, forwarding it if needed.
 
     Args:
-      service_name: [string] The service name we we are waiting on.
-      port: [int] The remote port the service is at.
-      timeout: [int] How much time to wait before giving up.
-
-    Returns:
-      The ForwardedPort entry for this service.
+      service_name: [string] The service to probe.
     """
     try:
       with self.__lock:
-        forwarding = self.__forwarded_ports.get(service_name)
-        if forwarding is None:
-          forwarding = self.__forward_port_to_service(service_name)
-        self.__forwarded_ports[service_name] = forwarding
+        probe = self.__health_probes.get(service_name)
+        if probe is None:
+          forwarding = self.__forwarded_ports.get(service_name)
+          if forwarding is None:
+            forwarding = self.__forward_port_to_service(service_name)
+            self.__forwarded_ports[service_name] = forwarding
+          probe = ServiceHealthProbe(service_name, forwarding)
+          self.__health_probes[service_name] = probe
+        return probe
     except Exception as ex:
       logging.exception('Exception while attempting to forward ports to "%s"',
                         service_name)
       raise
 
-    end_time = time.time() + timeout
-    logging.info('Waiting on "%s..."', service_name)
-    if port is None:
-      port = self.__service_port_map[service_name]
+  def wait_on_service(self, service_name, port=None, timeout=240):
+    """Wait for the given service to be available on the specified port.
 
-    # It seems we have a race condition in the poll
-    # where it thinks the jobs have terminated.
-    # I've only seen this happen once.
-    time.sleep(1)
+    Args:
+      service_name: [string] The service name we we are waiting on.
+      port: [int] The remote port the service is at.
+      timeout: [int] How much time to wait before giving up.
 
-    threadid = hex(threading.current_thread().ident)
-    count = 0
-    while forwarding.child.poll() is None:
-      try:
-        # localhost is hardcoded here because we are port forwarding.
-        # timeout=20 is to appease kubectl port forwarding, which will close
-        #            if left idle for 30s
-        logging.info('WaitOn polling %s | %s', service_name, threadid)
-        urllib2.urlopen('http://localhost:{port}/health'
-                        .format(port=forwarding.port),
-                        timeout=20)
-        logging.info('"%s" is ready on port %d | %s',
-                     service_name, forwarding.port, threadid)
-        return forwarding
-      except urllib2.HTTPError as error:
-        logging.warning('%s got %s. Ignoring that for now.',
-                        service_name, error)
-        return forwarding
+    Returns:
+      The ForwardedPort entry for this service.
+    """
+    self.wait_on_services([service_name], timeout=timeout)
+    return self.__forwarded_ports[service_name]
 
-      except (urllib2.URLError, Exception) as error:
-        if count % 5 == 0:
-          # poll every two seconds but only report every 10
-          logging.info('WaitOn got %s | %s', error, threadid)
-        count += 1
-        if time.time() >= end_time:
-          logging.error('Timing out waiting for %s | %s', service_name, threadid)
-          raise error
-        time.sleep(2.0)
+  def wait_on_services(self, service_names, timeout=240):
+    """Wait for all the given services to be available.
 
-    logging.error('It appears %s is no longer available.'
-                  ' Perhaps the tunnel closed.',
-                  service_name)
-    raise RuntimeError('It appears that {0} failed'.format(service_name))
+    The services are probed concurrently by their shared ServiceHealthProbe
+    so this thread only needs to wait on each of them in turn.
+
+    Args:
+      service_names: [list of string] The services to wait on.
+      timeout: [int] How much time to wait overall before giving up.
+    """
+    end_time = time.time() + timeout
+    probes = [self.__get_health_probe(name) for name in service_names]
+    for name, probe in zip(service_names, probes):
+      if not probe.is_ready:
+        logging.info('Waiting on "%s..."', name)
+      probe.wait(max(0, end_time - time.time()))
 
   def run_tests(self):
     """The actual controller that coordinates and runs the tests.
 
-    This attempts to process all the tests concurrently across
-    seperate threads, where each test will:
+    This first prepares all the tests concurrently, where each test will:
        (1) Determine whether or not the test is a candidate
            (passes the --test_include / --test_exclude criteria)
 
@@ -571,7 +1020,9 @@ class ValidateBomTestController(object):
                tunnels used by other tests. The tunnels allocate unused local
                ports to avoid potential conflict within the local machine.
 
-           (b) Wait for the service to be ready. Ideally this means it is
+           (b) Wait for the service to be ready. Each service has a single
+               health probe shared by all the tests waiting on it, which
+               remembers once the service is ready. Ideally this means it is
                healthy, however we'll allow unhealthy services to proceed
                as well and let those tests run and fail in case they are
                testing unhealthy service situations.
@@ -579,11 +1030,10 @@ class ValidateBomTestController(object):
            (c) If there is an error or the service takes too long then
                outright FAIL the test.
 
-        (3) Acquire the quota that the test requires.
-
-            * If the quota is not currently available, then block the
-              thread until it is. Since each test is in its own thread, this
-              will not impact other tests.
+    Then the runnable tests are scheduled, longest expected duration first:
+        (3) Each test waits in the QuotaTracker queue, prioritized by its
+            expected duration, for one of the --test_concurrency slots
+            and its quota.
 
             * Quota are only internal resources within the controller.
               This is used for purposes of rate limiting, etc. It does not
@@ -593,14 +1043,14 @@ class ValidateBomTestController(object):
               a resource without a known quota, then the quota is assumed
               to be infinite.
 
-        (4) Grab a semaphore used to rate limit running tests.
-            This is controlled by --test_concurrency, which defaults to all.
+            * Shorter tests may start ahead of a longer test waiting on
+              quota, but not if they need the same quota.
 
-        (5) Run the test.
+        (4) Run the test in its own thread.
 
-        (6) Release the quota and semaphore to unblock other tests.
+        (5) Release the quota to let pending tests start.
 
-        (7) Record the outcome as PASS or FAIL
+        (6) Record the outcome as PASS or FAIL
 
     If an exception is thrown along the way, the test will automatically
     be recorded as a FAILURE.
@@ -616,35 +1066,104 @@ class ValidateBomTestController(object):
         'Running tests (concurrency=%s).',
         options.test_concurrency or 'infinite')
 
-    thread_pool = ThreadPool(len(all_test_profiles))
-    thread_pool.map(self.__run_or_skip_test_profile_entry_wrapper,
-                    all_test_profiles.items())
+    thread_pool = ThreadPool(
+        min(len(all_test_profiles), MAX_PREPARE_CONCURRENCY) or 1)
+    prepared = thread_pool.map(self.__prepare_test_profile_entry_wrapper,
+                               all_test_profiles.items())
     thread_pool.terminate()
+    for test_name, _ in self.skipped:
+      self.__record_result(test_name, SKIPPED)
+
+    runnable = sorted([test for test in prepared if test],
+                      key=lambda test: (-test.estimate, test.name))
+    self.__run_scheduled_tests(runnable)
+    self.__duration_history.save()
+    logging.info(self.__tunnel_supervisor.report())
+    logging.info(self.__quota_tracker.report())
 
     logging.info('Finished running tests.')
 
-  def __run_or_skip_test_profile_entry_wrapper(self, args):
-    """Outer wrapper for running tests
+  def __run_scheduled_tests(self, pending):
+    """Run the tests within the concurrency and quota limits.
+
+    Args:
+      pending: [list of RunnableTest] The tests to run, longest first.
+    """
+    if not pending:
+      return
+    expected_secs = estimate_makespan(
+        pending, self.__quota_spec, self.__max_concurrent)
+    logging.info('Expecting the %d tests to take %d secs.',
+                 len(pending), expected_secs)
+
+    start_time = time.time()
+    def run_test(test, request):
+      logging.info('"%s" acquired quota %s', test.name, request.granted)
+      waited = dict(request.waited)
+      waits = {
+          'queue_wait_secs': time.time() - start_time,
+          'semaphore_wait_secs': waited.pop(TEST_CONCURRENCY_QUOTA, 0.0),
+          'quota_wait_secs': sum(waited.values())
+      }
+      try:
+        self.__execute_test(test, waits)
+      except Exception as ex:
+        logging.error('%s threw an exception:\n%s',
+                      test.name, traceback.format_exc())
+        with self.__lock:
+          self.__failed.append((test.name,
+                                'Caught exception {0}'.format(ex)))
+        self.__record_result(test.name, FAILED, **waits)
+
+    run_granted_tests(self.__quota_tracker, pending, run_test)
+
+    logging.info('Ran tests in %d secs (expected %d secs).',
+                 time.time() - start_time, expected_secs)
+
+  def __prepare_test_profile_entry_wrapper(self, args):
+    """Outer wrapper for preparing tests
 
     Args:
       args: [dict entry] The name and spec tuple from the mapped element.
+
+    Returns:
+      The RunnableTest or None if the test will not be run.
     """
     test_name = args[0]
-    spec = args[1]
+    spec = dict(args[1])
     try:
-      self.__run_or_skip_test_profile_entry(test_name, spec)
+      return self.__prepare_test_profile_entry(test_name, spec)
     except Exception as ex:
       logging.error('%s threw an exception:\n%s',
                     test_name, traceback.format_exc())
       with self.__lock:
         self.__failed.append((test_name, 'Caught exception {0}'.format(ex)))
+      self.__record_result(test_name, FAILED)
+      return None
 
-  def __run_or_skip_test_profile_entry(self, test_name, spec):
-    """Runs a test from within the thread-pool map() function.
+  def __record_result(self, test_name, outcome, **kwargs):
+    """Append the outcome of a test to the --test_results_store, if any."""
+    if self.__results_store is None:
+      return
+    try:
+      self.__results_store.record(
+          test_name, outcome,
+          log_path=os.path.join(self.options.log_dir, 'citest_logs',
+                                test_name + '.log'),
+          **kwargs)
+    except (IOError, OSError) as ex:
+      logging.error('Could not record result of %s: %s', test_name, ex)
+
+  def __prepare_test_profile_entry(self, test_name, spec):
+    """Prepares a test from within the thread-pool map() function.
 
     Args:
       test_name: [string] The name of the test.
       spec: [dict] The test profile specification.
+            This argument will be pruned as values are consumed from it.
+
+    Returns:
+      The RunnableTest or None if the test is skipped.
     """
     options = self.options
     if not re.search(options.test_include, test_name):
@@ -652,18 +1171,25 @@ class ValidateBomTestController(object):
                 ' --test_include criteria "{criteria}".'
                 .format(name=test_name, criteria=options.test_include))
       logging.warning(reason)
-      self.__skipped.append((test_name, reason))
-      return
+      with self.__lock:
+        self.__skipped.append((test_name, reason))
+      return None
     if options.test_exclude and re.search(options.test_exclude, test_name):
       reason = ('Skipped test "{name}" because it matches explicit'
                 ' --test_exclude criteria "{criteria}".'
                 .format(name=test_name, criteria=options.test_exclude))
       logging.warning(reason)
-      self.__skipped.append((test_name, reason))
-      return
+      with self.__lock:
+        self.__skipped.append((test_name, reason))
+      return None
 
     # This can raise an exception
-    self.run_test_profile_helper(test_name, spec)
+    quota = spec.pop('quota', {}) or {}
+    command = self.make_test_command_or_none(test_name, spec)
+    if command is None:
+      return None
+    return RunnableTest(test_name, command, quota,
+                        self.__duration_history.estimate(test_name))
 
   def validate_test_requirements(self, test_name, spec):
     """Determine whether or not the test requirements are satisfied.
@@ -709,9 +1235,7 @@ class ValidateBomTestController(object):
       raise ValueError('Unexpected fields in {name} specification: {remaining}'
                        .format(name=test_name, remaining=spec))
 
-    thread_pool = ThreadPool(len(services))
-    thread_pool.map(self.wait_on_service, services)
-    thread_pool.terminate()
+    self.wait_on_services(sorted(services))
     return True
 
   def add_extra_arguments(self, test_name, args, commandline):
@@ -806,54 +1330,30 @@ class ValidateBomTestController(object):
     self.add_extra_arguments(test_name, args, command)
     return command
 
-  def run_test_profile_helper(self, test_name, spec):
-    """Helper function for running an individual test.
+  def __execute_test(self, test, waits):
+    """Run a test whose quota was already acquired and record the outcome.
 
     The caller wraps this to trap and handle exceptions.
 
     Args:
-      test_name: The test being run.
-      spec: The test specification profile.
-            This argument will be pruned as values are consumed from it.
+      test: [RunnableTest] The test to run.
+      waits: [dict] How long the test waited to start, for the results store.
     """
-    quota = spec.pop('quota', {})
-    command = self.make_test_command_or_none(test_name, spec)
-    if command is None:
-      return
-    capture = CommandOutputMediator(test_name)
-
-    logging.info('Acquiring quota for test "%s"...', test_name)
-    quota_tracker = self.__quota_tracker
-    acquired_quota = quota_tracker.acquire_all_safe(test_name, quota)
-    if acquired_quota:
-      logging.info('"%s" acquired quota %s', test_name, acquired_quota)
-
-    execute_time = None
-    start_time = time.time()
+    capture = CommandOutputMediator(test.name)
+    execute_time = time.time()
+    logging.info('Executing "%s"...', test.name)
+    logging.debug('Running %s', ' '.join(test.command))
     try:
-      logging.info('Scheduling "%s"...', test_name)
-
-      # This will block. Note that we already acquired quota, thus
-      # we are blocking holding onto that quota. However since we are
-      # blocked awaiting a thread, nobody else can execute either,
-      # so it doesnt matter that we might be starving them of quota.
-      self.__semaphore.acquire(True)
-      execute_time = time.time()
-      wait_time = int(execute_time - start_time + 0.5)
-      if wait_time > 1:
-        logging.info('"%s" had a semaphore contention for %d secs.',
-                     test_name, wait_time)
-      logging.info('Executing "%s"...', test_name)
-      logging.debug('Running %s', ' '.join(command))
-      result = run_and_monitor(' '.join(command),
-                               echo=False,
-                               observe_stdout=capture.capture_stdout,
-                               observe_stderr=capture.capture_stderr)
+      # The full output is logged through the observers so we only
+      # need to keep the tail of it for the results.
+      result = run_and_monitor(
+          ' '.join(test.command),
+          echo=False,
+          observe_stdout=capture.capture_stdout,
+          observe_stderr=capture.capture_stderr,
+          max_buffer_bytes=self.options.test_output_buffer_kb * 1024)
     finally:
-      logging.info('Finished executing "%s"...', test_name)
-      self.__semaphore.release()
-      if acquired_quota:
-        quota_tracker.release_all_safe(test_name, acquired_quota)
+      logging.info('Finished executing "%s"...', test.name)
 
     capture.flush()
     end_time = time.time()
@@ -861,11 +1361,17 @@ class ValidateBomTestController(object):
 
     with self.__lock:
       if result.returncode == 0:
-        logging.info('%s PASSED after %d secs', test_name, delta_time)
-        self.__passed.append((test_name, result.stdout))
+        logging.info('%s PASSED after %d secs (expected %d)',
+                     test.name, delta_time, test.estimate)
+        self.__passed.append((test.name, result.stdout))
+        self.__duration_history.record(test.name, end_time - execute_time)
       else:
-        logging.info('FAILED %s after %d secs', test_name, delta_time)
-        self.__failed.append((test_name, result.stderr))
+        logging.info('FAILED %s after %d secs', test.name, delta_time)
+        self.__failed.append((test.name, result.stderr))
+    self.__record_result(
+        test.name, PASSED if result.returncode == 0 else FAILED,
+        start_time=execute_time, execution_secs=end_time - execute_time,
+        exit_code=result.returncode, **waits)
 
 
 def init_argument_parser(parser):
@@ -884,6 +1390,16 @@ def init_argument_parser(parser):
       '--test_concurrency', default=None, type=int,
       help='Limits how many tests to run at a time. Default is unbounded')
 
+  parser.add_argument(
+      '--test_duration_history', default='',
+      help='If set, records how long each test took in this file so that'
+           ' later runs can start the longest tests first.')
+
+  parser.add_argument(
+      '--test_results_store', default='',
+      help='If set, appends the outcome and timing of each test to this'
+           ' file. Summarize it with "python test_results_store.py <file>".')
+
   parser.add_argument(
       '--test_default_quota',
       default='google_backend_services=3,google_forwarding_rules=3,google_ssl_certificates=2,google_cpu=20,appengine_deployment=1',
@@ -893,6 +1409,11 @@ def init_argument_parser(parser):
       '--test_quota', default='',
       help='Comma-delimited name=value list of --test_default_quota overrides.')
 
+  parser.add_argument(
+      '--test_output_buffer_kb', default=64, type=int,
+      help='How much of the end of each test\'s stdout and stderr to keep in'
+           ' memory for the results. The full output is always logged.')
+
   parser.add_argument(
       '--test_disable', default=False, action='store_true',
       help='If true then dont run the testing phase.')
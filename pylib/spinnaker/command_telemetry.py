@@ -0,0 +1,270 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Records how long each shell command took, as JSON lines.
+
+Telemetry is enabled by setting the SPINNAKER_COMMAND_TELEMETRY environment
+variable to the path of the file to append to, or by calling enable(), which
+sets it so child processes also record to the same file. Each record holds
+the wall time, the CPU time and peak memory of the command's process tree,
+its exit code and how much output it produced. Records are attributed to the
+component being worked on through the context() manager.
+
+Running this module summarizes a telemetry file, listing the slowest steps
+for each component and comparing them with the previous run:
+
+  python command_telemetry.py command_telemetry.jsonl
+"""
+
+import argparse
+import collections
+import contextlib
+import errno
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+
+TELEMETRY_PATH_VAR = 'SPINNAKER_COMMAND_TELEMETRY'
+TELEMETRY_RUN_VAR = 'SPINNAKER_COMMAND_TELEMETRY_RUN'
+
+_lock = threading.Lock()
+_context = threading.local()
+
+
+def enable(path, run_id=None):
+  """Record commands run by this process and its children to a file.
+
+  Args:
+    path [string]: The JSON lines file to append records to.
+    run_id [string]: Identifies this run in the records. Child processes
+       inherit it so that their commands are grouped with this run.
+  """
+  os.environ[TELEMETRY_PATH_VAR] = os.path.abspath(path)
+  os.environ[TELEMETRY_RUN_VAR] = run_id or '{time}-{id}'.format(
+      time=time.strftime('%Y%m%d%H%M%S'), id=uuid.uuid4().hex[:8])
+
+
+def is_enabled():
+  return bool(os.environ.get(TELEMETRY_PATH_VAR))
+
+
+@contextlib.contextmanager
+def context(component=None, step=None):
+  """Attribute commands run by this thread within the block.
+
+  Args:
+    component [string]: The component being worked on.
+    step [string]: A stable name for the step, used to match it across runs.
+       Defaults to the command with its numbers masked out.
+  """
+  previous = getattr(_context, 'value', {})
+  value = dict(previous)
+  if component is not None:
+    value['component'] = component
+  if step is not None:
+    value['step'] = step
+  _context.value = value
+  try:
+    yield
+  finally:
+    _context.value = previous
+
+
+def wait_for_process(process):
+  """Wait for a subprocess.Popen to finish and collect its resource usage.
+
+  Args:
+    process [subprocess.Popen]: The process to wait on.
+
+  Returns:
+    The resource.struct_rusage for the process and its waited-on children,
+    or None if it could not be determined.
+  """
+  while True:
+    try:
+      _, status, rusage = os.wait4(process.pid, 0)
+    except OSError as ex:
+      if ex.errno == errno.EINTR:
+        continue
+      if ex.errno != errno.ECHILD:
+        raise
+      # Someone else already reaped it.
+      process.wait()
+      return None
+    # Record the exit code the way Popen would had it waited itself.
+    if os.WIFSIGNALED(status):
+      process.returncode = -os.WTERMSIG(status)
+    elif os.WIFEXITED(status):
+      process.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+def normalize_command(command):
+  """Returns the command with volatile numbers masked out."""
+  return re.sub(r'[0-9]+', '#', ' '.join(command.split()))
+
+
+def record(kind, command, start_time, wall_secs, returncode,
+           output_bytes, rusage=None):
+  """Append a record for a finished command, if telemetry is enabled.
+
+  Args:
+    kind [string]: The function that ran the command.
+    command [string]: The command that was run.
+    start_time [float]: When the command started, in seconds since the epoch.
+    wall_secs [float]: How long the command took.
+    returncode [int]: The command's exit code.
+    output_bytes [int]: The amount of output the command produced.
+    rusage [resource.struct_rusage]: The command's resource usage, if known.
+  """
+  path = os.environ.get(TELEMETRY_PATH_VAR)
+  if not path:
+    return
+  context_value = getattr(_context, 'value', {})
+  entry = {
+      'run': os.environ.get(TELEMETRY_RUN_VAR, ''),
+      'kind': kind,
+      'command': command,
+      'component': context_value.get('component', ''),
+      'step': context_value.get('step') or normalize_command(command),
+      'start_time': start_time,
+      'wall_secs': round(wall_secs, 3),
+      'returncode': returncode,
+      'output_bytes': output_bytes,
+      'pid': os.getpid()
+  }
+  if rusage is not None:
+    entry['user_cpu_secs'] = round(rusage.ru_utime, 3)
+    entry['system_cpu_secs'] = round(rusage.ru_stime, 3)
+    entry['max_rss_kb'] = rusage.ru_maxrss
+
+  # A single O_APPEND write keeps lines from concurrent processes intact.
+  line = json.dumps(entry, sort_keys=True) + '\n'
+  with _lock:
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+      os.write(fd, line)
+    finally:
+      os.close(fd)
+
+
+def load_records(path):
+  """Returns the records in a telemetry file, skipping malformed lines."""
+  records = []
+  with open(path, 'r') as f:
+    for line in f:
+      try:
+        records.append(json.loads(line))
+      except ValueError:
+        pass
+  return records
+
+
+def group_runs(records):
+  """Returns an OrderedDict of the records for each run, oldest first."""
+  runs = collections.OrderedDict()
+  for entry in sorted(records, key=lambda entry: entry['start_time']):
+    runs.setdefault(entry.get('run', ''), []).append(entry)
+  return runs
+
+
+def summarize(current, previous=None, top=5):
+  """Summarize the slowest steps for each component in a run.
+
+  Args:
+    current [list of dict]: The records for the run to summarize.
+    previous [list of dict]: The records for the run to compare with.
+    top [int]: The number of steps to list per component.
+
+  Returns:
+    The summary text.
+  """
+  def totals(records):
+    steps = {}
+    for entry in records:
+      key = (entry['component'], entry['step'])
+      total = steps.setdefault(key, {'wall_secs': 0.0, 'cpu_secs': 0.0,
+                                     'count': 0, 'failed': 0})
+      total['wall_secs'] += entry['wall_secs']
+      total['cpu_secs'] += (entry.get('user_cpu_secs', 0)
+                            + entry.get('system_cpu_secs', 0))
+      total['count'] += 1
+      if entry['returncode']:
+        total['failed'] += 1
+    return steps
+
+  current_steps = totals(current)
+  previous_steps = totals(previous or [])
+  by_component = {}
+  for (component, step), total in current_steps.items():
+    by_component.setdefault(component, []).append((step, total))
+
+  lines = []
+  for component in sorted(by_component.keys()):
+    steps = sorted(by_component[component],
+                   key=lambda item: item[1]['wall_secs'], reverse=True)
+    lines.append('{component}: {secs:.1f}s in {count} commands'.format(
+        component=component or '(no component)',
+        secs=sum([total['wall_secs'] for _, total in steps]),
+        count=sum([total['count'] for _, total in steps])))
+    for step, total in steps[:top]:
+      change = ''
+      before = previous_steps.get((component, step))
+      if before:
+        delta = total['wall_secs'] - before['wall_secs']
+        change = ' ({sign}{delta:.1f}s, {ratio:+.0%} vs previous)'.format(
+            sign='+' if delta >= 0 else '', delta=delta,
+            ratio=(delta / before['wall_secs']
+                   if before['wall_secs'] else 0))
+      elif previous:
+        change = ' (new)'
+      lines.append('  {wall:>8.1f}s wall {cpu:>8.1f}s cpu{failed}  {step}{change}'
+                   .format(wall=total['wall_secs'], cpu=total['cpu_secs'],
+                           failed=' FAILED' if total['failed'] else '',
+                           step=step, change=change))
+  return '\n'.join(lines)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Summarize the slowest commands recorded by a build.')
+  parser.add_argument('path', help='The telemetry file to summarize.')
+  parser.add_argument('--previous', default=None,
+                      help='A telemetry file for the run to compare with.'
+                           ' Defaults to the previous run in the same file.')
+  parser.add_argument('--top', default=5, type=int,
+                      help='The number of steps to list per component.')
+  options = parser.parse_args()
+
+  runs = group_runs(load_records(options.path))
+  if not runs:
+    sys.stderr.write('No records in {path}\n'.format(path=options.path))
+    return -1
+  current = runs.values()[-1]
+  if options.previous:
+    previous_runs = group_runs(load_records(options.previous))
+    previous = previous_runs.values()[-1] if previous_runs else None
+  else:
+    previous = runs.values()[-2] if len(runs) > 1 else None
+  print summarize(current, previous, top=options.top)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
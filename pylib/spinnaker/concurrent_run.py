@@ -0,0 +1,423 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs many shell commands concurrently from a single thread.
+
+Rather than dedicating a thread to each blocking run_and_monitor call, a
+ConcurrentCommandRunner starts the subprocesses itself and multiplexes all
+their output streams through a single poll loop. This lets callers fan out
+hundreds of git/gcloud/kubectl commands with a bounded number of them
+running at once, per-command timeouts, and cancellation.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+
+from run import RunResult
+from run import _StreamCollector
+
+
+# How often to check on commands that closed their output but have not exited.
+_REAP_INTERVAL_SECS = 0.05
+
+
+def _write_input(process, input):
+  """Feed input to a process's stdin then close it.
+
+  This runs in its own thread so a large input cannot block the poll loop.
+  """
+  try:
+    process.stdin.write(input)
+  except IOError:
+    pass  # The process exited without reading all of it.
+  finally:
+    try:
+      process.stdin.close()
+    except IOError:
+      pass
+
+
+class CommandTask(object):
+  """A command submitted to a ConcurrentCommandRunner."""
+
+  PENDING = 'PENDING'
+  RUNNING = 'RUNNING'
+  FINISHED = 'FINISHED'
+  CANCELLED = 'CANCELLED'
+  TIMED_OUT = 'TIMED_OUT'
+
+  @property
+  def command(self):
+    """The shell command to run."""
+    return self.__command
+
+  @property
+  def state(self):
+    """One of PENDING, RUNNING, FINISHED, CANCELLED or TIMED_OUT."""
+    return self.__state
+
+  @property
+  def done(self):
+    """Whether the task will not be making any more progress."""
+    return self.__state in [self.FINISHED, self.CANCELLED, self.TIMED_OUT]
+
+  @property
+  def result(self):
+    """The RunResult once the task is done.
+
+    If the task was cancelled or timed out while running, this contains
+    whatever output was collected before it was killed. If it was cancelled
+    before it started, this is None.
+    """
+    return self.__result
+
+  @property
+  def elapsed_secs(self):
+    """How long the command has been running, or ran for."""
+    if self.__start_time is None:
+      return 0
+    return (self.__end_time or time.time()) - self.__start_time
+
+  def __init__(self, command, timeout, input, observe_stdout, observe_stderr):
+    self.__command = command
+    self.__state = self.PENDING
+    self.__result = None
+    self.__start_time = None
+    self.__end_time = None
+    self.__finished_event = threading.Event()
+
+    # These are used by the ConcurrentCommandRunner.
+    self.timeout = timeout
+    self.input = input
+    self.observe_stdout = observe_stdout
+    self.observe_stderr = observe_stderr
+    self.cancel_requested = False
+    self.process = None
+    self.collectors = None
+
+  def wait(self, timeout=None):
+    """Block until the task is done.
+
+    This is only needed when another thread is running the runner's wait().
+
+    Returns:
+      True if the task is done, False if the timeout expired first.
+    """
+    self.__finished_event.wait(timeout)
+    return self.done
+
+  def mark_started(self):
+    """Called by the runner when the process is started."""
+    self.__state = self.RUNNING
+    self.__start_time = time.time()
+
+  def mark_done(self, state, result):
+    """Called by the runner when the task will not make any more progress."""
+    self.__end_time = time.time()
+    self.__result = result
+    self.__state = state
+    self.__finished_event.set()
+
+  def __repr__(self):
+    return 'CommandTask({0!r} {1})'.format(self.__command, self.__state)
+
+
+class _Poller(object):
+  """Waits on a changing set of file descriptors to become readable."""
+
+  def __init__(self):
+    self.__fds = set()
+    self.__poll = select.poll() if hasattr(select, 'poll') else None
+
+  def register(self, fd):
+    self.__fds.add(fd)
+    if self.__poll:
+      self.__poll.register(fd, select.POLLIN | select.POLLPRI)
+
+  def unregister(self, fd):
+    self.__fds.discard(fd)
+    if self.__poll:
+      self.__poll.unregister(fd)
+
+  def poll(self, timeout):
+    """Returns the readable file descriptors.
+
+    Args:
+      timeout [float]: Seconds to wait, or None to wait indefinitely.
+    """
+    try:
+      if self.__poll:
+        ms = None if timeout is None else max(0, int(timeout * 1000))
+        return [fd for fd, _ in self.__poll.poll(ms)]
+      return select.select(list(self.__fds), [], [], timeout)[0]
+    except select.error as ex:
+      if ex.args[0] != errno.EINTR:
+        raise
+      return []
+
+
+class ConcurrentCommandRunner(object):
+  """Runs shell commands concurrently, multiplexing them in one thread.
+
+  Commands are queued with submit() and run by wait(), which is the only
+  place the runner does any work. Other threads may submit() or cancel()
+  while wait() is running, but only one thread may wait() at a time.
+  """
+
+  def __init__(self, max_concurrency=None, echo=False):
+    """Constructor.
+
+    Args:
+      max_concurrency [int]: The most commands to run at once, or None
+         for no limit.
+      echo [bool]: If True then log each command when it is started.
+    """
+    self.__max_concurrency = max_concurrency
+    self.__echo = echo
+    self.__lock = threading.Lock()
+    self.__wait_lock = threading.Lock()
+    self.__pending = []
+    self.__running = []
+    self.__exiting = []  # Running tasks whose output streams have closed.
+    self.__fd_to_task = {}
+    self.__poller = _Poller()
+
+    # Writing to this pipe wakes up the poll loop when another thread
+    # submits or cancels a task.
+    self.__wake_read_fd, self.__wake_write_fd = os.pipe()
+    flags = fcntl.fcntl(self.__wake_write_fd, fcntl.F_GETFL)
+    fcntl.fcntl(self.__wake_write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    self.__poller.register(self.__wake_read_fd)
+
+  def close(self):
+    """Cancel any remaining tasks and release the runner's resources."""
+    with self.__lock:
+      tasks = list(self.__pending) + list(self.__running)
+    for task in tasks:
+      self.cancel(task)
+    self.wait(tasks)
+    os.close(self.__wake_read_fd)
+    os.close(self.__wake_write_fd)
+
+  def submit(self, command, timeout=None, input=None,
+             observe_stdout=None, observe_stderr=None):
+    """Queue a shell command to run.
+
+    Args:
+      command [string]: The shell command to execute.
+      timeout [float]: If not None, kill the command after this many seconds.
+      input [string]: If non-empty then feed this to stdin.
+      observe_stdout [callable]: If not None, called with lists of complete
+         lines from stdout as they arrive. This is called from the thread
+         running wait().
+      observe_stderr [callable]: Like observe_stdout but for stderr.
+
+    Returns:
+      The CommandTask for the command.
+    """
+    task = CommandTask(command, timeout, input, observe_stdout, observe_stderr)
+    with self.__lock:
+      self.__pending.append(task)
+    self.__wake()
+    return task
+
+  def cancel(self, task):
+    """Cancel the task.
+
+    A pending task will never be started. A running task will be killed.
+    """
+    with self.__lock:
+      if task in self.__pending:
+        self.__pending.remove(task)
+        task.mark_done(CommandTask.CANCELLED, None)
+        return
+      task.cancel_requested = True
+    self.__wake()
+
+  def wait(self, tasks=None):
+    """Run the loop until the tasks are done.
+
+    Args:
+      tasks [list of CommandTask]: The tasks to wait for, or None for all
+         the tasks submitted so far.
+
+    Returns:
+      The list of tasks waited on.
+    """
+    with self.__wait_lock:
+      if tasks is None:
+        with self.__lock:
+          tasks = list(self.__pending) + list(self.__running)
+      while not all(task.done for task in tasks):
+        self.__start_pending()
+        self.__process_events(self.__next_deadline_secs())
+        self.__reap_exited()
+        self.__handle_cancellations_and_timeouts()
+    return tasks
+
+  def __wake(self):
+    try:
+      os.write(self.__wake_write_fd, 'x')
+    except OSError:
+      # The pipe is already full so the loop will wake up anyway.
+      pass
+
+  def __start_pending(self):
+    """Start pending tasks while we are under the concurrency limit."""
+    while True:
+      with self.__lock:
+        if not self.__pending or (
+            self.__max_concurrency is not None
+            and len(self.__running) >= self.__max_concurrency):
+          return
+        task = self.__pending.pop(0)
+        self.__running.append(task)
+
+      if self.__echo:
+        logging.info('Running %s', task.command)
+      stdin = subprocess.PIPE if task.input else None
+      try:
+        # Run each command in its own process group so that killing it
+        # also kills anything it spawned.
+        process = subprocess.Popen(
+            task.command,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=stdin,
+            shell=True, close_fds=True, preexec_fn=os.setsid)
+      except OSError as ex:
+        with self.__lock:
+          self.__running.remove(task)
+        task.mark_done(CommandTask.FINISHED, RunResult(-1, '', str(ex)))
+        continue
+
+      task.process = process
+      task.mark_started()
+      if stdin:
+        writer = threading.Thread(target=_write_input,
+                                  args=(process, task.input))
+        writer.daemon = True
+        writer.start()
+
+      task.collectors = [
+          _StreamCollector(process.stdout, None, task.observe_stdout),
+          _StreamCollector(process.stderr, None, task.observe_stderr)
+      ]
+      for stream, collector in zip([process.stdout, process.stderr],
+                                   task.collectors):
+        self.__fd_to_task[stream.fileno()] = (task, collector)
+        self.__poller.register(stream.fileno())
+
+  def __next_deadline_secs(self):
+    """Returns how long until the loop next needs to check on a task."""
+    with self.__lock:
+      running = list(self.__running)
+    remaining = [task.timeout - task.elapsed_secs
+                 for task in running if task.timeout is not None]
+    if self.__exiting:
+      remaining.append(_REAP_INTERVAL_SECS)
+    return max(0, min(remaining)) if remaining else None
+
+  def __process_events(self, timeout):
+    """Read whatever output is available, blocking up to timeout."""
+    for fd in self.__poller.poll(timeout):
+      if fd == self.__wake_read_fd:
+        os.read(fd, 4096)
+        continue
+      entry = self.__fd_to_task.get(fd)
+      if entry is None:
+        continue
+      task, collector = entry
+      collector.read()
+      if collector.closed:
+        self.__stop_watching(fd)
+        if all(c.closed for c in task.collectors):
+          # The process may still be running (e.g. it daemonized), so it is
+          # reaped without blocking and remains subject to its timeout.
+          self.__exiting.append(task)
+
+  def __reap_exited(self):
+    """Finish the tasks whose processes have exited."""
+    for task in list(self.__exiting):
+      if task.process.poll() is not None:
+        self.__finish(task, CommandTask.FINISHED)
+
+  def __handle_cancellations_and_timeouts(self):
+    with self.__lock:
+      running = list(self.__running)
+    for task in running:
+      if task.cancel_requested:
+        self.__kill(task, CommandTask.CANCELLED)
+      elif task.timeout is not None and task.elapsed_secs >= task.timeout:
+        logging.warning('Killing "%s" after %.1f secs.',
+                        task.command, task.elapsed_secs)
+        self.__kill(task, CommandTask.TIMED_OUT)
+
+  def __kill(self, task, state):
+    try:
+      os.killpg(task.process.pid, signal.SIGKILL)
+    except OSError:
+      pass
+    # The process leads its own group so is always killed above.
+    task.process.wait()
+    # Dont wait for the output streams to close since something may have
+    # escaped the process group while holding onto them.
+    self.__stop_watching(task.process.stdout.fileno())
+    self.__stop_watching(task.process.stderr.fileno())
+    self.__finish(task, state)
+
+  def __stop_watching(self, fd):
+    if self.__fd_to_task.pop(fd, None) is not None:
+      self.__poller.unregister(fd)
+
+  def __finish(self, task, state):
+    """Complete a task whose process has already been reaped."""
+    process = task.process
+    if task in self.__exiting:
+      self.__exiting.remove(task)
+    process.stdout.close()
+    process.stderr.close()
+    stdout, stderr = [collector.getvalue() for collector in task.collectors]
+    with self.__lock:
+      self.__running.remove(task)
+    task.mark_done(state, RunResult(process.returncode, stdout, stderr))
+
+
+def run_concurrently(commands, max_concurrency=None, timeout=None, echo=True):
+  """Run shell commands concurrently and wait for them all to finish.
+
+  Args:
+    commands [list of string]: The shell commands to execute.
+    max_concurrency [int]: The most commands to run at once, or None for
+       no limit.
+    timeout [float]: If not None, kill any command that runs longer than
+       this many seconds.
+    echo [bool]: If True then log each command when it is started.
+
+  Returns:
+    List of RunResult for each of the commands, in the same order.
+    A command that timed out will have a negative returncode.
+  """
+  runner = ConcurrentCommandRunner(max_concurrency=max_concurrency, echo=echo)
+  try:
+    tasks = [runner.submit(command, timeout=timeout) for command in commands]
+    runner.wait(tasks)
+    return [task.result for task in tasks]
+  finally:
+    runner.close()
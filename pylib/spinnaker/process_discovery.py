@@ -0,0 +1,175 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Finds running Spinnaker subsystems by reading /proc directly.
+
+This replaces running 'jps' (which starts a JVM) or 'ps' (which may
+truncate the command line) with a single pass over /proc/*/cmdline.
+"""
+
+import errno
+import os
+import re
+
+
+_MAIN_CLASS_RE = re.compile(r'^com\.netflix\.spinnaker\.([^\.]+)\.')
+
+
+def have_proc_filesystem(proc_root='/proc'):
+  """Determine whether process discovery through /proc is possible."""
+  return os.path.exists(os.path.join(proc_root, 'self', 'cmdline'))
+
+
+def read_pid_file(path):
+  """Returns the pid recorded in a pid file, or None if there is not one."""
+  try:
+    with open(path, 'r') as f:
+      return int(f.read().strip())
+  except (IOError, ValueError):
+    return None
+
+
+def write_pid_file(path, pid):
+  """Record a pid into a pid file."""
+  with open(path, 'w') as f:
+    f.write('{pid}\n'.format(pid=pid))
+
+
+class ProcessTable(object):
+  """A snapshot of the processes visible in /proc."""
+
+  def __init__(self, proc_root='/proc'):
+    self.__proc_root = proc_root
+    self.__cmdlines = {}
+    self.__sessions = None
+
+    try:
+      names = os.listdir(proc_root)
+    except OSError:
+      names = []
+
+    for name in names:
+      if not name.isdigit():
+        continue
+      try:
+        with open(os.path.join(proc_root, name, 'cmdline'), 'rb') as f:
+          data = f.read()
+      except IOError:
+        continue  # The process went away.
+      if data:
+        self.__cmdlines[int(name)] = data.rstrip('\0').split('\0')
+
+  @property
+  def pids(self):
+    return self.__cmdlines.keys()
+
+  def get_argv(self, pid):
+    """Returns the argument list for the pid, or None if it is not known."""
+    return self.__cmdlines.get(pid)
+
+  def get_session(self, pid):
+    """Returns the session id of the pid, or None if it is not known."""
+    if self.__sessions is None:
+      self.__sessions = {}
+      for known in self.__cmdlines:
+        session = self.__read_session(known)
+        if session is not None:
+          self.__sessions[known] = session
+    return self.__sessions.get(pid)
+
+  def __read_session(self, pid):
+    try:
+      with open(os.path.join(self.__proc_root, str(pid), 'stat'), 'r') as f:
+        stat = f.read()
+    except IOError:
+      return None
+
+    # The command name is in parens and may itself contain spaces or parens.
+    # The fields after it are: state ppid pgrp session
+    fields = stat[stat.rfind(')') + 1:].split()
+    try:
+      return int(fields[3])
+    except (IndexError, ValueError):
+      return None
+
+
+def java_subsystem_name(argv, install_root):
+  """Determine which Spinnaker subsystem a java command line is running.
+
+  Args:
+    argv [list of string]: The process arguments.
+    install_root [string]: The directory the subsystems are installed in.
+
+  Returns:
+    The subsystem name or None if this is not a Spinnaker java process.
+  """
+  if not argv or os.path.basename(argv[0]) != 'java':
+    return None
+
+  classpath_name = None
+  classpath_prefix = install_root.rstrip('/') + '/'
+  for index, arg in enumerate(argv[1:]):
+    match = _MAIN_CLASS_RE.match(arg)
+    if match:
+      return match.group(1)
+    if (arg in ['-classpath', '-cp'] and index + 2 < len(argv)
+        and argv[index + 2].startswith(classpath_prefix)):
+      classpath_name = argv[index + 2][len(classpath_prefix):].split('/')[0]
+  return classpath_name
+
+
+def find_java_subsystem_jobs(install_root, pid_files=None, proc_root='/proc'):
+  """Look up all the running Spinnaker java subsystems.
+
+  Args:
+    install_root [string]: The directory the subsystems are installed in.
+    pid_files [dict]: Paths to pid files written by Runner.run_daemon, keyed
+       by subsystem name. The pid is the session leader that started the
+       subsystem. Pid files whose session is no longer running are removed.
+    proc_root [string]: The path to the proc filesystem.
+
+  Returns:
+    Dictionary keyed by subsystem name with pid values.
+  """
+  table = ProcessTable(proc_root)
+  job_map = {}
+  for pid in sorted(table.pids):
+    name = java_subsystem_name(table.get_argv(pid), install_root)
+    if name:
+      job_map[name] = pid
+
+  for name, path in (pid_files or {}).items():
+    if name in job_map:
+      continue
+    session = read_pid_file(path)
+    if session is None:
+      continue
+    if table.get_argv(session) is None:
+      try:
+        os.remove(path)
+      except OSError as error:
+        if error.errno != errno.ENOENT:
+          raise
+      continue
+
+    # The session is still running but its java command line was not
+    # recognized, so look for the java process within the session.
+    for pid in sorted(table.pids):
+      argv = table.get_argv(pid)
+      if (os.path.basename(argv[0]) == 'java'
+          and table.get_session(pid) == session):
+        job_map[name] = pid
+        break
+
+  return job_map
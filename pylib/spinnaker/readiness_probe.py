@@ -0,0 +1,413 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Determines when started Spinnaker services are ready to accept requests.
+
+A service is considered ready once its Spring Boot /health endpoint reports
+it is up. If that cannot be determined after a while, such as when the
+endpoint uses a certificate we do not trust or reports DOWN because of an
+unrelated health indicator, the service is considered ready once it accepts
+connections, as was done before probing /health. Each service is probed with jittered exponential backoff so that
+a slow starting service is not hammered, and all the services being waited
+on are probed from a single loop that also echoes their log files.
+"""
+
+import json
+import os
+import random
+import socket
+import sys
+import time
+import urllib2
+import urlparse
+
+
+class LogTailer(object):
+  """Echoes what is appended to a log file, similar to 'tail -f'.
+
+  The file is polled by seeking rather than by a child tail process.
+  It is fine if the file does not exist yet, is truncated, or is replaced.
+  """
+
+  # How far back from the end of an existing file to look for initial lines.
+  __INITIAL_SEEK_BYTES = 8192
+
+  def __init__(self, path, output=None, initial_lines=10):
+    """Constructor.
+
+    Args:
+      path [string]: The path of the file to follow.
+      output [stream]: Where to write the file contents, default is stdout.
+      initial_lines [int]: The number of existing lines to show initially.
+    """
+    self.__path = path
+    self.__output = output or sys.stdout
+    self.__initial_lines = initial_lines
+    self.__file = None
+    self.__inode = None
+
+  def close(self):
+    if self.__file:
+      self.__file.close()
+      self.__file = None
+
+  def poll(self):
+    """Write anything that was added to the file since the last poll."""
+    try:
+      stat = os.stat(self.__path)
+    except OSError:
+      return
+
+    if self.__file is not None and stat.st_ino != self.__inode:
+      # The file was replaced, so finish the old one and start the new one.
+      self.__copy_remaining()
+      self.close()
+      self.__initial_lines = None
+
+    if self.__file is None:
+      try:
+        self.__file = open(self.__path, 'r')
+      except IOError:
+        return
+      self.__inode = stat.st_ino
+      self.__seek_to_initial_lines(stat.st_size)
+    elif stat.st_size < self.__file.tell():
+      # The file was truncated.
+      self.__file.seek(0)
+
+    self.__copy_remaining()
+
+  def __seek_to_initial_lines(self, size):
+    if self.__initial_lines is None:
+      return
+    start = max(0, size - self.__INITIAL_SEEK_BYTES)
+    self.__file.seek(start)
+    tail = self.__file.read(size - start)
+    lines = tail.splitlines(True)
+    if start > 0 and lines:
+      lines = lines[1:]  # The first line is probably partial.
+    keep = len(''.join(lines[-self.__initial_lines:]))
+    self.__file.seek(size - keep)
+
+  def __copy_remaining(self):
+    data = self.__file.read()
+    if data:
+      self.__output.write(data)
+      self.__output.flush()
+
+
+class HealthProbe(object):
+  """Probes a service's /health endpoint until it reports the service is up.
+
+  Attempts are spaced with jittered exponential backoff. A probe fails by
+  raising SystemExit if the service process dies or the deadline passes.
+  """
+
+  @property
+  def name(self):
+    """The name of the service being probed."""
+    return self.__name
+
+  @property
+  def url(self):
+    """The health url being probed."""
+    return self.__url
+
+  @property
+  def ready(self):
+    """Whether the service has been observed to be healthy."""
+    return self.__ready_time is not None
+
+  @property
+  def next_attempt_time(self):
+    """When the next attempt should be made."""
+    return self.__next_attempt_time
+
+  @property
+  def elapsed_secs(self):
+    """Seconds since the probe started until now, or until it was ready."""
+    return (self.__ready_time or self.__clock()) - self.__start_time
+
+  @property
+  def ready_by(self):
+    """'health' or 'connect' depending on how readiness was determined."""
+    return self.__ready_by
+
+  @property
+  def metrics(self):
+    """A dictionary summarizing the probe attempts."""
+    return {
+        'name': self.__name,
+        'url': self.__url,
+        'ready': self.ready,
+        'ready_by': self.__ready_by,
+        'elapsed_secs': self.elapsed_secs,
+        'attempts': self.__attempts,
+        'last_status': self.__last_status,
+        'last_probe_secs': self.__last_probe_secs,
+        'max_probe_secs': self.__max_probe_secs,
+        'total_probe_secs': self.__total_probe_secs
+    }
+
+  def __init__(self, name, url, pid=None, deadline_secs=None,
+               initial_backoff_secs=0.1, max_backoff_secs=2.0,
+               backoff_multiplier=2.0, jitter=0.5, probe_timeout_secs=2.0,
+               connect_fallback_secs=None, clock=time.time, fetch=None,
+               connect=None):
+    """Constructor.
+
+    Args:
+      name [string]: The name of the service being probed.
+      url [string]: The /health url to probe.
+      pid [int]: If not None, the local process running the service.
+      deadline_secs [float]: If not None, give up after this many seconds.
+      initial_backoff_secs [float]: The delay after the first failed attempt.
+      max_backoff_secs [float]: The most to delay between attempts.
+      backoff_multiplier [float]: How much to grow the delay each attempt.
+      jitter [float]: The delay is randomly reduced by up to this fraction.
+      probe_timeout_secs [float]: The most time to wait for a response.
+      connect_fallback_secs [float]: If not None, once this many seconds
+         pass without a healthy response, consider the service ready if
+         it accepts a TCP connection.
+      clock [callable]: Returns the current time in seconds.
+      fetch [callable]: Given a url and timeout returns (status, body).
+         The default performs an HTTP GET.
+      connect [callable]: Given a host, port and timeout returns whether a
+         connection could be made. The default makes a TCP connection.
+    """
+    self.__name = name
+    self.__url = url
+    self.__pid = pid
+    self.__deadline_secs = deadline_secs
+    self.__initial_backoff_secs = initial_backoff_secs
+    self.__max_backoff_secs = max_backoff_secs
+    self.__backoff_multiplier = backoff_multiplier
+    self.__jitter = jitter
+    self.__probe_timeout_secs = probe_timeout_secs
+    self.__connect_fallback_secs = connect_fallback_secs
+    self.__clock = clock
+    self.__fetch = fetch or http_get
+    self.__connect = connect or tcp_connect
+
+    self.__start_time = clock()
+    self.__next_attempt_time = self.__start_time
+    self.__backoff_secs = initial_backoff_secs
+    self.__ready_time = None
+    self.__ready_by = None
+    self.__attempts = 0
+    self.__last_status = None
+    self.__last_probe_secs = None
+    self.__max_probe_secs = 0.0
+    self.__total_probe_secs = 0.0
+
+  def attempt(self):
+    """Probe the service once.
+
+    Returns:
+      True if the service is ready.
+
+    Raises:
+      SystemExit if the process died or the deadline passed.
+    """
+    if self.__ready_time is not None:
+      return True
+
+    self.check_still_running()
+    timeout = self.__probe_timeout_secs
+    if self.__deadline_secs is not None:
+      timeout = max(0.01, min(timeout,
+                              self.__deadline_secs - self.elapsed_secs))
+
+    start = self.__clock()
+    status, body = self.__fetch(self.__url, timeout)
+    now = self.__clock()
+    latency = now - start
+
+    self.__attempts += 1
+    self.__last_status = status
+    self.__last_probe_secs = latency
+    self.__max_probe_secs = max(self.__max_probe_secs, latency)
+    self.__total_probe_secs += latency
+
+    if self.is_healthy(status, body):
+      self.__ready_time = now
+      self.__ready_by = 'health'
+      return True
+
+    if (self.__connect_fallback_secs is not None
+        and self.elapsed_secs >= self.__connect_fallback_secs
+        and self.__connect_to_service(timeout)):
+      sys.stderr.write(
+          'WARNING: {name} is accepting connections but {url} did not report'
+          ' it healthy after {secs:.1f}s (last status={status}).'
+          ' Assuming it is ready.\n'.format(
+              name=self.__name, url=self.__url, secs=self.elapsed_secs,
+              status=status))
+      self.__ready_time = self.__clock()
+      self.__ready_by = 'connect'
+      return True
+
+    delay = self.__backoff_secs * (1 - self.__jitter * random.random())
+    self.__next_attempt_time = now + delay
+    self.__backoff_secs = min(self.__max_backoff_secs,
+                              self.__backoff_secs * self.__backoff_multiplier)
+    return False
+
+  def __connect_to_service(self, timeout):
+    """Determine if the service in the url is accepting connections."""
+    parsed = urlparse.urlparse(self.__url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    return self.__connect(parsed.hostname, port, timeout)
+
+  def check_still_running(self):
+    """Raise SystemExit if the process died or the deadline has passed."""
+    if self.__pid is not None:
+      try:
+        os.kill(self.__pid, 0)
+      except OSError:
+        raise SystemExit('{name} failed to start'.format(name=self.__name))
+
+    if (self.__deadline_secs is not None
+        and self.elapsed_secs >= self.__deadline_secs):
+      raise SystemExit(
+          '{name} was not ready after {secs:.1f}s'
+          ' ({attempts} probes of {url}, last status={status})'.format(
+              name=self.__name, secs=self.elapsed_secs,
+              attempts=self.__attempts, url=self.__url,
+              status=self.__last_status))
+
+  @staticmethod
+  def is_healthy(status, body):
+    """Determine if a /health response indicates the service is up.
+
+    Spring Boot answers 200 when the service is UP and 503 when it is not.
+    Any other HTTP response means the service is answering requests but
+    the health endpoint is not exposed to us, so we treat that as ready.
+
+    Args:
+      status [int]: The HTTP status code, or None if there was no response.
+      body [string]: The response body.
+    """
+    if status is None or status >= 500:
+      return False
+    if status != 200:
+      return True
+    try:
+      doc = json.loads(body)
+    except ValueError:
+      return True
+    return not isinstance(doc, dict) or doc.get('status', 'UP') == 'UP'
+
+
+def http_get(url, timeout):
+  """Perform an HTTP GET.
+
+  Returns:
+    (status, body) where status is None if there was no HTTP response.
+  """
+  try:
+    response = urllib2.urlopen(url, timeout=timeout)
+    try:
+      return response.getcode(), response.read()
+    finally:
+      response.close()
+  except urllib2.HTTPError as error:
+    return error.code, error.read()
+  except (urllib2.URLError, socket.error, IOError):
+    return None, ''
+
+
+def tcp_connect(host, port, timeout):
+  """Determine if a TCP connection can be made to host:port."""
+  try:
+    sock = socket.create_connection((host, port), timeout)
+  except (socket.error, IOError):
+    return False
+  sock.close()
+  return True
+
+
+class ReadinessMonitor(object):
+  """Waits on many HealthProbes at once from a single thread."""
+
+  # How often to echo log files while waiting between probes.
+  LOG_POLL_SECS = 0.25
+
+  @property
+  def probes(self):
+    """All the probes that were added, in the order they were added."""
+    return list(self.__probes)
+
+  def __init__(self, sleep=time.sleep, clock=time.time):
+    self.__sleep = sleep
+    self.__clock = clock
+    self.__probes = []
+    self.__pending = []
+    self.__tailers = {}
+
+  def add(self, probe, log_path=None, show_log_after_secs=0.5):
+    """Start waiting on a probe.
+
+    Args:
+      probe [HealthProbe]: The probe to wait on.
+      log_path [string]: If not None, the log file to echo while waiting.
+      show_log_after_secs [float]: How long to wait before echoing the log.
+    """
+    self.__probes.append(probe)
+    self.__pending.append(probe)
+    if log_path:
+      self.__tailers[probe] = (self.__clock() + show_log_after_secs,
+                               LogTailer(log_path))
+
+  def close(self):
+    for _, tailer in self.__tailers.values():
+      tailer.close()
+    self.__tailers = {}
+
+  def wait_for_any(self):
+    """Wait until at least one of the pending probes becomes ready.
+
+    Returns:
+      The list of probes that became ready.
+    """
+    while self.__pending:
+      now = self.__clock()
+      ready = []
+      for probe in list(self.__pending):
+        if probe.next_attempt_time > now:
+          probe.check_still_running()
+        elif probe.attempt():
+          ready.append(probe)
+      self.__poll_logs(now)
+
+      if ready:
+        for probe in ready:
+          self.__pending.remove(probe)
+          entry = self.__tailers.pop(probe, None)
+          if entry:
+            entry[1].close()
+        return ready
+
+      now = self.__clock()
+      delay = min([probe.next_attempt_time for probe in self.__pending]) - now
+      if self.__tailers:
+        delay = min(delay, self.LOG_POLL_SECS)
+      if delay > 0:
+        self.__sleep(delay)
+    return []
+
+  def __poll_logs(self, now):
+    for show_time, tailer in self.__tailers.values():
+      if now >= show_time:
+        tailer.poll()
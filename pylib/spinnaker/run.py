@@ -17,10 +17,15 @@
 """Provides support functions for running shell commands."""
 
 import collections
-import fcntl
+import errno
 import os
+import select
 import subprocess
 import sys
+import tempfile
+import time
+
+import command_telemetry
 
 
 class RunResult(collections.namedtuple('RunResult',
@@ -32,48 +37,195 @@ class RunResult(collections.namedtuple('RunResult',
   pass
 
 
-def __collect_from_stream(stream, buffer, echo_stream, observe_data):
-  """Read all the input from a stream.
-
-  Args:
-    stream [File]: The file to read() from.
-    buffer [list of string]: The buffer to append the collected data to.
-       This will write a single chunk if any data was read.
-    echo_stream [stream]: If not None, the File to write() for logging
-       the stream.
+class SpooledRunResult(RunResult):
+  """A RunResult whose full output was spooled to temporary files.
 
-  Returns:
-    Number of additional bytes added to the buffer.
+  stdout and stderr only hold the tail of the output that was kept in memory.
+  The full output is read back from the files on demand. The files are
+  removed when close() is called or the result is garbage collected.
   """
-  collected = []
-  try:
+
+  @property
+  def stdout_file(self):
+    """Returns the file containing all of stdout, rewound to the start."""
+    self.__stdout_file.seek(0)
+    return self.__stdout_file
+
+  @property
+  def stderr_file(self):
+    """Returns the file containing all of stderr, rewound to the start."""
+    self.__stderr_file.seek(0)
+    return self.__stderr_file
+
+  def __new__(cls, returncode, stdout, stderr, stdout_file, stderr_file):
+    result = super(SpooledRunResult, cls).__new__(
+        cls, returncode, stdout, stderr)
+    result.__stdout_file = stdout_file
+    result.__stderr_file = stderr_file
+    return result
+
+  def read_stdout(self):
+    """Returns all of stdout."""
+    return self.stdout_file.read()
+
+  def read_stderr(self):
+    """Returns all of stderr."""
+    return self.stderr_file.read()
+
+  def close(self):
+    """Removes the spooled output files."""
+    self.__stdout_file.close()
+    self.__stderr_file.close()
+
+
+# The most we will read from a child's output stream at a time.
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class _StreamCollector(object):
+  """Collects the output from one of a child process's streams."""
+
+  @property
+  def closed(self):
+    return self.__closed
+
+  @property
+  def spool_file(self):
+    return self.__spool_file
+
+  @property
+  def total_bytes(self):
+    """The number of bytes read so far, including any no longer buffered."""
+    return self.__total_bytes
+
+  def __init__(self, stream, echo_stream, observe_data,
+               max_buffer_bytes=None, spool_file=None):
+    """Constructor.
+
+    Args:
+      stream [File]: The file to read() from.
+      echo_stream [stream]: If not None, the File to write() for logging
+         the stream.
+      observe_data [callable]: If not None, called with a list of the
+         complete lines of text as they are read. Any partial last line is
+         passed once the stream is closed.
+      max_buffer_bytes [int]: If not None, only keep this many of the most
+         recently read bytes in memory.
+      spool_file [File]: If not None, write() all the data here as well.
+    """
+    self.__fd = stream.fileno()
+    self.__echo_stream = echo_stream
+    self.__observe_data = observe_data
+    self.__max_buffer_bytes = max_buffer_bytes
+    self.__spool_file = spool_file
+    self.__chunks = collections.deque()
+    self.__buffered_bytes = 0
+    self.__total_bytes = 0
+    self.__partial_line = ''
+    self.__closed = False
+
+  def read(self):
+    """Read the next chunk of available data.
+
+    This will block if there is no data yet available.
+
+    Returns:
+      Number of additional bytes collected. 0 means the stream is closed.
+    """
     while True:
-      got = os.read(stream.fileno(), 1)
-      if not got:
+      try:
+        got = os.read(self.__fd, READ_CHUNK_SIZE)
         break
-      collected.append(got)
-      if echo_stream:
-        echo_stream.write(got)
-        echo_stream.flush()
-  except OSError:
-    pass
+      except OSError as ex:
+        if ex.errno != errno.EINTR:
+          raise
+
+    if not got:
+      self.__closed = True
+      if self.__observe_data and self.__partial_line:
+        self.__observe_data([self.__partial_line])
+        self.__partial_line = ''
+      return 0
+
+    self.__total_bytes += len(got)
+    self.__buffer(got)
+    if self.__spool_file:
+      self.__spool_file.write(got)
+    if self.__echo_stream:
+      self.__echo_stream.write(got)
+      self.__echo_stream.flush()
+
+    if self.__observe_data:
+      text = self.__partial_line + got
+      eoln = text.rfind('\n')
+      if eoln < 0:
+        self.__partial_line = text
+      else:
+        self.__partial_line = text[eoln + 1:]
+        self.__observe_data(text[:eoln + 1].splitlines(True))
+    return len(got)
+
+  def __buffer(self, data):
+    """Add data to the in-memory buffer, dropping the oldest if full."""
+    self.__chunks.append(data)
+    self.__buffered_bytes += len(data)
+    limit = self.__max_buffer_bytes
+    if limit is None:
+      return
+    while (len(self.__chunks) > 1
+           and self.__buffered_bytes - len(self.__chunks[0]) >= limit):
+      self.__buffered_bytes -= len(self.__chunks.popleft())
+
+  def getvalue(self):
+    """Returns the data collected so far that is still in memory."""
+    data = ''.join(self.__chunks)
+    if (self.__max_buffer_bytes is not None
+        and len(data) > self.__max_buffer_bytes):
+      data = data[len(data) - self.__max_buffer_bytes:]
+    return data
+
+
+def __wait_for_readable(fds):
+  """Block until at least one of the file descriptors is readable.
+
+  Args:
+    fds [list of int]: The file descriptors to wait on.
 
-  # Chunk together all the data we just received.
-  if collected:
-      buffer.append(''.join(collected))
-  if observe_data:
-    observe_data(collected)
-  return len(collected)
+  Returns:
+    The list of file descriptors that can be read without blocking.
+    A closed stream is considered readable.
+  """
+  while True:
+    try:
+      if hasattr(select, 'poll'):
+        poller = select.poll()
+        for fd in fds:
+          poller.register(fd, select.POLLIN | select.POLLPRI)
+        return [fd for fd, _ in poller.poll()]
+      return select.select(fds, [], [])[0]
+    except select.error as ex:
+      if ex.args[0] != errno.EINTR:
+        raise
 
 
 def run_and_monitor(command, echo=True, input=None,
-                    observe_stdout=None, observe_stderr=None):
+                    observe_stdout=None, observe_stderr=None,
+                    max_buffer_bytes=None, spool_output=False):
   """Run the provided command in a subprocess shell.
 
   Args:
     command [string]: The shell command to execute.
     echo [bool]: If True then echo the command and output to stdout.
     input [string]: If non-empty then feed this to stdin.
+    observe_stdout [callable]: If not None, called with lists of complete
+       lines from stdout as they arrive.
+    observe_stderr [callable]: If not None, called with lists of complete
+       lines from stderr as they arrive.
+    max_buffer_bytes [int]: If not None, only keep the last this many bytes
+       of stdout and of stderr in memory. The returned stdout and stderr
+       will be truncated to this size.
+    spool_output [bool]: If True then also write all the output to
+       temporary files and return a SpooledRunResult for reading it back.
 
   Returns:
     RunResult with result code and output from running the command.
@@ -82,36 +234,51 @@ def run_and_monitor(command, echo=True, input=None,
     print command
 
   sys.stdout.flush()
+  start_time = time.time()
   stdin = subprocess.PIPE if input else None
   process = subprocess.Popen(
       command,
       stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=stdin,
       shell=True, close_fds=True)
 
-  # Setup for nonblocking reads
-  fl = fcntl.fcntl(process.stdout, fcntl.F_GETFL)
-  fcntl.fcntl(process.stdout, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-  fl = fcntl.fcntl(process.stderr, fcntl.F_GETFL)
-  fcntl.fcntl(process.stderr, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-
   if stdin:
       process.stdin.write(input)
       process.stdin.close()
 
-  out = []
-  err = []
-  echo_out = sys.stdout if echo else None
-  echo_err = sys.stderr if echo else None
-  while (__collect_from_stream(process.stdout, out, echo_out, observe_stdout)
-         or  __collect_from_stream(process.stderr, err, echo_err, observe_stderr)
-         or process.poll() is None):
-      pass
-
-  # Get any trailing data from termination race condition
-  __collect_from_stream(process.stdout, out, echo_out, observe_stdout)
-  __collect_from_stream(process.stderr, err, echo_err, observe_stderr)
-
-  return RunResult(process.returncode, ''.join(out), ''.join(err))
+  out = _StreamCollector(
+      process.stdout, sys.stdout if echo else None, observe_stdout,
+      max_buffer_bytes=max_buffer_bytes,
+      spool_file=tempfile.TemporaryFile() if spool_output else None)
+  err = _StreamCollector(
+      process.stderr, sys.stderr if echo else None, observe_stderr,
+      max_buffer_bytes=max_buffer_bytes,
+      spool_file=tempfile.TemporaryFile() if spool_output else None)
+  collectors = {process.stdout.fileno(): out, process.stderr.fileno(): err}
+
+  # Read in large chunks from whichever stream has data, blocking while
+  # neither does, until the child has closed both of them.
+  while collectors:
+    for fd in __wait_for_readable(collectors.keys()):
+      collector = collectors[fd]
+      collector.read()
+      if collector.closed:
+        del collectors[fd]
+
+  if command_telemetry.is_enabled():
+    rusage = command_telemetry.wait_for_process(process)
+    command_telemetry.record(
+        'run_and_monitor', command, start_time, time.time() - start_time,
+        process.returncode, out.total_bytes + err.total_bytes, rusage)
+  else:
+    process.wait()
+  process.stdout.close()
+  process.stderr.close()
+  if spool_output:
+    out.spool_file.flush()
+    err.spool_file.flush()
+    return SpooledRunResult(process.returncode, out.getvalue(), err.getvalue(),
+                            out.spool_file, err.spool_file)
+  return RunResult(process.returncode, out.getvalue(), err.getvalue())
 
 
 def run_quick(command, echo=True):
@@ -126,9 +293,18 @@ def run_quick(command, echo=True):
        The content of stderr will be joined into stdout.
        stderr itself will be None.
   """
+  start_time = time.time()
   p = subprocess.Popen(command, shell=True, close_fds=True,
                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-  stdout, stderr = p.communicate()
+  if command_telemetry.is_enabled():
+    stdout = p.stdout.read()
+    p.stdout.close()
+    rusage = command_telemetry.wait_for_process(p)
+    command_telemetry.record(
+        'run_quick', command, start_time, time.time() - start_time,
+        p.returncode, len(stdout), rusage)
+  else:
+    stdout, stderr = p.communicate()
   if echo:
     print command
     print stdout
@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import argparse
+import json
 import os
 import re
 import resource
@@ -34,6 +35,11 @@ from fetch import check_fetch
 from fetch import get_google_project
 from fetch import is_google_instance
 from fetch import GOOGLE_METADATA_URL
+from process_discovery import find_java_subsystem_jobs
+from process_discovery import have_proc_filesystem
+from process_discovery import write_pid_file
+from readiness_probe import HealthProbe
+from readiness_probe import ReadinessMonitor
 from run import check_run_quick
 from run import run_quick
 
@@ -72,9 +78,25 @@ class Runner(object):
   INDEPENDENT_SUBSYSTEM_LIST=['clouddriver', 'front50', 'orca', 'rosco',
                               'echo']
 
+  # Subsystems that must be accepting requests before the keyed subsystem
+  # is started. Dependencies that are not being started, or are not enabled
+  # by services.<name>.enabled, are ignored.
+  SUBSYSTEM_DEPENDENCIES = {
+      'fiat': ['clouddriver', 'front50'],
+      'igor': ['echo'],
+      'gate': INDEPENDENT_SUBSYSTEM_LIST + ['fiat', 'igor']
+  }
+
   # Denotes a process running on an external host
   EXTERNAL_PID = -123
 
+  # How long to wait for a subsystem to report healthy before settling for
+  # it accepting connections.
+  HEALTH_CONNECT_FALLBACK_SECS = 60
+
+  # How long to wait for a started subsystem to become ready.
+  DEFAULT_READINESS_DEADLINE_SECS = 600
+
   @property
   def _first_time_use_instructions(self):
     """Instructions for configuring Spinnaker for the first time.
@@ -160,7 +182,7 @@ class Runner(object):
     return result
 
   @staticmethod
-  def run_daemon(path, args, detach=True, environ=None):
+  def run_daemon(path, args, detach=True, environ=None, pid_path=None):
     """Run a program as a long-running background process.
 
     Args:
@@ -168,12 +190,21 @@ class Runner(object):
       args [list of string]: Arguments to pass to program
       detach [bool]: True if we're running it in separate process group.
          A separate process group will continue after we exit.
+      environ [dict]: If set, use these environment variables instead.
+      pid_path [string]: If set, write the pid of the process here.
+         When detached, this is also the session id of anything it starts.
     """
     pid = os.fork()
     if pid == 0:
       if detach:
         os.setsid()
     else:
+      if pid_path:
+        try:
+          write_pid_file(pid_path, pid)
+        except IOError as error:
+          sys.stderr.write('WARNING: Could not write {path}: {error}\n'
+                           .format(path=pid_path, error=error))
       return pid
 
     # Iterate through and close all file descriptors
@@ -239,7 +270,12 @@ class Runner(object):
                      '("{command}" > "{log}.log") 2>&1 '
                      '| tee -a "{log}.log" >& "{log}.err"'
                      .format(command=command, log=base_log_path)],
-                     environ=environ)
+                     environ=environ,
+                     pid_path=self.subsystem_pid_path(subsystem))
+
+  def subsystem_pid_path(self, subsystem):
+    """Returns the path of the pid file written when starting the subsystem."""
+    return os.path.join(self.__installation.LOG_DIR, subsystem + '.pid')
 
   def get_subsystem_environ(self, subsystem):
     if self.__bindings and subsystem != 'clouddriver':
@@ -269,6 +305,15 @@ class Runner(object):
 
     return environ
 
+  def is_subsystem_enabled(self, subsystem):
+    """Determine if the subsystem is enabled.
+
+    Subsystems are enabled unless services.<subsystem>.enabled is false.
+    """
+    enabled = self.__bindings.get(
+        'services.{system}.enabled'.format(system=subsystem))
+    return enabled is None or bool(enabled)
+
   def maybe_start_job(self, jobs, subsystem):
       if subsystem in jobs:
         print '{subsystem} already running as pid {pid}'.format(
@@ -278,18 +323,12 @@ class Runner(object):
         return self.start_subsystem_if_local(
               subsystem, environ=self.get_subsystem_environ(subsystem))
 
-  def start_spinnaker_subsystems(self, jobs):
-    started_list = []
-    for subsys in self.INDEPENDENT_SUBSYSTEM_LIST:
-        pid = self.maybe_start_job(jobs, subsys)
-        if pid:
-          started_list.append((subsys, pid))
+  def start_spinnaker_subsystems(self, jobs, deadline_secs=None):
+    subsystems = list(self.INDEPENDENT_SUBSYSTEM_LIST)
 
     fiat_enabled = self.__bindings.get('services.fiat.enabled')
     if fiat_enabled:
-      pid = self.maybe_start_job(jobs, 'fiat')
-      if pid:
-        started_list.append(('fiat', pid))
+      subsystems.append('fiat')
 
     jenkins_address = self.__bindings.get(
         'services.jenkins.defaultMaster.baseUrl')
@@ -311,15 +350,99 @@ class Runner(object):
               address=jenkins_address))
 
     if igor_enabled:
-      pid = self.maybe_start_job(jobs, 'igor')
-      if pid:
-        started_list.append(('igor', pid))
+      subsystems.append('igor')
+
+    subsystems.append('gate')
+    self.start_and_wait_for_subsystems(jobs, subsystems,
+                                       deadline_secs=deadline_secs)
+
+  def start_and_wait_for_subsystems(self, jobs, subsystems,
+                                    show_log_while_waiting=True,
+                                    deadline_secs=None):
+    """Start subsystems as soon as their dependencies are healthy.
+
+    Every subsystem whose SUBSYSTEM_DEPENDENCIES are ready is started at
+    once, and all the started subsystems are probed concurrently.
+
+    Args:
+      jobs [dict]: The pids of already running subsystems keyed by name.
+      subsystems [list of string]: The subsystems to start.
+      show_log_while_waiting [bool]: Whether to echo slow subsystem logs.
+      deadline_secs [float]: If not None, fail if a subsystem is not ready
+         this many seconds after it was started.
+
+    Returns:
+      Dictionary of seconds each subsystem took to become ready, keyed by name.
+    """
+    start_time = time.time()
+    not_started = list(subsystems)
+    ready_secs = {}
+    monitor = ReadinessMonitor()
+    num_waiting = 0
+
+    try:
+      while not_started or num_waiting:
+        num_not_started = len(not_started)
+        for subsystem in list(not_started):
+          dependencies = [
+              name for name in self.SUBSYSTEM_DEPENDENCIES.get(subsystem, [])
+              if name in subsystems and self.is_subsystem_enabled(name)]
+          if [name for name in dependencies if name not in ready_secs]:
+            continue
+          not_started.remove(subsystem)
+          pid = self.maybe_start_job(jobs, subsystem)
+          if pid:
+            probe, log_path = self.make_health_probe(
+                subsystem, pid, deadline_secs)
+            if pid == self.EXTERNAL_PID or not show_log_while_waiting:
+              log_path = None
+            monitor.add(probe, log_path=log_path)
+            num_waiting += 1
+          else:
+            ready_secs[subsystem] = time.time() - start_time
+
+        if not num_waiting:
+          if len(not_started) == num_not_started:
+            raise ValueError('Cyclic dependencies among {names}'.format(
+                names=not_started))
+          continue
 
-    for subsystem in started_list:
-      self.wait_for_service(subsystem[0], pid=subsystem[1])
+        for probe in monitor.wait_for_any():
+          num_waiting -= 1
+          ready_secs[probe.name] = time.time() - start_time
+          print ('Spinnaker subsystem={subsys} is up after {secs:.1f}s.'
+                 .format(subsys=probe.name, secs=probe.elapsed_secs))
+    finally:
+      monitor.close()
 
-    pid = self.maybe_start_job(jobs, 'gate')
-    self.wait_for_service('gate', pid=pid)
+    self.report_readiness(time.time() - start_time,
+                          [probe.metrics for probe in monitor.probes])
+    return ready_secs
+
+  def report_readiness(self, total_secs, metrics):
+    """Show how long each subsystem took to become ready.
+
+    The metrics are also written as JSON into the log directory so that
+    a slow service can be told apart from a slow poll.
+
+    Args:
+      total_secs [float]: The time it took for everything to be ready.
+      metrics [list of dict]: The HealthProbe metrics for each subsystem.
+    """
+    print 'Subsystems ready after {secs:.1f}s:'.format(secs=total_secs)
+    print '  {0:<12} {1:>7} {2:>8} {3:>10}'.format(
+        'SUBSYSTEM', 'READY', 'PROBES', 'MAX PROBE')
+    for entry in sorted(metrics, key=lambda entry: entry['elapsed_secs']):
+      print '  {name:<12} {elapsed_secs:6.1f}s {attempts:8d} {max:9.3f}s'.format(
+          max=entry['max_probe_secs'], **entry)
+
+    try:
+      path = os.path.join(self.__installation.LOG_DIR, 'readiness.json')
+      with open(path, 'w') as f:
+        json.dump({'total_secs': total_secs, 'subsystems': metrics}, f,
+                  indent=2, sort_keys=True)
+    except (AttributeError, IOError):
+      pass
 
   def get_all_java_subsystem_jobs(self):
     """Look up all the running java jobs.
@@ -327,6 +450,12 @@ class Runner(object):
     Returns:
        dictionary keyed by package name (spinnaker subsystem) with pid values.
     """
+    if have_proc_filesystem():
+      return find_java_subsystem_jobs(
+          self.__installation.SUBSYSTEM_ROOT_DIR,
+          pid_files={name: self.subsystem_pid_path(name)
+                     for name in self.get_all_subsystem_names()})
+
     re_pid_and_subsystem = None
 
     # Try jps, but this is not currently available on openjdk-8-jre
@@ -405,7 +534,12 @@ class Runner(object):
     return subprocess.Popen(['/usr/bin/tail', '-f', path], stdout=sys.stdout,
                             shell=False)
 
-  def wait_for_service(self, subsystem, pid, show_log_while_waiting=True):
+  def make_health_probe(self, subsystem, pid, deadline_secs=None):
+    """Create the HealthProbe for a subsystem that was just started.
+
+    Returns:
+      The probe and the path to the subsystem's log file.
+    """
     try:
       port, address = self.find_port_and_address(subsystem)
     except KeyError:
@@ -415,51 +549,37 @@ class Runner(object):
       sys.stderr.write(error)
       raise SystemExit(error)
 
-    log_path = os.path.join(self.__installation.LOG_DIR, subsystem + '.log')
-    print ('Waiting for {subsys} to start accepting requests on port {port}...'
-           .format(subsys=subsystem, port=port))
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-    tail_process = None
-    wait_msg_retries = 5 # Give half a second before showing log/warning.
-    while True:
-      if address:
-        host_colon = address.find(':')
-        host = address if host_colon < 0 else address[:host_colon]
-      else:
-        host = 'localhost'
-
-      try:
-        sock.connect((host, port))
-        break
-      except IOError:
-        if pid == self.EXTERNAL_PID:
-           tail_process = True  # Pretend, but really nothing to tail.
-        else:
-           try:
-             os.kill(pid, 0)
-           except OSError:
-             raise SystemExit('{subsys} failed to start'.format(
-                 subsys=subsystem))
-
-        if show_log_while_waiting and not tail_process:
-          if wait_msg_retries > 0:
-            # Give an initial delay before checking,
-            # as well as a delay between checks.
-            # The initial delay is because of a race condition having an old
-            # log file and starting to write a new one.
-            wait_msg_retries -= 1
-          elif not os.path.exists(log_path):
-            print '{path} does not yet exist..'.format(path=log_path)
-            wait_msg_retries = 5  # don't display again for half a second.
-          else:
-            tail_process = self.start_tail(log_path)
-
-        time.sleep(0.1)
+    if address:
+      host_colon = address.find(':')
+      host = address if host_colon < 0 else address[:host_colon]
+    else:
+      host = 'localhost'
 
-    if tail_process and pid != self.EXTERNAL_PID:
-      tail_process.kill()
-    sock.close()
+    protocol = ((self.__bindings
+                 and self.__bindings.get('services.default.protocol'))
+                or 'http')
+    url = '{protocol}://{host}:{port}/health'.format(
+        protocol=protocol, host=host, port=port)
+    log_path = os.path.join(self.__installation.LOG_DIR, subsystem + '.log')
+    print 'Waiting for {subsys} to report healthy at {url}...'.format(
+        subsys=subsystem, url=url)
+    probe = HealthProbe(subsystem, url,
+                        pid=None if pid == self.EXTERNAL_PID else pid,
+                        deadline_secs=deadline_secs,
+                        connect_fallback_secs=self.HEALTH_CONNECT_FALLBACK_SECS)
+    return probe, log_path
+
+  def wait_for_service(self, subsystem, pid, show_log_while_waiting=True,
+                       deadline_secs=None):
+    probe, log_path = self.make_health_probe(subsystem, pid, deadline_secs)
+    if pid == self.EXTERNAL_PID or not show_log_while_waiting:
+      log_path = None
+    monitor = ReadinessMonitor()
+    try:
+      monitor.add(probe, log_path=log_path)
+      monitor.wait_for_any()
+    finally:
+      monitor.close()
     print 'Spinnaker subsystem={subsys} is up.'.format(subsys=subsystem)
 
 
@@ -513,7 +633,9 @@ Proceeding anyway.
     google_enabled = self.__bindings.get('providers.google.enabled')
 
     jobs = self.get_all_java_subsystem_jobs()
-    self.start_spinnaker_subsystems(jobs)
+    self.start_spinnaker_subsystems(
+        jobs, deadline_secs=getattr(options, 'readiness_deadline_secs',
+                                    self.DEFAULT_READINESS_DEADLINE_SECS))
     self.start_deck()
     print 'Started all Spinnaker components.'
 
@@ -589,6 +711,11 @@ Proceeding anyway.
     parser.add_argument('action', help='START or STOP or RESTART')
     parser.add_argument('component',
                         help='Name of component to start or stop, or ALL')
+    parser.add_argument('--readiness_deadline_secs',
+                        default=self.DEFAULT_READINESS_DEADLINE_SECS,
+                        type=float,
+                        help='Fail if a started subsystem is not ready'
+                             ' within this many seconds.')
 
   def check_configuration(self, options):
     local_path = os.path.join(self.__installation.USER_CONFIG_DIR,
@@ -12,10 +12,114 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import os
 import re
+import threading
 import yaml
 
+
+# Matches a spring-style ${key} or ${key:default} variable reference.
+_EXPRESSION_RE = re.compile('\${([\._a-zA-Z0-9]+)(:.+?)?}')
+
+# Marks a field in the resolved value cache that is known not to exist.
+_NOT_FOUND = object()
+
+# Text that could be a plain scalar on a single line.
+# This anchors with \Z because $ would also match before a trailing newline.
+_PRINTABLE_ASCII_RE = re.compile('^[\x21-\x7e](?:[\x20-\x7e]*[\x21-\x7e])?\Z')
+
+# Characters that cannot start a plain scalar.
+# The first three can if they are followed by a non-space.
+_INDICATOR_CHARS = '-?:,[]{}#&*!|>\'"%@`'
+
+
+class TypedScalarResolver(object):
+  """Converts the text of a YAML value into the value the Loader would give.
+
+  This is equivalent to yaml.load('x: {text}')['x'] but plain scalars are
+  typed directly with the Loader's implicit resolver regexes and scalar
+  constructors rather than going through the full parser. Anything else
+  (quoted strings, flows, comments, etc) falls back to the parser.
+  Results are kept in an LRU cache keyed by the text.
+  """
+
+  # The implicit tags we construct directly. Others (e.g. merge) fall back.
+  SCALAR_TAGS = frozenset([
+      u'tag:yaml.org,2002:null',
+      u'tag:yaml.org,2002:bool',
+      u'tag:yaml.org,2002:int',
+      u'tag:yaml.org,2002:float',
+      u'tag:yaml.org,2002:timestamp',
+      u'tag:yaml.org,2002:str'
+  ])
+
+  def __init__(self, capacity=1024):
+    self.__capacity = capacity
+    self.__cache = collections.OrderedDict()
+    self.__lock = threading.Lock()
+    self.__constructors = yaml.Loader.yaml_constructors
+    self.__constructor_instance = yaml.constructor.Constructor()
+    implicit = yaml.Loader.yaml_implicit_resolvers
+    wildcard = implicit.get(None, [])
+    self.__resolvers = {first: list(resolvers) + wildcard
+                        for first, resolvers in implicit.items()
+                        if first is not None}
+    self.__wildcard_resolvers = wildcard
+
+  def __call__(self, text):
+    with self.__lock:
+      try:
+        value = self.__cache.pop(text)
+        self.__cache[text] = value
+        return value
+      except KeyError:
+        pass
+
+    value = self.__plain_scalar_value(text)
+    if value is _NOT_FOUND:
+      value = yaml.load('x: {0}'.format(text), Loader=yaml.Loader)['x']
+      if isinstance(value, (dict, list)):
+        # Do not share mutable values across callers.
+        return value
+
+    with self.__lock:
+      self.__cache[text] = value
+      if len(self.__cache) > self.__capacity:
+        self.__cache.popitem(last=False)
+    return value
+
+  def __plain_scalar_value(self, text):
+    """Returns the typed value of a plain scalar, or _NOT_FOUND if not one."""
+    if text:
+      if not _PRINTABLE_ASCII_RE.match(text):
+        return _NOT_FOUND
+      if text[0] in _INDICATOR_CHARS:
+        if text[0] not in '-?:' or len(text) == 1 or text[1] == ' ':
+          return _NOT_FOUND
+      if text.find(': ') >= 0 or text.find(' #') >= 0 or text[-1] == ':':
+        return _NOT_FOUND
+      text = unicode(text)
+      resolvers = self.__resolvers.get(text[0], self.__wildcard_resolvers)
+    else:
+      text = u''
+      resolvers = self.__resolvers.get(u'', self.__wildcard_resolvers)
+
+    tag = yaml.Loader.DEFAULT_SCALAR_TAG
+    for resolver_tag, regexp in resolvers:
+      if regexp.match(text):
+        tag = resolver_tag
+        break
+    if tag not in self.SCALAR_TAGS:
+      return _NOT_FOUND
+
+    node = yaml.nodes.ScalarNode(tag, text)
+    return self.__constructors[tag](self.__constructor_instance, node)
+
+
+typed_scalar_value = TypedScalarResolver()
+
+
 def yml_or_yaml_path(basedir, basename):
   """Return a path to the requested YAML file.
 
@@ -38,8 +142,102 @@ def yml_or_yaml_path(basedir, basename):
   return yml_path
 
 
+class YamlPathEntry(object):
+  """The nodes and source offsets for a key in a composed yaml document.
+
+  The offsets start out as the node marks but are maintained separately
+  so that they can be shifted as the source text is edited.
+  """
+  __slots__ = ['key_node', 'value_node',
+               'key_start', 'key_column', 'value_start', 'value_end']
+
+  def __init__(self, key_node, value_node):
+    self.key_node = key_node
+    self.value_node = value_node
+    self.key_start = key_node.start_mark.index
+    self.key_column = key_node.start_mark.column
+    self.value_start = value_node.start_mark.index
+    self.value_end = value_node.end_mark.index
+
+
+class YamlPathIndex(object):
+  """Maps dot-delimited key paths to their YamlPathEntry in a yaml document.
+
+  The index is built in a single walk of the composed tree so that
+  looking up a key does not scan sibling nodes. It can be reused across
+  edits to the source that do not add or remove keys by calling
+  shift() after each edit.
+  """
+
+  def __init__(self, root_node):
+    """Constructor.
+
+    Args:
+      root_node: [yaml.nodes.MappingNode] The composed yaml tree, or None.
+    """
+    self.__entries = {}
+    stack = [('', root_node)]
+    while stack:
+      prefix, node = stack.pop()
+      if not isinstance(node, yaml.nodes.MappingNode):
+        continue
+      for key_node, value_node in node.value:
+        key = key_node.value
+        if not isinstance(key, basestring) or key.find('.') >= 0:
+          continue
+        path = prefix + key
+        if path in self.__entries:
+          # The first occurrence of a key is the one that we edit.
+          continue
+        self.__entries[path] = YamlPathEntry(key_node, value_node)
+        stack.append((path + '.', value_node))
+
+  def get(self, path, default=None):
+    """Returns the YamlPathEntry for the path."""
+    return self.__entries.get(path, default)
+
+  def closest(self, parts):
+    """Find the deepest existing entry along a key path.
+
+    Args:
+      parts: [list of string] The components of the key path.
+
+    Returns:
+      entry, depth where entry is the YamlPathEntry for the first depth
+      parts of the path. The entry is None and depth is 0 if not even the
+      first part exists.
+    """
+    for depth in range(len(parts), 0, -1):
+      entry = self.__entries.get('.'.join(parts[0:depth]))
+      if entry is not None:
+        return entry, depth
+    return None, 0
+
+  def shift(self, offset, delta):
+    """Adjust the entries for delta characters inserted at offset.
+
+    Offsets at or after offset are moved. A negative delta means
+    characters were removed.
+    """
+    if not delta:
+      return
+    for entry in self.__entries.values():
+      if entry.key_start >= offset:
+        entry.key_start += delta
+      if entry.value_start >= offset:
+        entry.value_start += delta
+      if entry.value_end >= offset:
+        entry.value_end += delta
+
+
 class YamlBindings(object):
-  """Implements a map from yaml using variable references similar to spring."""
+  """Implements a map from yaml using variable references similar to spring.
+
+  Resolved field values are memoized so that repeated lookups against the
+  same bindings do not re-walk the tree or re-resolve nested references.
+  The cache is discarded whenever new values are imported. It assumes the
+  process environment does not change between imports.
+  """
 
   @property
   def map(self):
@@ -47,6 +245,15 @@ class YamlBindings(object):
 
   def __init__(self):
     self.__map = {}
+    self.__resolved = {}
+
+    # The last yaml source that we produced and the YamlPathIndex into it.
+    self.__indexed_source = None
+    self.__source_index = None
+
+    # The last yaml tree passed to find_yaml_context and its YamlPathIndex.
+    self.__indexed_root = None
+    self.__root_index = None
 
   def __getitem__(self, field):
     return self.__get_field_value(field, [], original=field)
@@ -59,6 +266,7 @@ class YamlBindings(object):
 
   def import_dict(self, d):
     if d is not None:
+      self.__resolved = {}
       for name,value in d.items():
         self.__update_field(name, value, self.__map)
 
@@ -100,11 +308,25 @@ class YamlBindings(object):
     """Convert the text of a value into the YAML value.
 
     This is used for type conversion for default values.
-    Not particularly efficient, but there doesnt seem to be a direct API.
     """
-    return yaml.load('x: {0}'.format(value_text), Loader=yaml.Loader)['x']
+    return typed_scalar_value(value_text)
 
   def __get_field_value(self, field, saw, original):
+    value = self.__resolved.get(field, None)
+    if value is _NOT_FOUND:
+      raise KeyError(field)
+    if value is not None or field in self.__resolved:
+      return value
+
+    try:
+      value = self.__resolve_field_value(field, saw, original)
+    except KeyError:
+      self.__resolved[field] = _NOT_FOUND
+      raise
+    self.__resolved[field] = value
+    return value
+
+  def __resolve_field_value(self, field, saw, original):
     value = os.environ.get(field, None)
     if value is None:
       value = self.__get_node(field)
@@ -120,8 +342,7 @@ class YamlBindings(object):
     return self.__resolve_value(value, saw, original)
 
   def __resolve_value(self, value, saw, original):
-    expression_re = re.compile('\${([\._a-zA-Z0-9]+)(:.+?)?}')
-    exact_match = expression_re.match(value)
+    exact_match = _EXPRESSION_RE.match(value)
 
     if exact_match and exact_match.group(0) == value:
       try:
@@ -138,7 +359,7 @@ class YamlBindings(object):
 
     # Look for fragments of ${key} or ${key:default} then resolve them.
     text = value
-    for match in expression_re.finditer(text):
+    for match in _EXPRESSION_RE.finditer(text):
         result.append(text[offset:match.start()])
         try:
           got = self.__get_field_value(str(match.group(1)), saw, original)
@@ -187,9 +408,8 @@ class YamlBindings(object):
     source = '' # declare so this is in scope for both 'with' blocks
     with open(path, 'r') as source_file:
       source = source_file.read()
-      for prop in updated_keys:
-        source = bindings.transform_yaml_source(source, prop,
-                                                add_new_nodes=add_new_nodes)
+      source = bindings.transform_yaml_source_keys(
+          source, updated_keys, add_new_nodes=add_new_nodes)
 
     with open(path, 'w') as source_file:
       source_file.write(source)
@@ -200,6 +420,9 @@ class YamlBindings(object):
     If the key does not exist, then return how we should modify the file
     around the insertion point so that the context is there.
 
+    Keys are looked up in a YamlPathIndex that is reused by subsequent
+    calls for the same root_node.
+
     Args:
       source: [string] The YAML source text.
       root_node: [yaml.nodes.MappingNode]  The composed yaml tree
@@ -222,48 +445,42 @@ class YamlBindings(object):
       else:
         raise ValueError(root_node.__class__.__name__ + ' is not a yaml node.')
 
-    closest_node = None
-    for key_index, key in enumerate(parts):
-      found = False
-      for node in root_node.value:
-        if node[0].value == key:
-          closest_node = node
-          found = True
-          break
-      if not found:
-        break
-      root_node = closest_node[1]
+    if root_node is not self.__indexed_root:
+      self.__indexed_root = root_node
+      self.__root_index = YamlPathIndex(root_node)
+    closest_entry, depth = self.__root_index.closest(parts)
 
-    if closest_node is None:
+    if closest_entry is None:
       if raise_if_not_found:
         raise KeyError(full_key)
       # Nothing matches, so stick this at the start of the file.
       return (self._make_missing_key_text('', parts), '\n'), (0, 0)
 
-    span = (closest_node[1].start_mark.index,
-            closest_node[1].end_mark.index)
+    span = (closest_entry.value_start, closest_entry.value_end)
     span_is_empty = span[0] == span[1]
 
-    if found:
-      # value of closest_node is what we are going to replace.
+    if depth == len(parts):
+      # value of closest_entry is what we are going to replace.
       # There is still a space between the token and value we write.
       return (' ' if span_is_empty else '', ''), span
 
     if raise_if_not_found:
-      raise KeyError('.'.join(parts[0:key_index + 1]))
-
-    # We are going to add a new child. This is going to be indented equal
-    # to the current line if the value isnt empty, otherwise one more level.
-    line_start = closest_node[0].start_mark.index - 1
-    while line_start >= 0 and source[line_start] == ' ':
-      line_start -= 1
+      raise KeyError('.'.join(parts[0:depth + 1]))
 
-    indent = ' ' * (closest_node[0].start_mark.index - line_start + 1)
-    key_text = self._make_missing_key_text(indent, parts[key_index:])
+    # We are going to add a new child.
+    indent = self.__child_indent(closest_entry)
+    key_text = self._make_missing_key_text(indent, parts[depth:])
     if span_is_empty:
-      key_text = '  ' + prefix
+      # The key had no value so start the child on the next line.
+      return ('\n' + indent + key_text, ''), span
     return (key_text, '\n' + indent), (span[0], span[0])
 
+  def __child_indent(self, entry):
+    """Returns the indentation for new children of the entry's key."""
+    if isinstance(entry.value_node, yaml.nodes.MappingNode):
+      return ' ' * entry.value_node.start_mark.column
+    return ' ' * (entry.key_column + 2)
+
   def _make_missing_key_text(self, indent, keys):
     key_context = []
     sep = ''
@@ -292,11 +509,119 @@ class YamlBindings(object):
     Returns:
       Transformed source with value of key replaced to match the bindings.
     """
-    try:
-      value = self[key]
-    except KeyError:
+    return self.transform_yaml_source_keys(
+        source, [key], add_new_nodes=add_new_nodes)
+
+  def transform_yaml_source_keys(self, source, keys, add_new_nodes=True):
+    """Transform the given yaml source so the values of keys match the bindings.
+
+    This is equivalent to calling transform_yaml_source for each of the keys
+    but the source is only composed once. All the keys are located in a
+    single walk of the yaml tree and the edits are spliced into the source
+    in one pass from the end back to the start.
+
+    Keys that are not among the bindings are ignored.
+
+    Args:
+      source [string]: A YAML document
+      keys [list of string]: The keys into the bindings to transform.
+      add_new_nodes [boolean]: If true, add nodes for keys not already present.
+           Otherwise raise a KeyError.
+
+    Returns:
+      Transformed source with values of keys replaced to match the bindings.
+    """
+    key_values = []
+    for key in collections.OrderedDict.fromkeys(keys):
+      try:
+        key_values.append((key, self.__format_yaml_value(self[key])))
+      except KeyError:
+        pass
+    if not key_values:
       return source
 
+    index = self.__get_source_index(source)
+
+    # Edits are (start, end, text, entry) cuts of the original source
+    # where entry is the YamlPathEntry whose value is being replaced, if any.
+    edits = []
+
+    # Keys to add, grouped by their closest existing YamlPathEntry.
+    # The root is grouped under None.
+    missing = collections.OrderedDict()
+
+    for key, value_text in key_values:
+      parts = key.split('.')
+      closest_entry, depth = index.closest(parts)
+      if depth == len(parts):
+        start, end = closest_entry.value_start, closest_entry.value_end
+        # There is still a space between the token and value we write.
+        edits.append((start, end,
+                      (' ' if start == end else '') + value_text,
+                      closest_entry))
+        continue
+
+      if not add_new_nodes:
+        raise KeyError(key if closest_entry is None
+                       else '.'.join(parts[0:depth + 1]))
+
+      tree = missing.setdefault(
+          None if closest_entry is None else id(closest_entry),
+          (closest_entry, collections.OrderedDict()))[1]
+      for part in parts[depth:-1]:
+        tree = tree.setdefault(part, collections.OrderedDict())
+      tree[parts[-1]] = value_text
+
+    for closest_entry, tree in missing.values():
+      edits.append(self.__make_missing_tree_edit(closest_entry, tree))
+
+    # Keep the index if we only replaced existing scalar values with text
+    # that will compose back into a value spanning exactly that text.
+    keep_index = not missing and all(
+        isinstance(edit[3].value_node, yaml.nodes.ScalarNode)
+        and _PRINTABLE_ASCII_RE.match(edit[2].lstrip(' '))
+        and edit[2].find(' #') < 0
+        for edit in edits)
+
+    result = []
+    offset = len(source)
+    for start, end, text, entry in sorted(edits, key=lambda edit: edit[0],
+                                          reverse=True):
+      result.append(source[end:offset])
+      result.append(text)
+      offset = start
+      if keep_index:
+        index.shift(end, len(text) - (end - start))
+        entry.value_start = start + len(text) - len(text.lstrip(' '))
+        entry.value_end = start + len(text)
+    result.append(source[0:offset])
+    result.reverse()
+    source = ''.join(result)
+
+    if keep_index:
+      self.__indexed_source = source
+      self.__source_index = index
+    else:
+      self.__indexed_source = None
+      self.__source_index = None
+    return source
+
+  def __get_source_index(self, source):
+    """Returns a YamlPathIndex for the source.
+
+    This reuses the index from the previous transform if it produced source.
+    """
+    if source == self.__indexed_source:
+      return self.__source_index
+
+    root_node = yaml.compose(source)
+    if root_node is not None and not isinstance(root_node,
+                                                yaml.nodes.MappingNode):
+      raise ValueError(root_node.__class__.__name__ + ' is not a yaml node.')
+    return YamlPathIndex(root_node)
+
+  def __format_yaml_value(self, value):
+    """Returns the text to write into a yaml source for a binding value."""
     if isinstance(value, basestring) and re.search('{[^}]*{', value):
       # Quote strings with nested {} yaml flows
       value = '"{0}"'.format(value)
@@ -305,21 +630,48 @@ class YamlBindings(object):
     if isinstance(value, bool):
       value = str(value).lower()
 
-    yaml_root = yaml.compose(source)
-    context, span = self.find_yaml_context(
-        source, yaml_root, key, not add_new_nodes)
-
-    text_before = context[0]
-    text_after = context[1]
-    start_cut = span[0]
-    end_cut = span[1]
-    return ''.join([
-        source[0:start_cut],
-        text_before,
-        '{value}'.format(value=value),
-        text_after,
-        source[end_cut:]
-    ])
+    return '{value}'.format(value=value)
+
+  def __make_missing_tree_edit(self, closest_entry, tree):
+    """Determine the edit that inserts a tree of new keys into a yaml source.
+
+    Args:
+      closest_entry: [YamlPathEntry] The existing key to add the tree under,
+         or None for the root.
+      tree: [OrderedDict] Nested dictionary of new keys whose leaves are
+         the value text to write.
+
+    Returns:
+      The (start, end, text, None) edit to apply to the source.
+    """
+    lines = []
+    stack = [(0, tree.items()[::-1])]
+    while stack:
+      depth, items = stack[-1]
+      if not items:
+        stack.pop()
+        continue
+      key, value = items.pop()
+      if isinstance(value, dict):
+        lines.append('{extra_indent}{key}:'.format(
+            extra_indent='  ' * depth, key=key))
+        stack.append((depth + 1, value.items()[::-1]))
+      else:
+        lines.append('{extra_indent}{key}: {value}'.format(
+            extra_indent='  ' * depth, key=key, value=value))
+
+    if closest_entry is None:
+      # Stick this at the start of the file.
+      return (0, 0, '\n'.join(lines) + '\n', None)
+
+    offset = closest_entry.value_start
+    sep = '\n' + self.__child_indent(closest_entry)
+    if offset == closest_entry.value_end:
+      # The key had no value so start the children on the next line.
+      return (offset, offset, sep + sep.join(lines), None)
+
+    # We are going to add new children in front of the existing value.
+    return (offset, offset, sep.join(lines) + sep, None)
 
 
 def load_bindings(installed_config_dir, user_config_dir, only_if_local=False):
@@ -0,0 +1,116 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures Annotator.determine_new_tag on a synthetic repository.
+
+This is not part of run_tests.sh. Run it directly with
+  PYTHONPATH=../pylib:../dev python annotate_source_benchmark.py [commits]
+
+It builds a repository with 20000 commits (by default) after a
+version-1.0.0 tag using 'git fast-import', then times determining the next
+tag with the streaming history reader. For comparison it also times the
+previous approach of one 'git log -n 1' per commit over a sample of the
+commits and extrapolates that to the whole history.
+"""
+
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from annotate_source import Annotator
+
+
+SAMPLE_SIZE = 500
+
+
+def make_repository(path, num_commits, breaking_change_at):
+  """Create a repository with num_commits after a version-1.0.0 tag.
+
+  Args:
+    path [string]: Where to create the repository.
+    num_commits [int]: The number of commits following the tag.
+    breaking_change_at [int]: If not None, the commit number (counting
+       back from HEAD) whose message has a BREAKING CHANGE.
+  """
+  subprocess.check_call(['git', 'init', '-q', path])
+  stream = []
+  for index in range(num_commits + 1):
+    if index == 0:
+      msg = 'Initial commit.\n'
+    elif num_commits - index == breaking_change_at:
+      msg = 'feat(x): Change {0}.\n\nBREAKING CHANGE: Renamed.\n'.format(index)
+    elif index % 10 == 0:
+      msg = 'feat(x): Change {0}.\n\nMore details here.\n'.format(index)
+    else:
+      msg = 'fix(x): Change {0}.\n\nMore details here.\n'.format(index)
+    stream.append('commit refs/heads/master\n')
+    stream.append('mark :{0}\n'.format(index + 1))
+    stream.append('committer Test <test@test.com> {0} +0000\n'.format(
+        1400000000 + index))
+    stream.append('data {0}\n{1}\n'.format(len(msg), msg))
+    if index == 0:
+      stream.append('reset refs/tags/version-1.0.0\nfrom :1\n\n')
+
+  process = subprocess.Popen(['git', '-C', path, 'fast-import', '--quiet'],
+                             stdin=subprocess.PIPE)
+  process.communicate(''.join(stream))
+  if process.returncode != 0:
+    raise RuntimeError('git fast-import failed')
+  subprocess.check_call(['git', '-C', path, 'checkout', '-q', 'master'])
+
+
+def time_old_approach(path):
+  """Returns the extrapolated seconds of one 'git log' per commit."""
+  hashes = subprocess.check_output(
+      ['git', '-C', path, 'log', '--pretty=oneline']).strip().split('\n')
+  start = time.time()
+  for line in hashes[:SAMPLE_SIZE]:
+    subprocess.check_output(['git', '-C', path, 'log', '-n', '1',
+                             '--pretty=medium', line.split(' ')[0]])
+  return (time.time() - start) * len(hashes) / min(len(hashes), SAMPLE_SIZE)
+
+
+def time_new_approach(path):
+  """Returns the seconds and VersionBump from determine_new_tag."""
+  parser = argparse.ArgumentParser()
+  Annotator.init_argument_parser(parser)
+  annotator = Annotator(parser.parse_args([]), path=path)
+  annotator.parse_git_tree()
+  start = time.time()
+  bump = annotator.determine_new_tag()
+  return time.time() - start, bump
+
+
+def main():
+  num_commits = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  for title, breaking_change_at in [('no breaking change', None),
+                                    ('breaking change near HEAD', 100)]:
+    path = tempfile.mkdtemp()
+    try:
+      make_repository(path, num_commits, breaking_change_at)
+      new_secs, bump = time_new_approach(path)
+      old_secs = time_old_approach(path)
+      print ('{title:<26} streaming {new:>7.2f}s  per-commit (est) {old:>8.1f}s'
+             '  -> {version}'.format(title=title, new=new_secs, old=old_secs,
+                                     version=bump.version_str))
+    finally:
+      shutil.rmtree(path)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
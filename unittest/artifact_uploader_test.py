@@ -0,0 +1,196 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+from artifact_uploader import ArtifactUploader
+from artifact_uploader import ChecksumError
+from artifact_uploader import UploadError
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Records uploads, counting the connections and bytes received."""
+  daemon_threads = True
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0), StandInHandler)
+    self.lock = threading.Lock()
+    self.connections = 0
+    self.bytes_received = 0
+    self.uploads = {}
+    self.fail_next = []   # Status codes to respond with before succeeding.
+    self.echo_sha1 = None
+
+  @property
+  def base_url(self):
+    return 'http://localhost:{port}'.format(port=self.server_address[1])
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+    with self.server.lock:
+      self.server.connections += 1
+
+  def log_message(self, format, *args):
+    pass
+
+  def respond(self, code, body, headers=None):
+    self.send_response(code)
+    self.send_header('Content-Length', str(len(body)))
+    for key, value in (headers or {}).items():
+      self.send_header(key, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_PUT(self):
+    length = int(self.headers['Content-Length'])
+    remaining = length
+    digest = hashlib.sha1()
+    while remaining:
+      chunk = self.rfile.read(min(remaining, 65536))
+      digest.update(chunk)
+      remaining -= len(chunk)
+    with self.server.lock:
+      self.server.bytes_received += length
+      fail = self.server.fail_next.pop(0) if self.server.fail_next else None
+      echo = self.server.echo_sha1 or digest.hexdigest()
+    if fail:
+      self.respond(fail, 'failed')
+      return
+    if digest.hexdigest() != self.headers['X-Checksum-Sha1']:
+      self.respond(400, 'checksum mismatch')
+      return
+    with self.server.lock:
+      self.server.uploads[self.path] = (length, digest.hexdigest(),
+                                        self.headers.get('Authorization'))
+    self.respond(201, 'created', {'X-Checksum-Sha1': echo})
+
+
+class ArtifactUploaderTest(unittest.TestCase):
+  def setUp(self):
+    self.server = StandInServer()
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.temp_dir = tempfile.mkdtemp()
+    self.sleeps = []
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.temp_dir)
+
+  def make_file(self, name, size):
+    path = os.path.join(self.temp_dir, name)
+    with open(path, 'wb') as f:
+      f.write(os.urandom(size))
+    return path
+
+  def make_uploader(self, **kwargs):
+    return ArtifactUploader(initial_backoff_secs=0.5,
+                            sleep=self.sleeps.append, **kwargs)
+
+  def test_concurrent_uploads(self):
+    sizes = [300 * 1024 + index for index in range(12)]
+    paths = [self.make_file('pkg{0}.deb'.format(index), size)
+             for index, size in enumerate(sizes)]
+    uploader = self.make_uploader(max_connections=3)
+    threads = [threading.Thread(
+        target=uploader.upload,
+        args=(self.server.base_url + '/content/' + os.path.basename(path),
+              path),
+        kwargs={'headers': {'Authorization': 'Basic xyz'}})
+               for path in paths]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    uploader.close()
+
+    self.assertEqual(sum(sizes), self.server.bytes_received)
+    self.assertEqual(sum(sizes), uploader.stats['bytes'])
+    self.assertEqual(12, len(self.server.uploads))
+    # Connections are kept alive and shared rather than one per file.
+    self.assertLessEqual(self.server.connections, 3)
+    self.assertEqual(self.server.connections, uploader.stats['connections'])
+    for path in paths:
+      length, sha1, auth = self.server.uploads[
+          '/content/' + os.path.basename(path)]
+      self.assertEqual(os.path.getsize(path), length)
+      with open(path, 'rb') as f:
+        self.assertEqual(hashlib.sha1(f.read()).hexdigest(), sha1)
+      self.assertEqual('Basic xyz', auth)
+
+  def test_retry(self):
+    path = self.make_file('pkg.deb', 1000)
+    self.server.fail_next = [503, 500]
+    uploader = self.make_uploader()
+    self.assertEqual('created',
+                     uploader.upload(self.server.base_url + '/pkg.deb', path))
+    self.assertEqual(2, uploader.stats['retries'])
+    self.assertEqual(2, len(self.sleeps))
+    self.assertLess(self.sleeps[0], self.sleeps[1])
+
+    self.server.fail_next = [503] * 4
+    with self.assertRaises(UploadError) as context:
+      uploader.upload(self.server.base_url + '/pkg.deb', path)
+    self.assertEqual(503, context.exception.code)
+
+  def test_no_retry_on_client_error(self):
+    path = self.make_file('pkg.deb', 1000)
+    self.server.fail_next = [409]
+    uploader = self.make_uploader()
+    with self.assertRaises(UploadError) as context:
+      uploader.upload(self.server.base_url + '/pkg.deb', path)
+    self.assertEqual(409, context.exception.code)
+    self.assertEqual([], self.sleeps)
+
+  def test_checksum_mismatch(self):
+    path = self.make_file('pkg.deb', 1000)
+    self.server.echo_sha1 = '0' * 40
+    uploader = self.make_uploader(max_attempts=2)
+    with self.assertRaises(ChecksumError):
+      uploader.upload(self.server.base_url + '/pkg.deb', path)
+    self.assertEqual(1, len(self.sleeps))
+
+  def test_connection_refused(self):
+    path = self.make_file('pkg.deb', 1000)
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    url = 'http://localhost:{port}/pkg.deb'.format(port=sock.getsockname()[1])
+    sock.close()
+    uploader = self.make_uploader(max_attempts=2)
+    with self.assertRaises(UploadError) as context:
+      uploader.upload(url, path)
+    self.assertIsNone(context.exception.code)
+    self.assertEqual(url, context.exception.url)
+    self.assertEqual(1, len(self.sleeps))
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(ArtifactUploaderTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -0,0 +1,145 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from build_manifest import BuildManifest
+from build_manifest import fingerprint_source
+from build_manifest import make_build_key
+
+
+class BuildManifestTest(unittest.TestCase):
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.base_dir, 'orca')
+    os.mkdir(self.path)
+    self.git('init', '-q')
+    self.write('build.gradle', 'apply plugin: "java"\n')
+    self.git('add', 'build.gradle')
+    self.git('commit', '-q', '-m', 'first')
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
+  def git(self, *args):
+    return subprocess.check_output(
+        ['git', '-C', self.path, '-c', 'user.name=test',
+         '-c', 'user.email=test@test.com'] + list(args))
+
+  def write(self, name, content):
+    with open(os.path.join(self.path, name), 'w') as f:
+      f.write(content)
+
+  def test_fingerprint_source(self):
+    original = fingerprint_source(self.path)
+    self.assertEqual(original, fingerprint_source(self.path))
+
+    self.git('tag', 'version-1.0.0')
+    tagged = fingerprint_source(self.path)
+    self.assertNotEqual(original, tagged)
+
+    self.write('build.gradle', 'changed\n')
+    modified = fingerprint_source(self.path)
+    self.assertNotEqual(tagged, modified)
+    self.git('checkout', '--', 'build.gradle')
+    self.assertEqual(tagged, fingerprint_source(self.path))
+
+    self.write('new.gradle', 'new\n')
+    self.assertNotEqual(tagged, fingerprint_source(self.path))
+
+    with self.assertRaises(IOError):
+      fingerprint_source(self.base_dir)
+
+  def test_make_build_key(self):
+    key = make_build_key('abc', {'platform': 'debian', 'nebula': True})
+    self.assertEqual(key, make_build_key('abc', {'nebula': True,
+                                                 'platform': 'debian'}))
+    self.assertNotEqual(key, make_build_key('abc', {'platform': 'redhat',
+                                                    'nebula': True}))
+    self.assertNotEqual(key, make_build_key('abd', {'platform': 'debian',
+                                                    'nebula': True}))
+
+  def test_lookup(self):
+    manifest_path = os.path.join(self.base_dir, 'manifest.json')
+    artifact = os.path.join(self.base_dir, 'orca_1.0.0_all.deb')
+    with open(artifact, 'w') as f:
+      f.write('package')
+
+    manifest = BuildManifest(manifest_path)
+    self.assertIsNone(manifest.lookup('orca', 'key'))
+    manifest.record('orca', 'key', '1.0.0', [artifact])
+
+    # The manifest persists.
+    manifest = BuildManifest(manifest_path)
+    entry = manifest.lookup('orca', 'key')
+    self.assertEqual('1.0.0', entry['version'])
+    self.assertEqual([artifact], [a['path'] for a in entry['artifacts']])
+    self.assertIsNone(manifest.lookup('orca', 'other'))
+
+    # Missing or changed artifacts need a rebuild.
+    with open(artifact, 'a') as f:
+      f.write('changed')
+    self.assertIsNone(manifest.lookup('orca', 'key'))
+    os.remove(artifact)
+    self.assertIsNone(manifest.lookup('orca', 'key'))
+
+    manifest.forget('orca')
+    self.assertIsNone(BuildManifest(manifest_path).lookup('orca', 'key'))
+
+  def test_no_path(self):
+    artifact = os.path.join(self.base_dir, 'orca_1.0.0_all.deb')
+    with open(artifact, 'w') as f:
+      f.write('package')
+    manifest = BuildManifest(None)
+    manifest.record('orca', 'key', '1.0.0', [artifact])
+    manifest.forget('orca')
+    self.assertEqual(['orca', 'orca_1.0.0_all.deb'],
+                     sorted(os.listdir(self.base_dir)))
+
+  def test_init_argument_parser(self):
+    parser = argparse.ArgumentParser()
+    BuildManifest.init_argument_parser(parser)
+    options = parser.parse_args([])
+    self.assertEqual('', options.build_manifest_path)
+    self.assertFalse(options.force_rebuild_packages)
+
+    # It does not clash with the Annotator's --force_rebuild.
+    parser.add_argument('--force_rebuild', default=False, action='store_true')
+    options = parser.parse_args(['--build_manifest_path', 'manifest.json',
+                                 '--force_rebuild_packages'])
+    self.assertEqual('manifest.json', options.build_manifest_path)
+    self.assertTrue(options.force_rebuild_packages)
+    self.assertFalse(options.force_rebuild)
+
+  def test_report(self):
+    manifest = BuildManifest(os.path.join(self.base_dir, 'manifest.json'))
+    manifest.note_reused('orca')
+    manifest.note_rebuilt('gate')
+    manifest.note_reused('echo')
+    self.assertEqual('Reused 2 unchanged component builds: echo, orca\n'
+                     'Rebuilt 1 components: gate',
+                     manifest.report())
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(BuildManifestTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
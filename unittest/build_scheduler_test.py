@@ -0,0 +1,145 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from build_scheduler import DurationHistory
+from build_scheduler import BuildJob
+from build_scheduler import WeightedScheduler
+from build_scheduler import critical_path
+from build_scheduler import format_schedule_report
+
+
+class DurationHistoryTest(unittest.TestCase):
+  def test_history(self):
+    temp_dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(temp_dir, 'durations.json')
+      history = DurationHistory(path, max_samples=2)
+      self.assertEqual(0, history.estimate('echo'))
+      for secs in [100, 10, 20]:
+        history.record('echo', secs)
+      history.record('clouddriver', 300)
+      history.save()
+
+      history = DurationHistory(path)
+      self.assertEqual(15, history.estimate('echo'))
+      # Unknown jobs are assumed to be as long as the longest known one.
+      self.assertEqual(300, history.estimate('gate'))
+    finally:
+      shutil.rmtree(temp_dir)
+
+
+class WeightedSchedulerTest(unittest.TestCase):
+  def make_jobs(self, durations, started, resources=None, dependencies=None):
+    lock = threading.Lock()
+    def make_func(name):
+      def func():
+        with lock:
+          started.append(name)
+        time.sleep(durations[name])
+        if name == 'bad':
+          raise ValueError('bad job')
+      return func
+    return [BuildJob(name, make_func(name),
+                     resources=(resources or {}).get(name, {'cpu': 1}),
+                     dependencies=(dependencies or {}).get(name))
+            for name in sorted(durations.keys())]
+
+  def test_longest_first(self):
+    durations = {'echo': 0.01, 'gate': 0.02, 'clouddriver': 0.2,
+                 'orca': 0.1}
+    started = []
+    scheduler = WeightedScheduler({'cpu': 2}, estimate=durations.get)
+    outcomes = scheduler.run(self.make_jobs(durations, started))
+    self.assertEqual(['clouddriver', 'orca'], sorted(started[:2]))
+    self.assertEqual(['gate', 'echo'], started[2:])
+    self.assertTrue(all([outcome.error is None
+                         for outcome in outcomes.values()]))
+
+    # Makespan is about the clouddriver build, not the sum of two columns.
+    path = critical_path(outcomes)
+    self.assertEqual(['clouddriver'], [outcome.name for outcome in path])
+    report = format_schedule_report('Builds', outcomes)
+    self.assertIn('Critical path', report)
+    self.assertIn('clouddriver', report)
+
+  def test_resource_limits(self):
+    durations = dict([(name, 0.05) for name in ['a', 'b', 'c', 'd']])
+    resources = dict([(name, {'cpu': 1, 'gcb': 1}) for name in durations])
+    active = []
+    max_active = [0]
+    lock = threading.Lock()
+    jobs = []
+    for name in sorted(durations):
+      def func():
+        with lock:
+          active.append(1)
+          max_active[0] = max(max_active[0], len(active))
+        time.sleep(0.05)
+        with lock:
+          active.pop()
+      jobs.append(BuildJob(name, func, resources=resources[name]))
+    outcomes = WeightedScheduler({'cpu': 4, 'gcb': 2}).run(jobs)
+    self.assertEqual(2, max_active[0])
+    self.assertEqual(2, len(critical_path(outcomes)))
+
+    with self.assertRaises(ValueError):
+      WeightedScheduler({'cpu': 1}).run(
+          [BuildJob('big', lambda: None, resources={'cpu': 2})])
+
+  def test_dependencies(self):
+    durations = {'base': 0.05, 'app': 0.01, 'other': 0.01, 'bad': 0.01,
+                 'after_bad': 0.01}
+    dependencies = {'app': ['base'], 'after_bad': ['bad']}
+    started = []
+    outcomes = WeightedScheduler({'cpu': 4}).run(
+        self.make_jobs(durations, started, dependencies=dependencies))
+    self.assertLess(started.index('base'), started.index('app'))
+    self.assertGreaterEqual(outcomes['app'].start, outcomes['base'].end)
+    self.assertEqual(['base', 'app'],
+                     [outcome.name for outcome in critical_path(outcomes)])
+    self.assertIsInstance(outcomes['bad'].error, ValueError)
+    self.assertNotIn('after_bad', started)
+    self.assertIsInstance(outcomes['after_bad'].error, RuntimeError)
+
+    with self.assertRaises(ValueError):
+      WeightedScheduler({}).run([BuildJob('a', None, dependencies=['b']),
+                                 BuildJob('b', None, dependencies=['a'])])
+
+  def test_system_exit(self):
+    def exit_job():
+      raise SystemExit('exiting')
+
+    outcomes = WeightedScheduler({'cpu': 1}).run(
+        [BuildJob('exit', exit_job), BuildJob('next', lambda: None)])
+    self.assertIsInstance(outcomes['exit'].error, SystemExit)
+    self.assertIsNotNone(outcomes['exit'].end)
+    self.assertIsNone(outcomes['next'].error)
+    self.assertIsNotNone(outcomes['next'].end)
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = unittest.TestSuite([
+      loader.loadTestsFromTestCase(DurationHistoryTest),
+      loader.loadTestsFromTestCase(WeightedSchedulerTest)])
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -0,0 +1,120 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from spinnaker import command_telemetry
+from spinnaker.run import run_and_monitor
+from spinnaker.run import run_quick
+
+
+class CommandTelemetryTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_dir, 'telemetry.jsonl')
+    self.saved_environ = dict(os.environ)
+    command_telemetry.enable(self.path, run_id='run1')
+
+  def tearDown(self):
+    os.environ.clear()
+    os.environ.update(self.saved_environ)
+    shutil.rmtree(self.temp_dir)
+
+  def test_disabled(self):
+    del os.environ[command_telemetry.TELEMETRY_PATH_VAR]
+    self.assertEqual('hi\n', run_quick('echo hi', echo=False).stdout)
+    self.assertFalse(os.path.exists(self.path))
+
+  def test_records(self):
+    with command_telemetry.context(component='orca'):
+      result = run_quick('echo hello; exit 2', echo=False)
+      with command_telemetry.context(step='burn'):
+        run_and_monitor(
+            '{python} -c "sum(range(3000000))"; head -c 1000 /dev/zero'
+            .format(python=sys.executable),
+            echo=False)
+    run_and_monitor('echo out; echo err >&2', echo=False)
+    self.assertEqual(2, result.returncode)
+    self.assertEqual('hello\n', result.stdout)
+
+    quick, monitored, other = command_telemetry.load_records(self.path)
+    self.assertEqual('run_quick', quick['kind'])
+    self.assertEqual('orca', quick['component'])
+    self.assertEqual('echo hello; exit #', quick['step'])
+    self.assertEqual(2, quick['returncode'])
+    self.assertEqual(6, quick['output_bytes'])
+    self.assertEqual('run1', quick['run'])
+
+    self.assertEqual('burn', monitored['step'])
+    self.assertEqual(1000, monitored['output_bytes'])
+    self.assertGreater(monitored['user_cpu_secs'], 0)
+    self.assertGreaterEqual(monitored['wall_secs'],
+                            monitored['user_cpu_secs'] * 0.5)
+    self.assertGreater(monitored['max_rss_kb'], 0)
+
+    self.assertEqual('', other['component'])
+    self.assertEqual(8, other['output_bytes'])
+
+  def test_wait_for_process_reaped(self):
+    process = subprocess.Popen(['true'])
+    process.wait()
+    self.assertIsNone(command_telemetry.wait_for_process(process))
+    self.assertEqual(0, process.returncode)
+
+  def test_wait_for_process_returncode(self):
+    process = subprocess.Popen(['sh', '-c', 'exit 3'])
+    self.assertIsNotNone(command_telemetry.wait_for_process(process))
+    self.assertEqual(3, process.returncode)
+    self.assertEqual(3, process.wait())
+
+    process = subprocess.Popen(['sleep', '60'])
+    process.kill()
+    command_telemetry.wait_for_process(process)
+    self.assertEqual(-9, process.returncode)
+
+  def test_summarize(self):
+    def entry(run, component, step, secs, returncode=0):
+      return {'run': run, 'component': component, 'step': step,
+              'wall_secs': secs, 'user_cpu_secs': secs / 2,
+              'system_cpu_secs': 0, 'returncode': returncode,
+              'start_time': {'old': 1, 'new': 2}[run]}
+    records = [entry('old', 'orca', './gradlew candidate', 100),
+               entry('old', 'orca', 'git fetch', 10),
+               entry('new', 'orca', './gradlew candidate', 150),
+               entry('new', 'orca', 'git fetch', 5),
+               entry('new', 'orca', 'docker build', 20, returncode=1),
+               entry('new', 'echo', './gradlew candidate', 30)]
+    runs = command_telemetry.group_runs(records)
+    self.assertEqual(['old', 'new'], runs.keys())
+    summary = command_telemetry.summarize(runs['new'], runs['old'], top=2)
+    self.assertEqual(
+        'echo: 30.0s in 1 commands\n'
+        '      30.0s wall     15.0s cpu  ./gradlew candidate (new)\n'
+        'orca: 175.0s in 3 commands\n'
+        '     150.0s wall     75.0s cpu  ./gradlew candidate'
+        ' (+50.0s, +50% vs previous)\n'
+        '      20.0s wall     10.0s cpu FAILED  docker build (new)',
+        summary)
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(CommandTelemetryTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -0,0 +1,140 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+import time
+import unittest
+
+from spinnaker.concurrent_run import CommandTask
+from spinnaker.concurrent_run import ConcurrentCommandRunner
+from spinnaker.concurrent_run import run_concurrently
+
+
+class ConcurrentRunTest(unittest.TestCase):
+  def test_run_concurrently(self):
+    commands = ['echo {0}; echo err{0} >&2; exit {1}'.format(i, i % 3)
+                for i in range(200)]
+    results = run_concurrently(commands, max_concurrency=20, echo=False)
+    self.assertEqual(200, len(results))
+    for i, result in enumerate(results):
+      self.assertEqual(i % 3, result.returncode)
+      self.assertEqual('{0}\n'.format(i), result.stdout)
+      self.assertEqual('err{0}\n'.format(i), result.stderr)
+
+  def test_commands_overlap(self):
+    start = time.time()
+    results = run_concurrently(['sleep 0.5'] * 10, echo=False)
+    self.assertLess(time.time() - start, 2.5)
+    self.assertEqual([0] * 10, [result.returncode for result in results])
+
+  def test_max_concurrency(self):
+    runner = ConcurrentCommandRunner(max_concurrency=2)
+    try:
+      tasks = [runner.submit('sleep 0.2') for _ in range(4)]
+      start = time.time()
+      runner.wait(tasks)
+      self.assertGreaterEqual(time.time() - start, 0.4)
+    finally:
+      runner.close()
+
+  def test_timeout(self):
+    runner = ConcurrentCommandRunner()
+    try:
+      slow = runner.submit('echo started; sleep 30', timeout=0.5)
+      fast = runner.submit('echo done')
+      start = time.time()
+      runner.wait()
+      self.assertLess(time.time() - start, 10)
+      self.assertEqual(CommandTask.TIMED_OUT, slow.state)
+      self.assertNotEqual(0, slow.result.returncode)
+      self.assertEqual(CommandTask.FINISHED, fast.state)
+      self.assertEqual('done\n', fast.result.stdout)
+    finally:
+      runner.close()
+
+  def test_cancel(self):
+    runner = ConcurrentCommandRunner(max_concurrency=1)
+    try:
+      running = runner.submit('sleep 30')
+      pending = runner.submit('echo never')
+      runner.cancel(pending)
+      self.assertEqual(CommandTask.CANCELLED, pending.state)
+      self.assertIsNone(pending.result)
+
+      timer = threading.Timer(0.2, runner.cancel, [running])
+      timer.start()
+      start = time.time()
+      runner.wait([running])
+      self.assertLess(time.time() - start, 10)
+      self.assertEqual(CommandTask.CANCELLED, running.state)
+    finally:
+      runner.close()
+
+  def test_observers(self):
+    lines = []
+    runner = ConcurrentCommandRunner()
+    try:
+      task = runner.submit('printf "a\\nb\\nc"', observe_stdout=lines.extend)
+      runner.wait([task])
+      self.assertEqual(['a\n', 'b\n', 'c'], lines)
+      self.assertEqual('a\nb\nc', task.result.stdout)
+    finally:
+      runner.close()
+
+  def test_input(self):
+    runner = ConcurrentCommandRunner()
+    try:
+      task = runner.submit('cat', input='Hello')
+      runner.wait([task])
+      self.assertEqual('Hello', task.result.stdout)
+    finally:
+      runner.close()
+
+  def test_large_input(self):
+    runner = ConcurrentCommandRunner()
+    try:
+      text = 'x' * (4 * 1024 * 1024)
+      task = runner.submit('cat', input=text, timeout=30)
+      runner.wait([task])
+      self.assertEqual(CommandTask.FINISHED, task.state)
+      self.assertEqual(len(text), len(task.result.stdout))
+    finally:
+      runner.close()
+
+  def test_closed_output_does_not_block(self):
+    runner = ConcurrentCommandRunner()
+    try:
+      # These close their output streams but keep running.
+      lingering = runner.submit('exec >&- 2>&-; sleep 1; exit 3')
+      stuck = runner.submit('exec >&- 2>&-; sleep 30', timeout=0.5)
+      fast = runner.submit('sleep 0.2; echo done')
+      start = time.time()
+      runner.wait([fast])
+      self.assertLess(time.time() - start, 0.9)
+      self.assertEqual('done\n', fast.result.stdout)
+
+      runner.wait([lingering, stuck])
+      self.assertLess(time.time() - start, 10)
+      self.assertEqual(3, lingering.result.returncode)
+      self.assertEqual(CommandTask.TIMED_OUT, stuck.state)
+    finally:
+      runner.close()
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(ConcurrentRunTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -0,0 +1,76 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from generate_bom import BomGenerator
+from tag_index import TagIndex
+
+
+class BomGeneratorTest(unittest.TestCase):
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    for index, comp in enumerate(BomGenerator.COMPONENTS + ['halyard']):
+      path = os.path.join(self.base_dir, comp)
+      os.mkdir(path)
+      self.git(path, 'init', '-q')
+      self.git(path, 'commit', '-q', '--allow-empty', '-m', 'first')
+      self.git(path, 'tag', 'version-1.{0}.0'.format(index))
+      self.git(path, 'tag', 'v9.9.9')
+      msg = 'feat(x): New.' if index % 2 else 'fix(x): Fixed.'
+      self.git(path, 'commit', '-q', '--allow-empty', '-m', msg)
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
+  def git(self, path, *args):
+    return subprocess.check_output(
+        ['git', '-C', path, '-c', 'user.name=test',
+         '-c', 'user.email=test@test.com'] + list(args))
+
+  def test_determine_and_tag_versions(self):
+    parser = argparse.ArgumentParser()
+    BomGenerator.init_argument_parser(parser)
+    options = parser.parse_args(['--base_dir', self.base_dir,
+                                 '--build_number', '42',
+                                 '--component_workers', '4'])
+    generator = BomGenerator(options)
+    generator.determine_and_tag_versions()
+
+    for index, comp in enumerate(BomGenerator.COMPONENTS + ['halyard']):
+      expect = ('version-1.{0}.0'.format(index + 1) if index % 2
+                else 'version-1.{0}.1'.format(index))
+      tags = TagIndex(os.path.join(self.base_dir, comp)).tags
+      self.assertIn(expect, tags)
+      self.assertIn(expect[len('version-'):] + '-42', tags)
+      self.assertNotIn('v9.9.9', tags)
+
+    # Halyard was already tagged so this does not tag it again.
+    halyard_bump = generator.halyard_version_bump
+    self.assertEqual(expect, halyard_bump.version_str)
+    generator.determine_and_tag_halyard()
+    self.assertIs(halyard_bump, generator.halyard_version_bump)
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(BomGeneratorTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
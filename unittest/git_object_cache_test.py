@@ -0,0 +1,153 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from git_object_cache import GitObjectCache
+
+
+class GitObjectCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.base_dir, 'cache')
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
+  def git(self, path, *args):
+    return subprocess.check_output(
+        ['git', '-C', path, '-c', 'user.name=test',
+         '-c', 'user.email=test@test.com'] + list(args))
+
+  def make_remote(self, name, num_commits=2):
+    path = os.path.join(self.base_dir, 'remote', name)
+    os.makedirs(path)
+    self.git(path, 'init', '-q')
+    self.add_commits(path, num_commits)
+    return 'file://' + path
+
+  def add_commits(self, path, num_commits):
+    for index in range(num_commits):
+      with open(os.path.join(path, 'file.txt'), 'a') as f:
+        f.write('{0}\n'.format(index))
+      self.git(path, 'add', 'file.txt')
+      self.git(path, 'commit', '-q', '-m', str(index))
+
+  def count_local_objects(self, path):
+    counts = {}
+    for line in self.git(path, 'count-objects', '-v').splitlines():
+      key, value = line.split(': ')
+      counts[key] = value
+    return int(counts['count']) + int(counts['in-pack'])
+
+  def test_clone_borrows_objects(self):
+    url = self.make_remote('orca')
+    cache = GitObjectCache(self.cache_dir)
+    first = os.path.join(self.base_dir, 'first')
+    cache.clone(url, first)
+    self.assertEqual(0, self.count_local_objects(first))
+    with open(os.path.join(first, '.git', 'objects', 'info',
+                           'alternates')) as f:
+      self.assertEqual(os.path.join(cache.mirror_path(url), 'objects'),
+                       f.read().strip())
+
+    # New commits are fetched into the mirror, not the clone.
+    self.add_commits(url[len('file://'):], 3)
+    second = os.path.join(self.base_dir, 'second')
+    cache.clone(url, second)
+    self.assertEqual(0, self.count_local_objects(second))
+    self.assertEqual(5, len(self.git(second, 'log', '--format=%H').split()))
+
+  def test_dissociate(self):
+    url = self.make_remote('orca')
+    cache = GitObjectCache(self.cache_dir, dissociate=True)
+    dest = os.path.join(self.base_dir, 'clone')
+    cache.clone(url, dest)
+    shutil.rmtree(cache.mirror_path(url))
+    self.assertEqual(2, len(self.git(dest, 'log', '--format=%H').split()))
+
+  def test_limits_imply_dissociate(self):
+    self.assertFalse(GitObjectCache(self.cache_dir).dissociate)
+    self.assertTrue(GitObjectCache(self.cache_dir, max_entries=1).dissociate)
+    self.assertTrue(GitObjectCache(self.cache_dir, max_bytes=1).dissociate)
+
+    url = self.make_remote('orca')
+    cache = GitObjectCache(self.cache_dir, max_entries=1)
+    dest = os.path.join(self.base_dir, 'clone')
+    cache.clone(url, dest)
+    self.assertFalse(os.path.exists(
+        os.path.join(dest, '.git', 'objects', 'info', 'alternates')))
+
+  def test_borrowed_objects_not_pruned(self):
+    url = self.make_remote('orca')
+    remote = url[len('file://'):]
+    cache = GitObjectCache(self.cache_dir)
+    cache.refresh(url)
+    self.git(remote, 'checkout', '-q', '-b', 'feature')
+    self.add_commits(remote, 1)
+    dest = os.path.join(self.base_dir, 'clone')
+    cache.clone(url, dest, options='-b feature')
+
+    # The clone still needs the feature branch after upstream deletes it.
+    self.git(remote, 'checkout', '-q', 'master')
+    self.git(remote, 'branch', '-q', '-D', 'feature')
+    cache.refresh(url)
+    self.git(cache.mirror_path(url), 'prune')
+    self.assertEqual(3, len(self.git(dest, 'log', '--format=%H').split()))
+
+  def test_gc(self):
+    urls = [self.make_remote(name) for name in ['a', 'b', 'c']]
+    seed = GitObjectCache(self.cache_dir)
+    for url in urls:
+      seed.refresh(url)
+    for url in urls:
+      os.utime(os.path.join(seed.mirror_path(url), 'last-used'),
+               (urls.index(url), urls.index(url)))
+
+    # Nothing to do without limits.
+    self.assertEqual([], GitObjectCache(self.cache_dir).gc())
+
+    # The least recently used go first, but not ones in use by this cache.
+    cache = GitObjectCache(self.cache_dir, max_entries=1)
+    cache.refresh(urls[1])
+    self.assertEqual([cache.mirror_path(urls[0]), cache.mirror_path(urls[2])],
+                     cache.gc())
+    cache = GitObjectCache(self.cache_dir, max_entries=2)
+    cache.refresh(urls[0])
+    cache.refresh(urls[2])
+    self.assertEqual([cache.mirror_path(urls[1])], cache.gc())
+    self.assertEqual(
+        [cache.mirror_path(urls[0]), cache.mirror_path(urls[2])],
+        sorted([os.path.join(self.cache_dir, name)
+                for name in os.listdir(self.cache_dir)
+                if name.endswith('.git')]))
+
+    size = sum([os.path.getsize(os.path.join(root, name))
+                for root, _, files in os.walk(cache.mirror_path(urls[2]))
+                for name in files])
+    cache = GitObjectCache(self.cache_dir, max_bytes=size)
+    self.assertEqual([cache.mirror_path(urls[0])], cache.gc())
+    self.assertFalse(os.path.exists(cache.mirror_path(urls[0])))
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(GitObjectCacheTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -0,0 +1,122 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from spinnaker.process_discovery import ProcessTable
+from spinnaker.process_discovery import find_java_subsystem_jobs
+from spinnaker.process_discovery import java_subsystem_name
+from spinnaker.process_discovery import write_pid_file
+
+
+class ProcessDiscoveryTest(unittest.TestCase):
+  def setUp(self):
+    self.proc = tempfile.mkdtemp()
+    self.run_dir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(self.proc, 'self'))
+    os.mkdir(os.path.join(self.proc, 'sys'))
+
+  def tearDown(self):
+    shutil.rmtree(self.proc)
+    shutil.rmtree(self.run_dir)
+
+  def add_process(self, pid, argv, session=None):
+    path = os.path.join(self.proc, str(pid))
+    os.mkdir(path)
+    with open(os.path.join(path, 'cmdline'), 'wb') as f:
+      f.write('\0'.join(argv) + '\0' if argv else '')
+    with open(os.path.join(path, 'stat'), 'w') as f:
+      f.write('{pid} ({comm}) S 1 {session} {session} 0 -1\n'.format(
+          pid=pid, comm=os.path.basename(argv[0]) if argv else 'kthread',
+          session=session or pid))
+
+  def java_argv(self, classpath, main=None):
+    argv = ['/usr/bin/java', '-Xmx2g', '-classpath', classpath]
+    if main:
+      argv.append(main)
+    return argv
+
+  def test_subsystem_name(self):
+    self.assertEqual(
+        'clouddriver',
+        java_subsystem_name(
+            self.java_argv('/x.jar', 'com.netflix.spinnaker.clouddriver.Main'),
+            '/opt'))
+    self.assertEqual(
+        'front50',
+        java_subsystem_name(
+            self.java_argv('/opt/front50/lib/front50.jar:/opt/front50/lib/b'),
+            '/opt'))
+    self.assertIsNone(
+        java_subsystem_name(self.java_argv('/other/lib/x.jar'), '/opt'))
+    self.assertIsNone(
+        java_subsystem_name(['/bin/bash', 'com.netflix.spinnaker.gate.Main'],
+                            '/opt'))
+    self.assertIsNone(java_subsystem_name([], '/opt'))
+
+  def test_process_table(self):
+    self.add_process(10, ['/bin/bash', '-c', 'a b'], session=7)
+    self.add_process(11, [])  # Kernel threads have no command line.
+    table = ProcessTable(self.proc)
+    self.assertEqual([10], table.pids)
+    self.assertEqual(['/bin/bash', '-c', 'a b'], table.get_argv(10))
+    self.assertEqual(7, table.get_session(10))
+    self.assertIsNone(table.get_argv(11))
+
+  def test_find_jobs(self):
+    self.add_process(100, ['/sbin/init'])
+    self.add_process(
+        200, self.java_argv('/opt/orca/lib/orca.jar',
+                            'com.netflix.spinnaker.orca.Main'))
+    self.add_process(300, self.java_argv('/opt/rosco/lib/rosco.jar'))
+    self.add_process(400, self.java_argv('/usr/share/gradle/lib/gradle.jar',
+                                         'org.gradle.launcher.GradleMain'))
+    self.assertEqual({'orca': 200, 'rosco': 300},
+                     find_java_subsystem_jobs('/opt', proc_root=self.proc))
+
+  def test_find_jobs_from_pid_files(self):
+    # echo runs in a session started by run_daemon but its java command
+    # line is not recognizable on its own.
+    self.add_process(500, ['/bin/bash', '-c', 'echo'])
+    self.add_process(501, ['/usr/bin/java', '-jar', 'echo.jar'], session=500)
+    echo_pid_path = os.path.join(self.run_dir, 'echo.pid')
+    write_pid_file(echo_pid_path, 500)
+
+    # igor was started but is no longer running.
+    igor_pid_path = os.path.join(self.run_dir, 'igor.pid')
+    write_pid_file(igor_pid_path, 600)
+
+    pid_files = {'echo': echo_pid_path, 'igor': igor_pid_path,
+                 'gate': os.path.join(self.run_dir, 'gate.pid')}
+    self.assertEqual({'echo': 501},
+                     find_java_subsystem_jobs('/opt', pid_files=pid_files,
+                                              proc_root=self.proc))
+    self.assertTrue(os.path.exists(echo_pid_path))
+    self.assertFalse(os.path.exists(igor_pid_path))
+
+  def test_real_proc(self):
+    table = ProcessTable()
+    self.assertIn(os.getpid(), table.pids)
+    self.assertEqual(os.getsid(0), table.get_session(os.getpid()))
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(ProcessDiscoveryTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
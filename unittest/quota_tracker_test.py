@@ -0,0 +1,211 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import random
+import sys
+import threading
+import time
+import unittest
+
+from validate_bom__test import QuotaTracker
+
+
+def wait_until(predicate, timeout=10):
+  end_time = time.time() + timeout
+  while not predicate():
+    if time.time() > end_time:
+      return False
+    time.sleep(0.01)
+  return True
+
+
+class QuotaTrackerTest(unittest.TestCase):
+  def setUp(self):
+    # The tracker logs every request, which is too much for the stress test.
+    logging.disable(logging.WARNING)
+
+  def tearDown(self):
+    logging.disable(logging.NOTSET)
+
+  def start_waiter(self, tracker, who, quota, order, **kwargs):
+    result = {}
+    def acquire():
+      result['got'] = tracker.acquire_all_safe(who, quota, **kwargs)
+      order.append(who)
+    thread = threading.Thread(target=acquire)
+    thread.daemon = True
+    thread.start()
+    return thread, result
+
+  def test_all_or_nothing(self):
+    tracker = QuotaTracker({'google': 2, 'aws': 1})
+    self.assertEqual({}, tracker.acquire_all_or_none_safe('a', {}))
+    self.assertEqual({'google': 2, 'other': 5},
+                     tracker.acquire_all_or_none_safe(
+                         'a', {'google': 2, 'other': 5}))
+    self.assertIsNone(tracker.acquire_all_or_none_safe(
+        'b', {'google': 1, 'aws': 1}))
+    # The failed request did not keep the aws quota.
+    self.assertEqual({'aws': 1},
+                     tracker.acquire_all_or_none_safe('c', {'aws': 1}))
+
+  def test_oversize_takes_everything(self):
+    tracker = QuotaTracker({'google': 2})
+    self.assertEqual({'google': 2},
+                     tracker.acquire_all_or_none_safe('a', {'google': 5}))
+    self.assertIsNone(tracker.acquire_all_or_none_safe('b', {'google': 1}))
+
+  def test_large_request_not_starved(self):
+    tracker = QuotaTracker({'google': 2})
+    first = tracker.acquire_all_safe('first', {'google': 1})
+    order = []
+    big, big_result = self.start_waiter(tracker, 'big', {'google': 2}, order)
+    self.assertTrue(wait_until(lambda: tracker.num_waiting == 1))
+    small, _ = self.start_waiter(tracker, 'small', {'google': 1}, order)
+
+    # The small request fits, but the quota is reserved for the big one.
+    self.assertTrue(wait_until(lambda: tracker.num_waiting == 2))
+    self.assertEqual([], order)
+    tracker.release_all_safe('first', first)
+    big.join(5)
+    self.assertEqual(['big'], order)
+    tracker.release_all_safe('big', big_result['got'])
+    small.join(5)
+    self.assertEqual(['big', 'small'], order)
+
+  def test_priority(self):
+    tracker = QuotaTracker({'google': 1})
+    held = tracker.acquire_all_safe('held', {'google': 1})
+    order = []
+    results = {}
+    for who, priority in [('low', 0), ('high', 10), ('medium', 5)]:
+      _, results[who] = self.start_waiter(tracker, who, {'google': 1}, order,
+                                          priority=priority)
+      self.assertTrue(wait_until(
+          lambda: tracker.num_waiting == len(results)))
+
+    for who in ['high', 'medium', 'low']:
+      tracker.release_all_safe('held', held)
+      self.assertTrue(wait_until(lambda: len(order) == 1))
+      self.assertEqual(who, order.pop())
+      held = results[who]['got']
+
+  def test_timeout(self):
+    tracker = QuotaTracker({'google': 1, 'aws': 1})
+    held = tracker.acquire_all_safe('held', {'google': 1})
+    start = time.time()
+    self.assertIsNone(tracker.acquire_all_safe(
+        'late', {'google': 1, 'aws': 1}, timeout=0.2))
+    self.assertGreaterEqual(time.time() - start, 0.2)
+    metrics = tracker.wait_metrics()
+    self.assertEqual(1, metrics['google']['timed_out'])
+
+    # The abandoned request no longer reserves aws.
+    self.assertEqual({'aws': 1},
+                     tracker.acquire_all_or_none_safe('other', {'aws': 1}))
+    tracker.release_all_safe('held', held)
+
+  def test_shared_keys(self):
+    tracker = QuotaTracker({'slots': 2, 'google': 1}, shared_keys=['slots'])
+    tracker.acquire_all_safe('running', {'slots': 1})
+    held = tracker.acquire_all_safe('held', {'google': 1})
+    waiting = tracker.request_safe('waiting', {'slots': 1, 'google': 1})
+    self.assertIsNone(waiting.granted)
+
+    # The waiting request does not keep the last slot from others.
+    other = tracker.request_safe('other', {'slots': 1})
+    self.assertEqual({'slots': 1}, other.granted)
+    tracker.release_all_safe('held', held)
+    self.assertIsNone(waiting.granted)
+
+    # But once it is only waiting on a slot, that slot is reserved for it.
+    late = tracker.request_safe('late', {'slots': 1})
+    self.assertIsNone(late.granted)
+    tracker.release_all_safe('other', other.granted)
+    self.assertEqual({'slots': 1, 'google': 1},
+                     tracker.wait_safe(waiting, timeout=5))
+    self.assertIsNone(late.granted)
+    self.assertEqual(['google', 'slots'], sorted(waiting.waited.keys()))
+
+  def test_stress(self):
+    limits = {'google': 3, 'aws': 2, 'azure': 1}
+    tracker = QuotaTracker(limits)
+    lock = threading.Lock()
+    in_use = dict([(name, 0) for name in limits])
+    violations = []
+    completed = []
+    rand = random.Random(1234)
+    requests = []
+    for index in range(1000):
+      names = rand.sample(sorted(limits.keys()), rand.randint(1, 2))
+      requests.append((
+          'test{0}'.format(index),
+          dict([(name, rand.randint(1, limits[name] + 1)) for name in names]),
+          rand.randint(0, 3)))
+
+    start_event = threading.Event()
+    def requester(who, quota, priority):
+      start_event.wait()
+      got = tracker.acquire_all_safe(who, quota, priority=priority,
+                                     timeout=120)
+      if got is None:
+        with lock:
+          violations.append('{0} timed out'.format(who))
+        return
+      with lock:
+        for name, count in got.items():
+          in_use[name] += count
+          if in_use[name] > limits[name]:
+            violations.append('{0} overcommitted'.format(name))
+      time.sleep(0.0005)
+      with lock:
+        for name, count in got.items():
+          in_use[name] -= count
+      tracker.release_all_safe(who, got)
+      with lock:
+        completed.append(who)
+
+    saved_stack_size = threading.stack_size(256 * 1024)
+    try:
+      threads = [threading.Thread(target=requester, args=request)
+                 for request in requests]
+      for thread in threads:
+        thread.daemon = True
+        thread.start()
+    finally:
+      threading.stack_size(saved_stack_size)
+    start_event.set()
+    for thread in threads:
+      thread.join(120)
+
+    self.assertEqual([], violations)
+    self.assertEqual(1000, len(completed))
+    self.assertEqual(in_use, dict([(name, 0) for name in limits]))
+    self.assertEqual(limits, tracker.acquire_all_or_none_safe('all', limits))
+    metrics = tracker.wait_metrics()
+    for name in limits:
+      expect = len([quota for _, quota, _ in requests if name in quota])
+      self.assertEqual(expect + 1, metrics[name]['acquired'])
+      self.assertGreater(metrics[name]['waited'], 0)
+      self.assertGreaterEqual(metrics[name]['max_wait_secs'],
+                              metrics[name]['total_wait_secs']
+                              / metrics[name]['waited'])
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(QuotaTrackerTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
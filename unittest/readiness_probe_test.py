@@ -0,0 +1,264 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import BaseHTTPServer
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import threading
+import unittest
+
+from spinnaker.readiness_probe import HealthProbe
+from spinnaker.readiness_probe import LogTailer
+from spinnaker.readiness_probe import ReadinessMonitor
+from spinnaker.readiness_probe import http_get
+
+
+class FakeClock(object):
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, secs):
+    self.now += secs
+
+
+class HealthHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Answers /health with 503 a few times before answering 200."""
+  remaining_failures = 2
+
+  def do_GET(self):
+    if HealthHandler.remaining_failures > 0:
+      HealthHandler.remaining_failures -= 1
+      code, body = 503, '{"status": "DOWN"}'
+    else:
+      code, body = 200, '{"status": "UP"}'
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+class HealthProbeTest(unittest.TestCase):
+  def test_is_healthy(self):
+    self.assertTrue(HealthProbe.is_healthy(200, '{"status": "UP"}'))
+    self.assertFalse(HealthProbe.is_healthy(200, '{"status": "DOWN"}'))
+    self.assertTrue(HealthProbe.is_healthy(200, 'not json'))
+    self.assertFalse(HealthProbe.is_healthy(503, '{"status": "DOWN"}'))
+    self.assertFalse(HealthProbe.is_healthy(None, ''))
+    self.assertTrue(HealthProbe.is_healthy(401, ''))
+
+  def test_backoff(self):
+    clock = FakeClock()
+    probe = HealthProbe('test', 'http://test/health',
+                        initial_backoff_secs=0.1, max_backoff_secs=1.0,
+                        jitter=0, clock=clock,
+                        fetch=lambda url, timeout: (None, ''))
+    delays = []
+    for _ in range(6):
+      before = clock.now
+      self.assertFalse(probe.attempt())
+      delays.append(probe.next_attempt_time - before)
+      clock.now = probe.next_attempt_time
+    for expect, got in zip([0.1, 0.2, 0.4, 0.8, 1.0, 1.0], delays):
+      self.assertAlmostEqual(expect, got)
+
+  def test_jitter(self):
+    clock = FakeClock()
+    probe = HealthProbe('test', 'http://test/health',
+                        initial_backoff_secs=1.0, backoff_multiplier=1.0,
+                        jitter=0.5, clock=clock,
+                        fetch=lambda url, timeout: (None, ''))
+    for _ in range(20):
+      probe.attempt()
+      delay = probe.next_attempt_time - clock.now
+      self.assertTrue(0.5 <= delay <= 1.0)
+
+  def test_deadline(self):
+    clock = FakeClock()
+    probe = HealthProbe('test', 'http://test/health', deadline_secs=1.0,
+                        clock=clock, fetch=lambda url, timeout: (503, ''))
+    probe.attempt()
+    clock.now += 1.0
+    with self.assertRaises(SystemExit):
+      probe.attempt()
+
+  def test_connect_fallback(self):
+    clock = FakeClock()
+    connected = []
+
+    def connect(host, port, timeout):
+      connected.append((host, port))
+      return True
+
+    probe = HealthProbe('test', 'https://test/health', clock=clock,
+                        connect_fallback_secs=5.0,
+                        fetch=lambda url, timeout: (None, ''),
+                        connect=connect)
+    self.assertFalse(probe.attempt())
+    self.assertEqual([], connected)
+    clock.now += 5.0
+    self.assertTrue(probe.attempt())
+    self.assertEqual([('test', 443)], connected)
+    self.assertEqual('connect', probe.ready_by)
+
+  def test_connect_fallback_refused(self):
+    clock = FakeClock()
+    probe = HealthProbe('test', 'http://test:8084/health', clock=clock,
+                        connect_fallback_secs=0, deadline_secs=1.0,
+                        fetch=lambda url, timeout: (503, ''),
+                        connect=lambda host, port, timeout: False)
+    self.assertFalse(probe.attempt())
+    clock.now += 1.0
+    with self.assertRaises(SystemExit):
+      probe.attempt()
+
+  def test_dead_process(self):
+    probe = HealthProbe('test', 'http://test/health', pid=0x7ffffff0,
+                        fetch=lambda url, timeout: (None, ''))
+    with self.assertRaises(SystemExit):
+      probe.attempt()
+
+  def test_metrics(self):
+    clock = FakeClock()
+    responses = [(None, ''), (503, ''), (200, '{"status": "UP"}')]
+
+    def fetch(url, timeout):
+      clock.now += 0.25
+      return responses.pop(0)
+
+    probe = HealthProbe('test', 'http://test/health', clock=clock,
+                        fetch=fetch)
+    while not probe.attempt():
+      clock.now = probe.next_attempt_time
+
+    metrics = probe.metrics
+    self.assertTrue(metrics['ready'])
+    self.assertEqual('health', metrics['ready_by'])
+    self.assertEqual(3, metrics['attempts'])
+    self.assertEqual(200, metrics['last_status'])
+    self.assertAlmostEqual(0.75, metrics['total_probe_secs'])
+    self.assertAlmostEqual(0.25, metrics['max_probe_secs'])
+
+  def test_http_server(self):
+    HealthHandler.remaining_failures = 2
+    server = BaseHTTPServer.HTTPServer(('localhost', 0), HealthHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+      url = 'http://localhost:{port}/health'.format(
+          port=server.server_address[1])
+      self.assertEqual(503, http_get(url, 5)[0])
+      probe = HealthProbe('test', url, initial_backoff_secs=0.01)
+      monitor = ReadinessMonitor()
+      monitor.add(probe)
+      self.assertEqual([probe], monitor.wait_for_any())
+      self.assertEqual(2, probe.metrics['attempts'])
+    finally:
+      server.shutdown()
+      server.server_close()
+
+  def test_connection_refused(self):
+    server = BaseHTTPServer.HTTPServer(('localhost', 0), HealthHandler)
+    port = server.server_address[1]
+    server.server_close()
+    self.assertEqual(
+        (None, ''),
+        http_get('http://localhost:{port}/health'.format(port=port), 5))
+
+
+class ReadinessMonitorTest(unittest.TestCase):
+  def test_wait_for_any(self):
+    clock = FakeClock()
+    ready_at = {'fast': clock.now + 0.3, 'slow': clock.now + 2}
+
+    def make_probe(name):
+      def fetch(url, timeout):
+        return (200, '') if clock.now >= ready_at[name] else (None, '')
+      return HealthProbe(name, 'http://test/health', clock=clock, fetch=fetch)
+
+    fast = make_probe('fast')
+    slow = make_probe('slow')
+    monitor = ReadinessMonitor(sleep=clock.sleep, clock=clock)
+    monitor.add(fast)
+    monitor.add(slow)
+    self.assertEqual([fast], monitor.wait_for_any())
+    self.assertEqual([slow], monitor.wait_for_any())
+    self.assertEqual([], monitor.wait_for_any())
+    self.assertLess(slow.metrics['attempts'], 10)
+
+
+class LogTailerTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'test.log')
+    self.output = StringIO.StringIO()
+    self.tailer = LogTailer(self.path, output=self.output, initial_lines=2)
+
+  def tearDown(self):
+    self.tailer.close()
+    shutil.rmtree(self.dir)
+
+  def write(self, text, mode='a'):
+    with open(self.path, mode) as f:
+      f.write(text)
+
+  def test_missing_file(self):
+    self.tailer.poll()
+    self.assertEqual('', self.output.getvalue())
+    self.write('hello\n')
+    self.tailer.poll()
+    self.assertEqual('hello\n', self.output.getvalue())
+
+  def test_initial_lines_then_follow(self):
+    self.write('one\ntwo\nthree\n')
+    self.tailer.poll()
+    self.assertEqual('two\nthree\n', self.output.getvalue())
+    self.write('four\n')
+    self.tailer.poll()
+    self.assertEqual('two\nthree\nfour\n', self.output.getvalue())
+
+  def test_truncated(self):
+    self.write('one\ntwo\n')
+    self.tailer.poll()
+    self.write('x\n', mode='w')
+    self.tailer.poll()
+    self.assertEqual('one\ntwo\nx\n', self.output.getvalue())
+
+  def test_replaced(self):
+    self.write('one\n')
+    self.tailer.poll()
+    self.write('two\n')
+    os.rename(self.path, self.path + '.old')
+    self.write('new\n')
+    self.tailer.poll()
+    self.assertEqual('one\ntwo\nnew\n', self.output.getvalue())
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = unittest.TestSuite()
+  suite.addTests(loader.loadTestsFromTestCase(HealthProbeTest))
+  suite.addTests(loader.loadTestsFromTestCase(ReadinessMonitorTest))
+  suite.addTests(loader.loadTestsFromTestCase(LogTailerTest))
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
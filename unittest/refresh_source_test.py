@@ -0,0 +1,186 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from refresh_source import Refresher
+from refresh_source import RefreshState
+from refresh_source import SourceRepository
+
+
+class LocalRefresher(Refresher):
+  """A Refresher whose "github" repositories are local directories."""
+
+  def __init__(self, options, remote_dir):
+    super(LocalRefresher, self).__init__(options)
+    self.remote_dir = remote_dir
+
+  def get_github_repository_url(self, repository, owner=None):
+    return 'file://' + os.path.join(self.remote_dir, repository.name)
+
+
+class RefresherTest(unittest.TestCase):
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.remote_dir = os.path.join(self.base_dir, 'remote')
+    self.work_dir = os.path.join(self.base_dir, 'work')
+    os.mkdir(self.remote_dir)
+    os.mkdir(self.work_dir)
+    self.prev_dir = os.getcwd()
+    os.chdir(self.work_dir)
+
+  def tearDown(self):
+    os.chdir(self.prev_dir)
+    shutil.rmtree(self.base_dir)
+
+  def git(self, path, *args):
+    return subprocess.check_output(
+        ['git', '-C', path, '-c', 'user.name=test',
+         '-c', 'user.email=test@test.com'] + list(args))
+
+  def make_remote(self, name, num_commits):
+    path = os.path.join(self.remote_dir, name)
+    os.mkdir(path)
+    self.git(path, 'init', '-q')
+    for index in range(num_commits):
+      self.git(path, 'commit', '-q', '--allow-empty', '-m', str(index))
+    return path
+
+  def make_refresher(self, *args):
+    parser = argparse.ArgumentParser()
+    Refresher.init_argument_parser(parser)
+    options = parser.parse_args(['--github_user=test', '--pull_origin',
+                                 '--noadd_upstream',
+                                 '--nodisable_upstream_push'] + list(args))
+    return LocalRefresher(options, self.remote_dir)
+
+  def test_concurrent(self):
+    refresher = self.make_refresher('--refresh_workers=4')
+    lock = threading.Lock()
+    active = [0]
+    max_active = [0]
+    def func(repository):
+      with lock:
+        active[0] += 1
+        max_active[0] = max(max_active[0], active[0])
+      time.sleep(0.05)
+      with lock:
+        active[0] -= 1
+      return repository.name
+
+    refresher.for_all_repositories('test', func)
+    self.assertEqual(4, max_active[0])
+    self.assertFalse(os.path.exists(refresher_state_path()))
+
+  def test_resume(self):
+    refresher = self.make_refresher()
+    visited = []
+    def fail_on_orca(repository):
+      visited.append(repository.name)
+      if repository.name == 'orca':
+        raise RuntimeError('orca failed')
+      return 'ok'
+
+    with self.assertRaises(RuntimeError):
+      refresher.for_all_repositories('test', fail_on_orca)
+    self.assertEqual(set(visited) - set(['orca']),
+                     RefreshState(refresher_state_path()).finished('test'))
+
+    # Resuming only revisits what did not finish.
+    del visited[:]
+    refresher = self.make_refresher('--resume')
+    refresher.for_all_repositories('test', lambda repo: visited.append(
+        repo.name))
+    self.assertEqual(['orca'], visited)
+    self.assertFalse(os.path.exists(refresher_state_path()))
+
+  def test_no_resume_by_default(self):
+    refresher = self.make_refresher()
+    def fail_on_orca(repository):
+      if repository.name == 'orca':
+        raise RuntimeError('orca failed')
+
+    with self.assertRaises(RuntimeError):
+      refresher.for_all_repositories('test', fail_on_orca)
+    self.assertTrue(os.path.exists(refresher_state_path()))
+
+    # Running again without --resume revisits everything.
+    visited = []
+    refresher = self.make_refresher()
+    refresher.for_all_repositories('test', lambda repo: visited.append(
+        repo.name))
+    self.assertIn('orca', visited)
+    self.assertIn('clouddriver', visited)
+    self.assertFalse(os.path.exists(refresher_state_path()))
+
+  def test_shallow_clone(self):
+    self.make_remote('orca', 5)
+    refresher = self.make_refresher('--clone_depth=2')
+    self.assertEqual(
+        'cloned', refresher.git_clone(SourceRepository('orca', 'spinnaker')))
+    self.assertEqual(
+        2, len(self.git('orca', 'log', '--format=%H').split()))
+
+  def test_reference_clone(self):
+    remote = self.make_remote('orca', 3)
+    reference_dir = os.path.join(self.base_dir, 'reference')
+    os.mkdir(reference_dir)
+    subprocess.check_call(['git', 'clone', '-q', '--mirror', remote,
+                           os.path.join(reference_dir, 'orca.git')])
+    refresher = self.make_refresher(
+        '--clone_reference_dir=' + reference_dir)
+    refresher.git_clone(SourceRepository('orca', 'spinnaker'))
+    with open(os.path.join('orca', '.git', 'objects', 'info',
+                           'alternates')) as f:
+      self.assertIn(reference_dir, f.read())
+    self.assertEqual(3, len(self.git('orca', 'log', '--format=%H').split()))
+
+  def test_git_cache_clone(self):
+    self.make_remote('orca', 3)
+    cache_dir = os.path.join(self.base_dir, 'cache')
+    refresher = self.make_refresher('--git_cache_dir=' + cache_dir)
+    refresher.git_clone(SourceRepository('orca', 'spinnaker'))
+    with open(os.path.join('orca', '.git', 'objects', 'info',
+                           'alternates')) as f:
+      self.assertTrue(f.read().startswith(cache_dir))
+    self.assertEqual(3, len(self.git('orca', 'log', '--format=%H').split()))
+
+  def test_git_cache_missing_optional_repository(self):
+    cache_dir = os.path.join(self.base_dir, 'cache')
+    refresher = self.make_refresher('--git_cache_dir=' + cache_dir)
+    self.assertEqual(
+        'missing optional repository',
+        refresher.git_clone(SourceRepository('citest', 'google')))
+    self.assertFalse(os.path.exists('citest'))
+    with self.assertRaises(SystemExit):
+      refresher.git_clone(SourceRepository('orca', 'spinnaker'))
+
+
+def refresher_state_path():
+  return os.path.join(os.getcwd(), '.refresh_source_state.json')
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(RefresherTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
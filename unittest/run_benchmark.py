@@ -0,0 +1,75 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures run_and_monitor throughput.
+
+This is not part of run_tests.sh. Run it directly with
+  PYTHONPATH=../pylib:../dev python run_benchmark.py [megabytes]
+
+It pipes 100 MB (by default) of child output through run_and_monitor,
+once as raw bytes and once as lines with an observer attached. It then
+runs a quiet child to show that waiting on it does not consume CPU.
+"""
+
+import resource
+import sys
+import time
+
+from spinnaker.run import run_and_monitor
+
+
+def measure(title, command, expect_bytes, **kwargs):
+  """Run the command and report its wall and CPU time in this process."""
+  before = resource.getrusage(resource.RUSAGE_SELF)
+  start = time.time()
+  result = run_and_monitor(command, echo=False, **kwargs)
+  wall_secs = time.time() - start
+  after = resource.getrusage(resource.RUSAGE_SELF)
+  cpu_secs = ((after.ru_utime - before.ru_utime)
+              + (after.ru_stime - before.ru_stime))
+
+  if result.returncode != 0 or len(result.stdout) != expect_bytes:
+    raise RuntimeError('{0} got {1} bytes, expected {2}'.format(
+        title, len(result.stdout), expect_bytes))
+
+  megabytes = expect_bytes / float(1024 * 1024)
+  print '{title:<24} {wall:>8.2f}s wall {cpu:>8.2f}s cpu {rate:>10.1f} MB/s'.format(
+      title=title, wall=wall_secs, cpu=cpu_secs,
+      rate=megabytes / wall_secs if megabytes else 0)
+
+
+def main():
+  megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+  num_bytes = megabytes * 1024 * 1024
+
+  measure('raw bytes', 'head -c {0} /dev/zero'.format(num_bytes), num_bytes)
+
+  line = 'x' * 79 + '\n'
+  num_lines = num_bytes / len(line)
+  observed = [0]
+  def count_lines(lines):
+    observed[0] += len(lines)
+  measure('lines with observer',
+          'yes {0} | head -n {1}'.format(line[:-1], num_lines),
+          num_lines * len(line), observe_stdout=count_lines)
+  if observed[0] != num_lines:
+    raise RuntimeError('Observed {0} lines, expected {1}'.format(
+        observed[0], num_lines))
+
+  measure('idle child for 2s', 'sleep 2', 0)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
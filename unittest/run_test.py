@@ -0,0 +1,94 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import unittest
+
+from spinnaker.run import SpooledRunResult
+from spinnaker.run import run_and_monitor
+from spinnaker.run import run_quick
+
+
+class RunTest(unittest.TestCase):
+  def test_run_and_monitor(self):
+    result = run_and_monitor('echo "Hello"; echo "World" >&2; exit 3',
+                             echo=False)
+    self.assertEqual(3, result.returncode)
+    self.assertEqual('Hello\n', result.stdout)
+    self.assertEqual('World\n', result.stderr)
+
+  def test_run_and_monitor_input(self):
+    result = run_and_monitor('cat', echo=False, input='Hello, World!')
+    self.assertEqual(0, result.returncode)
+    self.assertEqual('Hello, World!', result.stdout)
+    self.assertEqual('', result.stderr)
+
+  def test_run_and_monitor_large_output(self):
+    result = run_and_monitor('head -c 1000000 /dev/zero; echo "done" >&2',
+                             echo=False)
+    self.assertEqual(0, result.returncode)
+    self.assertEqual('\0' * 1000000, result.stdout)
+    self.assertEqual('done\n', result.stderr)
+
+  def test_run_and_monitor_observers(self):
+    stdout_calls = []
+    stderr_calls = []
+    result = run_and_monitor(
+        'printf "a\\nb"; sleep 0.1; printf "c\\nd\\n"; printf "x\\ny" >&2',
+        echo=False,
+        observe_stdout=stdout_calls.append,
+        observe_stderr=stderr_calls.append)
+    self.assertEqual('a\nbc\nd\n', result.stdout)
+    self.assertEqual(['a\n', 'bc\n', 'd\n'], sum(stdout_calls, []))
+    self.assertEqual(['x\n', 'y'], sum(stderr_calls, []))
+    for calls in [stdout_calls, stderr_calls]:
+      self.assertTrue(all(calls))
+
+  def test_run_and_monitor_max_buffer_bytes(self):
+    command = 'for i in $(seq 1 2000); do echo "line $i"; echo "err $i" >&2; done'
+    expect_out = ''.join(['line {0}\n'.format(i) for i in range(1, 2001)])
+    expect_err = ''.join(['err {0}\n'.format(i) for i in range(1, 2001)])
+    result = run_and_monitor(command, echo=False, max_buffer_bytes=100)
+    self.assertEqual(0, result.returncode)
+    self.assertNotIsInstance(result, SpooledRunResult)
+    self.assertEqual(expect_out[-100:], result.stdout)
+    self.assertEqual(expect_err[-100:], result.stderr)
+
+  def test_run_and_monitor_spool_output(self):
+    result = run_and_monitor('head -c 500000 /dev/zero; echo "done" >&2',
+                             echo=False, max_buffer_bytes=1024,
+                             spool_output=True)
+    try:
+      self.assertIsInstance(result, SpooledRunResult)
+      self.assertEqual(0, result.returncode)
+      self.assertEqual('\0' * 1024, result.stdout)
+      self.assertEqual('done\n', result.stderr)
+      self.assertEqual('\0' * 500000, result.read_stdout())
+      self.assertEqual('\0' * 500000, result.read_stdout())
+      self.assertEqual('done\n', result.stderr_file.read())
+    finally:
+      result.close()
+
+  def test_run_quick(self):
+    result = run_quick('echo "Hello"; echo "World" >&2', echo=False)
+    self.assertEqual(0, result.returncode)
+    self.assertEqual('Hello\nWorld\n', result.stdout)
+    self.assertIsNone(result.stderr)
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(RunTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -0,0 +1,130 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import BaseHTTPServer
+import SocketServer
+import socket
+import sys
+import threading
+import unittest
+
+from validate_bom__test import ForwardedPort
+from validate_bom__test import ServiceHealthProbe
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Counts the health checks, failing the first few."""
+  daemon_threads = True
+
+  def __init__(self, num_unavailable=0, status=200):
+    BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0), StandInHandler)
+    self.lock = threading.Lock()
+    self.num_requests = 0
+    self.num_unavailable = num_unavailable
+    self.status = status
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    with self.server.lock:
+      self.server.num_requests += 1
+      unavailable = self.server.num_requests <= self.server.num_unavailable
+    if unavailable:
+      # Look like the service is not listening yet.
+      self.connection.shutdown(socket.SHUT_RDWR)
+      return
+    self.send_response(self.server.status)
+    self.send_header('Content-Length', '2')
+    self.end_headers()
+    self.wfile.write('OK')
+
+
+class StandInChild(object):
+  """Stands in for the port forwarding process."""
+  def __init__(self):
+    self.returncode = None
+
+  def poll(self):
+    return self.returncode
+
+
+class ServiceHealthProbeTest(unittest.TestCase):
+  def setUp(self):
+    self.server = None
+
+  def tearDown(self):
+    if self.server:
+      self.server.shutdown()
+      self.server.server_close()
+
+  def start_server(self, **kwargs):
+    self.server = StandInServer(**kwargs)
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return ForwardedPort(StandInChild(), self.server.server_address[1])
+
+  def test_waiters_share_probe(self):
+    forwarding = self.start_server(num_unavailable=2)
+    probe = ServiceHealthProbe('gate', forwarding, interval_secs=0.1)
+    errors = []
+    def wait():
+      try:
+        probe.wait(10)
+      except Exception as ex:
+        errors.append(ex)
+    threads = [threading.Thread(target=wait) for _ in range(20)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual([], errors)
+    self.assertTrue(probe.is_ready)
+    self.assertEqual(3, self.server.num_requests)
+
+    # Once ready, waiting does not probe again.
+    probe.wait(10)
+    self.assertEqual(3, self.server.num_requests)
+
+  def test_unhealthy_is_ready(self):
+    forwarding = self.start_server(status=503)
+    probe = ServiceHealthProbe('gate', forwarding, interval_secs=0.1)
+    probe.wait(10)
+    self.assertTrue(probe.is_ready)
+
+  def test_closed_tunnel(self):
+    forwarding = self.start_server()
+    forwarding.child.returncode = 1
+    probe = ServiceHealthProbe('gate', forwarding, interval_secs=0.1)
+    with self.assertRaises(RuntimeError):
+      probe.wait(10)
+    self.assertFalse(probe.is_ready)
+    self.assertEqual(0, self.server.num_requests)
+
+  def test_timeout(self):
+    forwarding = self.start_server(num_unavailable=1000)
+    probe = ServiceHealthProbe('gate', forwarding, interval_secs=0.1)
+    with self.assertRaises(Exception):
+      probe.wait(1.5)
+    self.assertFalse(probe.is_ready)
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(ServiceHealthProbeTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -15,10 +15,14 @@
 # limitations under the License.
 
 import argparse
+import shutil
+import subprocess
 import sys
+import tempfile
 import unittest
 
-from annotate_source import Annotator, CommitTag, VersionBump
+from annotate_source import Annotator, CommitMessage, CommitTag, VersionBump
+from annotate_source import iter_commit_messages
 
 global OPTIONS # argparse Namespace
 
@@ -154,6 +158,49 @@ class SourceAnnotatorTest(unittest.TestCase):
     result = annotator.bump_semver(self.PREV_VERSION, commit_hashes, commit_msgs)
     self.assertEqual(expect, result)
 
+  def test_stops_at_breaking_change(self):
+    expect = VersionBump('version-2.0.0', 'head', major=True)
+    annotator = Annotator(OPTIONS)
+    consumed = []
+    def commits():
+      for hash, msg in [('a', 'fix(stuff): More stuff.'),
+                        ('b', 'feat(x): New.\n\nBREAKING CHANGE: Oops.'),
+                        ('c', 'feat(y): Never read.')]:
+        consumed.append(hash)
+        yield CommitMessage(hash, msg)
+
+    result = annotator.bump_semver_from_commits(
+        self.PREV_VERSION, commits(), 'head')
+    self.assertEqual(expect, result)
+    self.assertEqual(['a', 'b'], consumed)
+
+  def test_iter_commit_messages(self):
+    path = tempfile.mkdtemp()
+    try:
+      def git(*args):
+        return subprocess.check_output(
+            ['git', '-C', path, '-c', 'user.name=test',
+             '-c', 'user.email=test@test.com'] + list(args))
+      git('init', '-q')
+      for msg in ['first', 'fix(a): Second.', 'feat(b): Third.\n\nDetails.']:
+        git('commit', '-q', '--allow-empty', '-m', msg)
+      hashes = git('log', '--format=%H').split()
+
+      commits = list(iter_commit_messages(path, hashes[2] + '..HEAD'))
+      self.assertEqual(hashes[:2], [commit.hash for commit in commits])
+      self.assertEqual(['feat(b): Third.\n\nDetails.\n', 'fix(a): Second.\n'],
+                       [commit.msg for commit in commits])
+
+      # Stopping early does not wait for git to finish.
+      commits = iter_commit_messages(path, 'HEAD')
+      self.assertEqual(hashes[0], next(commits).hash)
+      commits.close()
+
+      with self.assertRaises(IOError):
+        list(iter_commit_messages(path, 'nosuchref..HEAD'))
+    finally:
+      shutil.rmtree(path)
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   Annotator.init_argument_parser(parser)
@@ -0,0 +1,112 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import unittest
+
+from spinnaker.readiness_probe import HealthProbe
+from spinnaker.spinnaker_runner import Runner
+
+
+class FakeRunner(Runner):
+  """A Runner whose subsystems become healthy after a delay."""
+
+  def __init__(self, delays, disabled=None):
+    # Skip the base constructor since there is no configuration to load.
+    self.delays = delays
+    self.disabled = disabled or []
+    self.started = []
+    self.__ready_at = {}
+
+  def is_subsystem_enabled(self, subsystem):
+    return subsystem not in self.disabled
+
+  def maybe_start_job(self, jobs, subsystem):
+    self.started.append(subsystem)
+    self.__ready_at[subsystem] = time.time() + self.delays.get(subsystem, 0)
+    return os.getpid()
+
+  def make_health_probe(self, subsystem, pid, deadline_secs=None):
+    def fetch(url, timeout):
+      if time.time() < self.__ready_at[subsystem]:
+        return None, ''
+      return 200, '{"status": "UP"}'
+
+    probe = HealthProbe(subsystem, 'http://localhost/health', pid=pid,
+                        deadline_secs=deadline_secs, max_backoff_secs=0.05,
+                        fetch=fetch)
+    return probe, None
+
+
+class SpinnakerRunnerTest(unittest.TestCase):
+  def test_dependents_start_once_dependencies_are_up(self):
+    runner = FakeRunner({'clouddriver': 0.3, 'orca': 1.0})
+    ready = runner.start_and_wait_for_subsystems(
+        {}, Runner.INDEPENDENT_SUBSYSTEM_LIST + ['fiat', 'igor', 'gate'],
+        show_log_while_waiting=False)
+
+    self.assertEqual(
+        sorted(Runner.INDEPENDENT_SUBSYSTEM_LIST + ['fiat', 'igor', 'gate']),
+        sorted(ready.keys()))
+    # Independent subsystems are all started together up front.
+    self.assertEqual(sorted(Runner.INDEPENDENT_SUBSYSTEM_LIST),
+                     sorted(runner.started[:5]))
+    self.assertEqual('gate', runner.started[-1])
+
+    # fiat and igor need not wait for the slow orca.
+    self.assertLess(ready['fiat'], ready['orca'])
+    self.assertLess(ready['igor'], ready['orca'])
+    self.assertGreaterEqual(ready['fiat'], ready['clouddriver'])
+    self.assertGreaterEqual(ready['gate'], max(ready['orca'], ready['fiat']))
+
+  def test_unstarted_dependencies_are_ignored(self):
+    runner = FakeRunner({})
+    ready = runner.start_and_wait_for_subsystems(
+        {}, ['echo', 'gate'], show_log_while_waiting=False)
+    self.assertEqual(['echo', 'gate'], runner.started)
+    self.assertEqual(set(['echo', 'gate']), set(ready.keys()))
+
+  def test_disabled_dependencies_are_ignored(self):
+    runner = FakeRunner({'clouddriver': 1.0}, disabled=['clouddriver'])
+    ready = runner.start_and_wait_for_subsystems(
+        {}, ['clouddriver', 'front50', 'fiat'], show_log_while_waiting=False)
+    self.assertLess(ready['fiat'], ready['clouddriver'])
+
+  def test_dead_subsystem_fails(self):
+    class DeadRunner(FakeRunner):
+      def maybe_start_job(self, jobs, subsystem):
+        super(DeadRunner, self).maybe_start_job(jobs, subsystem)
+        return 0x7ffffff0  # Not a running process.
+
+    runner = DeadRunner({'echo': 60})
+    with self.assertRaises(SystemExit):
+      runner.start_and_wait_for_subsystems(
+          {}, ['echo'], show_log_while_waiting=False)
+
+  def test_deadline(self):
+    runner = FakeRunner({'echo': 60})
+    with self.assertRaises(SystemExit):
+      runner.start_and_wait_for_subsystems(
+          {}, ['echo', 'gate'], show_log_while_waiting=False,
+          deadline_secs=0.2)
+    self.assertEqual(['echo'], runner.started)
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(SpinnakerRunnerTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -0,0 +1,161 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from spinnaker.run import run_quick
+
+from ssh_connection import SshConnectionManager
+
+
+# Stands in for ssh by running remote commands locally. The master is
+# simulated by creating the control socket path as a plain file.
+FAKE_SSH = """#!/bin/sh
+echo "$@" >> "$FAKE_SSH_LOG"
+control=""
+operation=""
+master=no
+previous=""
+for arg in "$@"; do
+  case "$previous" in
+    -o) case "$arg" in
+          ControlPath=*) control="${arg#ControlPath=}";;
+          ControlMaster=yes) master=yes;;
+        esac;;
+    -O) operation="$arg";;
+  esac
+  previous="$arg"
+done
+eval "last=\\${$#}"
+case "$operation" in
+  check) test -e "$control"; exit $?;;
+  forward) exit 0;;
+  exit) rm -f "$control"; exit 0;;
+esac
+if [ $master = yes ]; then
+  if [ -n "$FAKE_SSH_UNREACHABLE" ]; then exit 255; fi
+  touch "$control"
+  exit 0
+fi
+case "$last" in
+  *@*) exit 0;;
+  *) exec sh -c "$last";;
+esac
+"""
+
+
+class SshConnectionManagerTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    bin_dir = os.path.join(self.temp_dir, 'bin')
+    os.makedirs(bin_dir)
+    ssh_path = os.path.join(bin_dir, 'ssh')
+    with open(ssh_path, 'w') as f:
+      f.write(FAKE_SSH)
+    os.chmod(ssh_path, 0755)
+    self.log_path = os.path.join(self.temp_dir, 'ssh.log')
+    self.saved_environ = dict(os.environ)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ['FAKE_SSH_LOG'] = self.log_path
+    self.connection = SshConnectionManager(
+        'tester', 'host', '/tmp/key path',
+        control_dir=os.path.join(self.temp_dir, 'control'))
+    os.makedirs(os.path.join(self.temp_dir, 'control'))
+
+  def tearDown(self):
+    os.environ.clear()
+    os.environ.update(self.saved_environ)
+    shutil.rmtree(self.temp_dir)
+
+  def read_log(self):
+    if not os.path.exists(self.log_path):
+      return []
+    with open(self.log_path, 'r') as f:
+      return f.read().splitlines()
+
+  def test_commands_share_master(self):
+    command = self.connection.make_ssh_command('exit 0')
+    self.assertIn('-o ControlMaster=no', command)
+    self.assertIn(
+        '-o ControlPath={0}'.format(self.connection.control_path), command)
+    self.assertIn("-i '/tmp/key path'", command)
+    self.assertTrue(command.endswith("tester@host 'exit 0'"))
+
+  def test_ensure_master(self):
+    self.assertTrue(self.connection.ensure_master())
+    self.assertTrue(self.connection.ensure_master())
+    masters = [line for line in self.read_log()
+               if 'ControlMaster=yes' in line]
+    self.assertEqual(1, len(masters))
+
+    self.connection.close()
+    self.assertFalse(os.path.exists(self.connection.control_path))
+
+  def test_ensure_master_unreachable(self):
+    os.environ['FAKE_SSH_UNREACHABLE'] = 'true'
+    self.assertFalse(self.connection.ensure_master())
+
+  def test_fetch_files(self):
+    remote_dir = os.path.join(self.temp_dir, 'remote')
+    local_dir = os.path.join(self.temp_dir, 'local')
+    os.makedirs(local_dir)
+    for service in ['gate', 'orca']:
+      os.makedirs(os.path.join(remote_dir, service))
+      with open(os.path.join(remote_dir, service, service + '.log'), 'w') as f:
+        f.write('{0} log\n'.format(service))
+
+    command = self.connection.make_fetch_files_command(
+        [os.path.join(remote_dir, service, service + '.log')
+         for service in ['gate', 'missing', 'orca']],
+        local_dir)
+    result = run_quick(command, echo=False)
+    self.assertEqual(0, result.returncode, result.stdout)
+    self.assertEqual(['gate.log', 'orca.log'], sorted(os.listdir(local_dir)))
+    with open(os.path.join(local_dir, 'gate.log'), 'r') as f:
+      self.assertEqual('gate log\n', f.read())
+
+    # Everything came back over a single connection.
+    self.assertEqual(1, len(self.read_log()))
+
+  def test_port_forward(self):
+    command = self.connection.make_port_forward_command(
+        1234, 8084, check_interval_secs=0.1)
+    child = subprocess.Popen(command)
+    try:
+      while not any(['-O forward' in line for line in self.read_log()]):
+        self.assertIsNone(child.poll())
+        time.sleep(0.01)
+      self.assertIn('-L 1234:localhost:8084',
+                    [line for line in self.read_log()
+                     if '-O forward' in line][0])
+
+      # The forward goes away with the master.
+      os.remove(self.connection.control_path)
+      self.assertEqual(0, child.wait())
+    finally:
+      if child.poll() is None:
+        child.kill()
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(SshConnectionManagerTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
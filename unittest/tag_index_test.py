@@ -0,0 +1,109 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from annotate_source import Annotator
+from tag_index import TagIndex
+
+
+class TagIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.git('init', '-q')
+    self.git('commit', '-q', '--allow-empty', '-m', 'first')
+    self.first = self.git('rev-parse', 'HEAD').strip()
+    self.git('commit', '-q', '--allow-empty', '-m', 'second')
+    self.second = self.git('rev-parse', 'HEAD').strip()
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def git(self, *args):
+    return subprocess.check_output(
+        ['git', '-C', self.path, '-c', 'user.name=test',
+         '-c', 'user.email=test@test.com'] + list(args))
+
+  def show_ref_tags(self):
+    tags = {}
+    for line in self.git('show-ref', '--tags').splitlines():
+      hash, ref = line.split(' ')
+      tags[ref[len('refs/tags/'):]] = hash
+    return tags
+
+  def test_packed_and_loose(self):
+    self.git('tag', 'version-1.9.0', self.first)
+    self.git('tag', '-a', '-m', 'annotated', 'v1.0.0', self.first)
+    self.git('pack-refs', '--all')
+    self.git('tag', 'version-1.10.0', self.second)
+    self.git('tag', 'nested/name', self.second)
+    # A loose ref overriding a packed one.
+    self.git('tag', '-f', 'version-1.9.0', self.second)
+
+    index = TagIndex(self.path)
+    self.assertEqual(self.show_ref_tags(), index.tags)
+    self.assertEqual(self.second, index.tags['version-1.9.0'])
+
+  def test_partition(self):
+    for tag in ['version-1.9.0', 'version-1.10.0', 'version-1.2.3',
+                'v2.0.0', '1.10.0-15']:
+      self.git('tag', tag)
+    index = TagIndex(self.path)
+    matching, other = index.partition(Annotator.TAG_MATCHER)
+    self.assertEqual(['version-1.10.0', 'version-1.9.0', 'version-1.2.3'],
+                     [tag for tag, _ in matching])
+    self.assertEqual(['1.10.0-15', 'v2.0.0'], [tag for tag, _ in other])
+
+  def test_semver(self):
+    self.assertEqual((1, 10, 0), TagIndex.semver('version-1.10.0'))
+    self.assertEqual((12, 0, 3), TagIndex.semver('v12.0.3'))
+    self.assertIsNone(TagIndex.semver('release'))
+
+  def test_delete_tags(self):
+    names = ['t{0}'.format(i) for i in range(200)]
+    for name in names:
+      self.git('tag', name)
+    self.git('pack-refs', '--all')
+    self.git('tag', 'loose')
+    self.git('tag', 'keep')
+
+    index = TagIndex(self.path)
+    index.delete_tags(names + ['loose'])
+    self.assertEqual({'keep': self.second}, index.tags)
+    self.assertEqual({'keep': self.second}, self.show_ref_tags())
+
+    with self.assertRaises(IOError):
+      index.delete_tags(['bad..name'])
+
+  def test_worktree(self):
+    self.git('tag', 'version-1.0.0')
+    worktree = tempfile.mkdtemp()
+    try:
+      shutil.rmtree(worktree)
+      self.git('worktree', 'add', '-q', worktree, self.first)
+      self.assertEqual({'version-1.0.0': self.second},
+                       TagIndex(worktree).tags)
+    finally:
+      shutil.rmtree(worktree)
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(TagIndexTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
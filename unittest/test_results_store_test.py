@@ -0,0 +1,104 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from test_results_store import FAILED
+from test_results_store import PASSED
+from test_results_store import SKIPPED
+from test_results_store import TestResultsStore
+from test_results_store import format_summaries
+from test_results_store import load_records
+from test_results_store import percentile
+from test_results_store import summarize_tests
+
+
+class TestResultsStoreTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_dir, 'results.jsonl')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def record_runs(self, outcomes_by_test):
+    """Record one run per position in the lists of (outcome, secs)."""
+    num_runs = len(outcomes_by_test.values()[0])
+    for index in range(num_runs):
+      store = TestResultsStore(self.path, run_id='run{0:02d}'.format(index),
+                               labels={'version': '1.{0}'.format(index)})
+      for test, outcomes in outcomes_by_test.items():
+        outcome, secs = outcomes[index]
+        store.record(test, outcome, queue_wait_secs=1.5,
+                     semaphore_wait_secs=1.0, quota_wait_secs=0.5,
+                     execution_secs=secs, exit_code=0 if outcome == PASSED
+                     else 1, log_path='/logs/{0}.log'.format(test))
+
+  def test_record(self):
+    self.record_runs({'smoke': [(PASSED, 10)], 'bake': [(SKIPPED, None)]})
+    records = sorted(load_records(self.path), key=lambda entry: entry['test'])
+    self.assertEqual(['bake', 'smoke'], [entry['test'] for entry in records])
+    smoke = records[1]
+    self.assertEqual('run00', smoke['run'])
+    self.assertEqual('1.0', smoke['version'])
+    self.assertEqual(PASSED, smoke['outcome'])
+    self.assertEqual(10, smoke['execution_secs'])
+    self.assertEqual(1.0, smoke['semaphore_wait_secs'])
+    self.assertEqual(0.5, smoke['quota_wait_secs'])
+    self.assertEqual(0, smoke['exit_code'])
+    self.assertEqual('/logs/smoke.log', smoke['log_path'])
+
+  def test_percentile(self):
+    self.assertIsNone(percentile([], 50))
+    self.assertEqual(2, percentile([4, 1, 3, 2], 50))
+    self.assertEqual(4, percentile([4, 1, 3, 2], 95))
+    self.assertEqual(5, percentile([5], 95))
+
+  def test_summarize(self):
+    self.record_runs({
+        'steady': [(PASSED, 10), (PASSED, 10), (PASSED, 20), (PASSED, 20)],
+        'flaky': [(PASSED, 5), (FAILED, 1), (PASSED, 5), (FAILED, 1)],
+        'skipped': [(SKIPPED, None)] * 4})
+    summaries = dict([(summary['test'], summary)
+                      for summary in summarize_tests(load_records(self.path),
+                                                     num_runs=2)])
+    self.assertEqual(['flaky', 'steady'], sorted(summaries.keys()))
+
+    steady = summaries['steady']
+    self.assertEqual(2, steady['runs'])
+    self.assertEqual(0, steady['failures'])
+    self.assertEqual(20, steady['p50_secs'])
+    self.assertEqual(10, steady['previous_p50_secs'])
+    self.assertEqual(0.0, steady['flakiness'])
+
+    flaky = summaries['flaky']
+    self.assertEqual(1, flaky['failures'])
+    self.assertEqual(5, flaky['p95_secs'])
+    self.assertEqual(1, flaky['flips'])
+    self.assertEqual(1.0, flaky['flakiness'])
+
+    table = format_summaries(summarize_tests(load_records(self.path),
+                                             num_runs=2))
+    self.assertIn('+100%', table.split('\n')[2])
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(TestResultsStoreTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
@@ -0,0 +1,114 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import sys
+import threading
+import time
+import unittest
+
+from tunnel_supervisor import TunnelSupervisor
+
+
+def wait_until(predicate, timeout=10):
+  end_time = time.time() + timeout
+  while not predicate():
+    if time.time() > end_time:
+      return False
+    time.sleep(0.01)
+  return True
+
+
+class TunnelSupervisorTest(unittest.TestCase):
+  def setUp(self):
+    self.supervisor = None
+
+  def tearDown(self):
+    if self.supervisor:
+      self.supervisor.stop()
+
+  def test_restarts_dead_tunnel(self):
+    self.supervisor = TunnelSupervisor(check_interval_secs=0.05,
+                                       keepalive_interval_secs=0)
+    tunnel = self.supervisor.add('gate', ['sleep', '60'], 1234)
+    first = tunnel.process
+    first.kill()
+    self.assertTrue(wait_until(lambda: tunnel.process is not first))
+    self.assertIsNone(tunnel.poll())
+    self.assertIsNone(tunnel.process.poll())
+    self.assertEqual(1, tunnel.resets)
+    self.assertEqual('Tunnel resets: gate=1', self.supervisor.report())
+
+  def test_gives_up(self):
+    self.supervisor = TunnelSupervisor(check_interval_secs=0.01,
+                                       keepalive_interval_secs=0,
+                                       max_resets=3)
+    tunnel = self.supervisor.add('gate', ['sh', '-c', 'exit 3'], 1234)
+    self.assertTrue(wait_until(lambda: tunnel.poll() is not None))
+    self.assertEqual(3, tunnel.poll())
+    self.assertEqual(3, tunnel.resets)
+
+  def test_kill(self):
+    self.supervisor = TunnelSupervisor(check_interval_secs=0.01,
+                                       keepalive_interval_secs=0)
+    tunnel = self.supervisor.add('gate', ['sleep', '60'], 1234)
+    process = tunnel.process
+    tunnel.kill()
+    self.assertIsNotNone(tunnel.poll())
+    self.assertIsNotNone(process.poll())
+    time.sleep(0.1)
+    self.assertIs(process, tunnel.process)
+    self.assertEqual(0, tunnel.resets)
+
+  def test_stop_joins_watcher(self):
+    num_threads = threading.active_count()
+    supervisor = TunnelSupervisor(check_interval_secs=0.01,
+                                  keepalive_interval_secs=0)
+    supervisor.add('gate', ['sleep', '60'], 1234)
+    self.assertEqual(num_threads + 1, threading.active_count())
+    supervisor.stop()
+    self.assertEqual(num_threads, threading.active_count())
+
+  def test_keepalive(self):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('localhost', 0))
+    server.listen(5)
+    accepted = []
+    def accept():
+      while True:
+        try:
+          connection, _ = server.accept()
+        except socket.error:
+          return
+        accepted.append(connection)
+        connection.close()
+    thread = threading.Thread(target=accept)
+    thread.daemon = True
+    thread.start()
+
+    self.supervisor = TunnelSupervisor(check_interval_secs=0.01,
+                                       keepalive_interval_secs=0.05)
+    try:
+      self.supervisor.add('gate', ['sleep', '60'], server.getsockname()[1])
+      self.supervisor.add('orca', ['sleep', '60'], server.getsockname()[1])
+      self.assertTrue(wait_until(lambda: len(accepted) >= 4))
+    finally:
+      server.close()
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(TunnelSupervisorTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
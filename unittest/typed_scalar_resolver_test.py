@@ -0,0 +1,110 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import unittest
+import yaml
+
+from spinnaker.yaml_util import TypedScalarResolver
+
+
+# Text values as they might appear in environment variables or defaults.
+EQUIVALENCE_CASES = [
+    '', '~', 'null', 'Null', 'NULL',
+    'true', 'True', 'TRUE', 'false', 'False', 'yes', 'No', 'on', 'OFF',
+    '0', '123', '-321', '+12', '0x1F', '0o17', '017', '0b101', '1_000',
+    '190:20:30', '1.5', '-1.5', '.5', '1e3', '1.0e+3', '.inf', '-.Inf',
+    '.nan', '1_000.5', '2017-01-31', '2017-01-31T12:30:45Z',
+    '2017-01-31 12:30:45.5 -08:00',
+    'hello', 'Hello World', 'a.b.c', 'http://localhost:8084',
+    'localhost:7002', 'a:b', '-x', ':x', '?x', 'a,b', 'a[0]', 'a#b',
+    '/home/spinnaker/.spinnaker', 'us-central1-f', '${nested}', '$HOME',
+    'a b  c', 'C:\\Temp', "it's", 'say "hi"', '=', '<<',
+    "'quoted'", '"double quoted"', '"escaped\\ttab"', 'a # comment',
+    '[a, b]', '{a: 1}', '- x', '-', '*', '&anchor value', '!!str 123',
+    '|', '>', '@x', '`x', '%x', ' padded ', 'trailing:', 'key: value',
+    '\tindented', 'true\n', 'abc\n', '12\n', 'abc\r'
+]
+
+
+def load_value(text):
+  return yaml.load('x: {0}'.format(text), Loader=yaml.Loader)['x']
+
+
+def outcome(func, text):
+  """Returns the type and value from func(text), or the error it raised."""
+  try:
+    value = func(text)
+  except yaml.YAMLError as ex:
+    return ex.__class__, None
+  return type(value), value
+
+
+class TypedScalarResolverTest(unittest.TestCase):
+  def test_equivalent_to_loader(self):
+    resolver = TypedScalarResolver()
+    for text in EQUIVALENCE_CASES:
+      self.assertEqual(outcome(load_value, text), outcome(resolver, text),
+                       'Mismatch on {0!r}'.format(text))
+
+  def test_equivalent_when_cached(self):
+    resolver = TypedScalarResolver()
+    for text in EQUIVALENCE_CASES:
+      outcome(resolver, text)
+    for text in EQUIVALENCE_CASES:
+      self.assertEqual(outcome(load_value, text), outcome(resolver, text),
+                       'Mismatch on {0!r}'.format(text))
+
+  def test_non_ascii(self):
+    resolver = TypedScalarResolver()
+    text = u'caf\u00e9'.encode('utf-8')
+    self.assertEqual(load_value(text), resolver(text))
+
+  def test_lru_eviction(self):
+    # Quoted values need the parser, so count how often it is called.
+    loaded = []
+    original_load = yaml.load
+    def counting_load(*args, **kwargs):
+      loaded.append(args[0])
+      return original_load(*args, **kwargs)
+
+    resolver = TypedScalarResolver(capacity=2)
+    yaml.load = counting_load
+    try:
+      self.assertEqual('1', resolver("'1'"))
+      self.assertEqual('2', resolver("'2'"))
+      self.assertEqual('1', resolver("'1'"))
+      self.assertEqual(2, len(loaded))
+
+      # '2' is the least recently used so is evicted to make room.
+      self.assertEqual('3', resolver("'3'"))
+      self.assertEqual('1', resolver("'1'"))
+      self.assertEqual(3, len(loaded))
+      self.assertEqual('2', resolver("'2'"))
+      self.assertEqual(["x: '1'", "x: '2'", "x: '3'", "x: '2'"], loaded)
+    finally:
+      yaml.load = original_load
+
+  def test_containers_not_shared(self):
+    resolver = TypedScalarResolver()
+    first = resolver('[a, b]')
+    first.append('c')
+    self.assertEqual(['a', 'b'], resolver('[a, b]'))
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = loader.loadTestsFromTestCase(TypedScalarResolverTest)
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
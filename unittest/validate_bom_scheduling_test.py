@@ -0,0 +1,134 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import sys
+import threading
+import time
+import unittest
+
+from validate_bom__test import TEST_CONCURRENCY_QUOTA
+from validate_bom__test import RunnableTest
+from validate_bom__test import estimate_makespan
+from validate_bom__test import make_test_quota_tracker
+from validate_bom__test import request_test_quota
+from validate_bom__test import run_granted_tests
+
+
+def make_test(name, estimate, quota=None):
+  return RunnableTest(name, ['true'], quota or {}, estimate)
+
+
+class TestQuotaTrackerTest(unittest.TestCase):
+  def setUp(self):
+    logging.disable(logging.WARNING)
+
+  def tearDown(self):
+    logging.disable(logging.NOTSET)
+
+  def test_respects_concurrency(self):
+    tracker = make_test_quota_tracker({}, 2)
+    requests = [request_test_quota(tracker, test)
+                for test in [make_test('a', 30), make_test('b', 20),
+                             make_test('c', 10)]]
+    self.assertEqual([{TEST_CONCURRENCY_QUOTA: 1}] * 2 + [None],
+                     [request.granted for request in requests])
+    tracker.release_all_safe('a', requests[0].granted)
+    self.assertEqual({TEST_CONCURRENCY_QUOTA: 1}, requests[2].granted)
+    self.assertGreater(requests[2].waited[TEST_CONCURRENCY_QUOTA], 0)
+
+  def test_backfill_does_not_take_reserved_quota(self):
+    tracker = make_test_quota_tracker({'google': 2, 'aws': 1}, 10)
+    running = request_test_quota(tracker, make_test('running', 40,
+                                                    {'google': 1}))
+    big, small, other = [
+        request_test_quota(tracker, test)
+        for test in [make_test('big', 30, {'google': 2}),
+                     make_test('small', 10, {'google': 1}),
+                     make_test('other', 5, {'aws': 1})]]
+    self.assertIsNone(big.granted)
+    self.assertIsNone(small.granted)
+    self.assertEqual({'aws': 1, TEST_CONCURRENCY_QUOTA: 1}, other.granted)
+
+    tracker.release_all_safe('running', running.granted)
+    self.assertEqual({'google': 2, TEST_CONCURRENCY_QUOTA: 1}, big.granted)
+    self.assertIsNone(small.granted)
+    self.assertEqual(['google'], big.waited.keys())
+
+  def test_report(self):
+    tracker = make_test_quota_tracker({'google': 1}, 2)
+    self.assertEqual('No quota requests.', tracker.report())
+    request_test_quota(tracker, make_test('a', 10, {'google': 1}))
+    self.assertEqual(
+        'Quota waits: google=0/1 (total 0.0s, max 0.0s),'
+        ' test_concurrency=0/1 (total 0.0s, max 0.0s)',
+        tracker.report())
+
+
+class RunGrantedTestsTest(unittest.TestCase):
+  def setUp(self):
+    logging.disable(logging.WARNING)
+
+  def tearDown(self):
+    logging.disable(logging.NOTSET)
+
+  def test_only_running_tests_have_threads(self):
+    tests = [make_test('test{0}'.format(index), 20 - index,
+                       {'google': 1} if index % 2 else {})
+             for index in range(20)]
+    tracker = make_test_quota_tracker({'google': 1}, 3)
+    lock = threading.Lock()
+    started = []
+    max_threads = [0]
+    base_threads = threading.active_count()
+    def run_test(test, request):
+      with lock:
+        started.append(test.name)
+        max_threads[0] = max(max_threads[0],
+                             threading.active_count() - base_threads)
+      time.sleep(0.01)
+
+    run_granted_tests(tracker, tests, run_test)
+    self.assertEqual(sorted([test.name for test in tests]), sorted(started))
+    self.assertEqual(['test0', 'test1', 'test2'], sorted(started[:3]))
+    self.assertLessEqual(max_threads[0], 3)
+    self.assertEqual(0, tracker.num_waiting)
+
+
+class EstimateMakespanTest(unittest.TestCase):
+  def test_unlimited(self):
+    tests = [make_test('a', 30), make_test('b', 20), make_test('c', 10)]
+    self.assertEqual(30, estimate_makespan(tests, {}, 3))
+
+  def test_concurrency_limit(self):
+    tests = [make_test('a', 30), make_test('b', 20), make_test('c', 10)]
+    # a runs alone while b then c run in the other slot.
+    self.assertEqual(30, estimate_makespan(tests, {}, 2))
+    self.assertEqual(60, estimate_makespan(tests, {}, 1))
+
+  def test_quota_limit(self):
+    tests = [make_test('a', 30, {'google': 1}),
+             make_test('b', 20, {'google': 1}),
+             make_test('c', 10)]
+    self.assertEqual(50, estimate_makespan(tests, {'google': 1}, 3))
+
+
+if __name__ == '__main__':
+  loader = unittest.TestLoader()
+  suite = unittest.TestSuite([
+      loader.loadTestsFromTestCase(TestQuotaTrackerTest),
+      loader.loadTestsFromTestCase(RunGrantedTestsTest),
+      loader.loadTestsFromTestCase(EstimateMakespanTest)])
+  got = unittest.TextTestRunner(verbosity=2).run(suite)
+  sys.exit(len(got.errors) + len(got.failures))
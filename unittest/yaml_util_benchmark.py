@@ -0,0 +1,68 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures YamlBindings lookup cost.
+
+This is not part of run_tests.sh. Run it directly with
+  PYTHONPATH=../pylib:../dev python yaml_util_benchmark.py
+
+For each chain length, it builds a binding whose value is found through
+that many nested ${key} references at increasing depth and reports the
+cost of the first (cold) lookup against the average warm lookup.
+Warm lookups should stay flat as the chain gets longer.
+"""
+
+import sys
+import timeit
+
+from spinnaker.yaml_util import YamlBindings
+
+
+def make_bindings(depth, references):
+  """Build bindings with a chain of references at the given key depth."""
+  prefix = '.'.join(['level{0}'.format(i) for i in range(depth)])
+  bindings = YamlBindings()
+  for index in range(references):
+    key = 'ref{0}'.format(index)
+    value = '${{{0}.ref{1}}}/x'.format(prefix, index + 1)
+    bindings.import_string(make_yaml(depth, key, value))
+  bindings.import_string(
+      make_yaml(depth, 'ref{0}'.format(references), 'leaf'))
+  return bindings, '{0}.ref0'.format(prefix)
+
+
+def make_yaml(depth, key, value):
+  lines = []
+  for i in range(depth):
+    lines.append('{indent}level{i}:'.format(indent='  ' * i, i=i))
+  lines.append('{indent}{key}: "{value}"'.format(
+      indent='  ' * depth, key=key, value=value))
+  return '\n'.join(lines)
+
+
+def main():
+  iterations = 10000
+  print '{0:>6} {1:>6} {2:>14} {3:>14}'.format(
+      'depth', 'refs', 'cold (usec)', 'warm (usec)')
+  for depth, references in [(1, 1), (4, 4), (8, 16), (16, 64)]:
+    bindings, field = make_bindings(depth, references)
+    cold = timeit.timeit(lambda: bindings.get(field), number=1)
+    warm = timeit.timeit(lambda: bindings.get(field), number=iterations)
+    print '{0:>6} {1:>6} {2:>14.2f} {3:>14.2f}'.format(
+        depth, references, cold * 1e6, warm * 1e6 / iterations)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
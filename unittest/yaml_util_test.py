@@ -17,7 +17,10 @@ import sys
 import tempfile
 import unittest
 
+import yaml
+
 from spinnaker.yaml_util import YamlBindings
+from spinnaker.yaml_util import YamlPathIndex
 from spinnaker.yaml_util import yml_or_yaml_path
 
 class YamlUtilTest(unittest.TestCase):
@@ -222,6 +225,29 @@ e:
     with self.assertRaises(ValueError):
       bindings.get('field')
 
+  def test_cached_value_invalidated_on_import(self):
+    bindings = YamlBindings()
+    bindings.import_dict({'field': '${injected.value}'})
+    self.assertEqual('${injected.value}', bindings.get('field'))
+    self.assertIsNone(bindings.get('injected.value'))
+
+    bindings.import_dict({'injected': {'value': 'HELLO'}})
+    self.assertEqual('HELLO', bindings.get('injected.value'))
+    self.assertEqual('HELLO', bindings.get('field'))
+
+    bindings.import_string('injected:\n  value: WORLD')
+    self.assertEqual('WORLD', bindings['field'])
+
+  def test_cyclic_reference_after_warm_lookup(self):
+    bindings = YamlBindings()
+    bindings.import_dict({'field': '${other}', 'other': 'OTHER'})
+    self.assertEqual('OTHER', bindings.get('field'))
+    bindings.import_dict({'other': '${field}'})
+    with self.assertRaises(ValueError):
+      bindings.get('field')
+    with self.assertRaises(ValueError):
+      bindings.get('field')
+
   def test_load_None_strings(self):
     bindings = YamlBindings()
     bindings.import_dict({'a': None, 'b': 'B'})
@@ -307,6 +333,115 @@ unique:
      self.assertEqual(expect, got)
 
 
+  def test_transform_keys(self):
+     bindings = YamlBindings()
+     bindings.import_dict({'a': {'b': {'space': 'WithSpace',
+                                       'empty': 'Empty'},
+                                 'new': {'x': 'X', 'y': 'Y'}},
+                           'top': {'z': 1}})
+     source = """# Leading comment
+a:  # trailing comment
+  b:
+    space: SPACE  # keep me
+    empty:
+    other: unchanged
+"""
+     expect = """top:
+  z: 1
+# Leading comment
+a:  # trailing comment
+  new:
+    x: X
+    y: Y
+  b:
+    space: WithSpace  # keep me
+    empty: Empty
+    other: unchanged
+"""
+     keys = ['a.b.space', 'a.b.empty', 'a.new.x', 'a.new.y', 'top.z', 'bogus']
+     self.assertEqual(expect, bindings.transform_yaml_source_keys(source, keys))
+
+     sequential = source
+     for key in ['a.b.space', 'a.b.empty']:
+       sequential = bindings.transform_yaml_source(sequential, key)
+     self.assertEqual(
+         sequential,
+         bindings.transform_yaml_source_keys(source, ['a.b.space', 'a.b.empty']))
+
+     with self.assertRaises(KeyError):
+       bindings.transform_yaml_source_keys(source, keys, add_new_nodes=False)
+
+  def test_transform_keys_into_empty_value(self):
+     bindings = YamlBindings()
+     bindings.import_dict({'a': {'b': {'x': 'X', 'y': True}}})
+     source = """a:
+  b:
+c: C
+"""
+     expect = """a:
+  b:
+    x: X
+    y: true
+c: C
+"""
+     got = bindings.transform_yaml_source_keys(source, ['a.b.x', 'a.b.y'])
+     self.assertEqual(expect, got)
+
+  def test_path_index(self):
+     source = """a:
+  b:
+    c: C
+  a.dot: ignored
+  d: D
+  d: Duplicate
+"""
+     index = YamlPathIndex(yaml.compose(source))
+     entry = index.get('a.b.c')
+     self.assertEqual('C', source[entry.value_start:entry.value_end])
+     self.assertEqual(4, entry.key_column)
+     self.assertEqual('D', source[index.get('a.d').value_start:
+                                  index.get('a.d').value_end])
+     self.assertIsNone(index.get('a.a.dot'))
+     self.assertEqual((index.get('a.b'), 2),
+                      index.closest(['a', 'b', 'x', 'y']))
+     self.assertEqual((None, 0), index.closest(['x']))
+
+     index.shift(entry.value_end, 3)
+     self.assertEqual('C', source[entry.value_start:entry.value_start + 1])
+     self.assertEqual(entry.value_start + 4, entry.value_end)
+
+  def test_find_yaml_context_into_empty_value(self):
+     bindings = YamlBindings()
+     source = 'a:\n  b:\nc: C\n'
+     context, span = bindings.find_yaml_context(
+         source, yaml.compose(source), 'a.b.x', False)
+     self.assertEqual(('\n    x: ', ''), context)
+     self.assertEqual((7, 7), span)
+
+  def test_transform_reuses_index(self):
+     source = """a:
+  b: B
+  empty:
+  c:
+    d: D
+e: E
+"""
+     keys = ['a.b', 'a.empty', 'a.c.d', 'e', 'a.b', 'a.empty']
+     bindings = YamlBindings()
+     got = source
+     expect = source
+     for index, key in enumerate(keys):
+       update = {'a': {'b': 'Longer' * index, 'empty': index,
+                       'c': {'d': 'x # y'}},
+                 'e': 'X'}
+       bindings.import_dict(update)
+       got = bindings.transform_yaml_source(got, key)
+
+       fresh = YamlBindings()
+       fresh.import_dict(update)
+       expect = fresh.transform_yaml_source(expect, key)
+       self.assertEqual(expect, got)
+
   def test_transform_fail(self):
      bindings = YamlBindings()
      bindings.import_dict({'a': {'b': { 'child': 'Hello, World!'}},
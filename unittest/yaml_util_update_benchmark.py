@@ -0,0 +1,103 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures rewriting many keys in a large yaml source.
+
+This is not part of run_tests.sh. Run it directly with
+  PYTHONPATH=../pylib:../dev python yaml_util_update_benchmark.py
+
+It generates a 2000 line config and updates 200 of its keys three ways:
+  * One key at a time with new bindings for each key, which composes
+    the whole source for every key.
+  * One key at a time through the same bindings, which reuses the path
+    index from the previous edit.
+  * All at once through transform_yaml_source_keys.
+"""
+
+import sys
+import time
+
+from spinnaker.yaml_util import YamlBindings
+
+
+NUM_SECTIONS = 100
+OPTIONS_PER_SECTION = 16
+
+
+def make_source():
+  """Returns a 2000 line yaml source with comments."""
+  lines = []
+  for section in range(NUM_SECTIONS):
+    lines.append('# Settings for service{0}'.format(section))
+    lines.append('service{0}:'.format(section))
+    lines.append('  host: host{0}.example.com  # where it runs'.format(section))
+    lines.append('  options:')
+    for option in range(OPTIONS_PER_SECTION):
+      lines.append('    option{0}: value{1}'.format(option, section))
+  return '\n'.join(lines) + '\n'
+
+
+def make_bindings():
+  """Returns the bindings, update dict, and the 200 keys to update."""
+  update = {}
+  keys = []
+  for section in range(NUM_SECTIONS):
+    name = 'service{0}'.format(section)
+    update[name] = {'host': 'updated{0}.example.com'.format(section),
+                    'options': {'option7': section}}
+    keys.append(name + '.host')
+    keys.append(name + '.options.option7')
+  bindings = YamlBindings()
+  bindings.import_dict(update)
+  return bindings, update, keys
+
+
+def main():
+  source = make_source()
+  bindings, update, keys = make_bindings()
+  print 'Updating {0} keys in {1} lines.'.format(
+      len(keys), source.count('\n'))
+
+  start = time.time()
+  recomposed = source
+  for key in keys:
+    key_bindings = YamlBindings()
+    key_bindings.import_dict(update)
+    recomposed = key_bindings.transform_yaml_source(recomposed, key)
+  recomposed_secs = time.time() - start
+  print 'one key at a time, recomposing: {0:.3f}s'.format(recomposed_secs)
+
+  start = time.time()
+  sequential = source
+  for key in keys:
+    sequential = bindings.transform_yaml_source(sequential, key)
+  sequential_secs = time.time() - start
+  print 'one key at a time, reusing index: {0:.3f}s'.format(sequential_secs)
+
+  start = time.time()
+  batch = YamlBindings()
+  batch.import_dict(update)
+  batch = batch.transform_yaml_source_keys(source, keys)
+  batch_secs = time.time() - start
+  print 'all keys at once: {0:.3f}s'.format(batch_secs)
+
+  if not recomposed == sequential == batch:
+    sys.stderr.write('ERROR: The results differ.\n')
+    return -1
+  print 'Speedup over recomposing: {0:.1f}x'.format(recomposed_secs / batch_secs)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())